@@ -1,9 +1,7 @@
-from io import BytesIO
 from pathlib import Path
 from time import time
 from zipfile import ZipFile, ZIP_DEFLATED
 
-import duckdb
 import geopandas as gp
 import numpy as np
 import pandas as pd
@@ -14,6 +12,7 @@ from analysis.constants import SEVERITY_TO_PASSABILITY, STATES
 from analysis.lib.util import get_signed_dtype, append
 from analysis.rank.lib.networks import get_network_results, get_removed_network_results
 from analysis.rank.lib.metrics import classify_streamorder, classify_spps, classify_annual_flow, classify_cost
+from analysis.post.lib.api_data import create_api_db, create_resident_tables, create_indexes, create_public_shards
 from api.constants import (
     GENERAL_API_FIELDS1,
     UNIT_FIELDS,
@@ -33,6 +32,7 @@ from api.constants import (
 from api.constants import LOGO_PATH
 from api.metadata import get_readme, get_terms
 from api.lib.domains import unpack_domains
+from api.lib.zip import open_zip_entry
 from analysis.constants import NETWORK_TYPES
 
 # NOTE: no need to aggregate stats for full / dams-only networks
@@ -506,34 +506,24 @@ search_barriers.sort_values(by=["priority", "SARPID"]).drop_duplicates(subset="S
 ### Create DuckDB database for much faster barrier lookup by SARPID
 ################################################################################
 
-# NOTE:
-# this uses an index on SARPID, which works because it is highly selective and thus high performance;
-# name and other fields are not indexed because the current indexes in DuckDB
-# are not actually used when querying them (not selective enough), so they are
-# slower than reading directly from the feather files.
-# This excludes waterfalls, which aren't searched via the API (and also would fail unique index below)
-
 print("Creating DuckDB database for faster barrier lookup")
-out_db = api_dir / "api.db"
-if out_db.exists():
-    out_db.unlink()
-
-with duckdb.connect(str(out_db)) as con:
-    for network_type in network_types:
-        print(f"Creating {network_type} table")
-        ds = dataset(api_dir / f"{network_type}.feather", format="feather")
-        _ = con.execute(f"CREATE TABLE {network_type} AS SELECT * from ds")
-        _ = con.execute(f"CREATE UNIQUE INDEX {network_type}_sarpid_index ON {network_type} (SARPID)")
-
-    print("Creating road_crossings table")
-    ds = dataset(api_dir / "road_crossings.feather", format="feather")
-    _ = con.execute("CREATE TABLE road_crossings AS SELECT * from ds")
-    _ = con.execute("CREATE UNIQUE INDEX road_crossings_sarpid_index ON road_crossings (SARPID)")
-
-    print("Creating seach_barriers table")
-    ds = dataset(api_dir / "search_barriers.feather", format="feather")
-    _ = con.execute("CREATE TABLE search_barriers AS SELECT * from ds")
-    _ = con.execute("CREATE UNIQUE INDEX search_barriers_sarpid_index ON search_barriers (SARPID)")
+create_api_db(api_dir, network_types)
+
+################################################################################
+### Create uncompressed Arrow IPC files that can be memory-mapped by the API
+################################################################################
+
+print("Creating uncompressed barrier tables for memory-mapping")
+create_resident_tables(api_dir)
+
+
+################################################################################
+### Create summary unit and spatial indexes, query cubes, and metric ranks for API
+################################################################################
+
+print("Creating summary unit, filter, and spatial indexes, query cubes, metric ranks, and search index")
+create_indexes(api_dir)
+
 
 ################################################################################
 ### Pre-create zip files for national downloads
@@ -576,11 +566,19 @@ for barrier_type in ["dams", "small_barriers", "combined_barriers", "road_crossi
     )
     terms = get_terms()
 
+    # the CSV file is deflated using ZIP_THREADS threads
     with ZipFile(zip_dir / f"{barrier_type}.zip", "w", compression=ZIP_DEFLATED, compresslevel=9) as out:
-        csv_stream = BytesIO()
-        write_csv(df, csv_stream)
-        out.writestr(filename, csv_stream.getvalue())
+        with open_zip_entry(out, filename) as entry:
+            write_csv(df, entry)
 
         out.writestr("README.txt", readme)
         out.writestr("TERMS_OF_USE.txt", terms)
         out.write(LOGO_PATH, "SARP_logo.png")
+
+
+################################################################################
+### Create pre-rendered CSV shards for public state query API
+################################################################################
+
+print("Creating CSV shards for public state query API")
+create_public_shards(api_dir)
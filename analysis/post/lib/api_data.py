@@ -0,0 +1,176 @@
+"""Create the derived files used by the API from the API barrier tables
+(data/api/<barrier_type>.feather, search_barriers.feather).
+
+These are used by aggregate_networks.py and by the synthetic dataset generator
+in benchmarks/generate_data.py, and must be recreated whenever the API barrier
+tables are updated.
+"""
+
+import duckdb
+from pyarrow.dataset import dataset
+from pyarrow.feather import write_feather
+
+from api.constants import (
+    DAM_FILTER_FIELDS,
+    SB_FILTER_FIELDS,
+    COMBINED_FILTER_FIELDS,
+    ROAD_CROSSING_FILTER_FIELDS,
+    DAM_PUBLIC_EXPORT_FIELDS,
+    SB_PUBLIC_EXPORT_FIELDS,
+)
+from api.lib.indexes import (
+    build_unit_index,
+    build_filter_index,
+    build_query_cube,
+    build_metric_ranks,
+    build_search_index,
+    build_spatial_index,
+)
+from api.lib.shards import build_state_shards
+from api.lib.tiers import METRICS
+
+
+# barrier types that have uncompressed copies for memory-mapping
+RESIDENT_TABLE_TYPES = [
+    "dams",
+    "small_barriers",
+    "combined_barriers",
+    "largefish_barriers",
+    "smallfish_barriers",
+    "road_crossings",
+    "waterfalls",
+    "search_barriers",
+]
+
+# filter fields of barrier types that have summary unit and filter indexes
+# and query cubes
+INDEX_FILTER_FIELDS = {
+    "dams": DAM_FILTER_FIELDS,
+    "small_barriers": SB_FILTER_FIELDS,
+    "combined_barriers": COMBINED_FILTER_FIELDS,
+    "largefish_barriers": COMBINED_FILTER_FIELDS,
+    "smallfish_barriers": COMBINED_FILTER_FIELDS,
+    "road_crossings": ROAD_CROSSING_FILTER_FIELDS,
+}
+
+PUBLIC_EXPORT_FIELDS = {"dams": DAM_PUBLIC_EXPORT_FIELDS, "small_barriers": SB_PUBLIC_EXPORT_FIELDS}
+
+
+def create_api_db(api_dir, network_types):
+    """Create DuckDB database for much faster barrier lookup by SARPID.
+
+    NOTE: this uses an index on SARPID, which works because it is highly
+    selective and thus high performance; name and other fields are not indexed
+    because the current indexes in DuckDB are not actually used when querying
+    them (not selective enough), so they are slower than reading directly from
+    the feather files.  This excludes waterfalls, which aren't searched via the
+    API (and also would fail unique index below).
+
+    Parameters
+    ----------
+    api_dir : Path
+    network_types : list-like of str
+        barrier types with networks, e.g., "dams", "combined_barriers"
+    """
+    out_db = api_dir / "api.db"
+    if out_db.exists():
+        out_db.unlink()
+
+    with duckdb.connect(str(out_db)) as con:
+        for table in list(network_types) + ["road_crossings", "search_barriers"]:
+            print(f"Creating {table} table")
+            ds = dataset(api_dir / f"{table}.feather", format="feather")  # noqa: F841
+            _ = con.execute(f"CREATE TABLE {table} AS SELECT * from ds")
+            _ = con.execute(f"CREATE UNIQUE INDEX {table}_sarpid_index ON {table} (SARPID)")
+
+
+def create_resident_tables(api_dir):
+    """Create uncompressed Arrow IPC files that can be memory-mapped by the API.
+
+    NOTE: these are only used if RESIDENT_TABLES is set for the API, except for
+    search_barriers, which is always used with the search index.  Each is
+    written as a single record batch so that tables are not split into chunks
+    and can be sliced and indexed without copying.
+
+    Parameters
+    ----------
+    api_dir : Path
+    """
+    mmap_dir = api_dir / "mmap"
+    mmap_dir.mkdir(exist_ok=True)
+
+    for barrier_type in RESIDENT_TABLE_TYPES:
+        df = dataset(api_dir / f"{barrier_type}.feather", format="feather").to_table().combine_chunks()
+        write_feather(df, mmap_dir / f"{barrier_type}.feather", compression="uncompressed", chunksize=max(len(df), 1))
+
+
+def create_indexes(api_dir):
+    """Create summary unit, filter, and spatial indexes, query cubes, metric
+    ranks, and the word index for searching barriers by name.
+
+    NOTE: these map each summary unit id and each value of the filter fields to
+    the positions of rows in the API barrier tables.
+
+    Parameters
+    ----------
+    api_dir : Path
+    """
+    index_dir = api_dir / "indexes"
+    index_dir.mkdir(exist_ok=True)
+
+    for barrier_type, filter_fields in INDEX_FILTER_FIELDS.items():
+        df = dataset(api_dir / f"{barrier_type}.feather", format="feather").to_table().combine_chunks()
+        write_feather(build_unit_index(df), index_dir / f"{barrier_type}_units.feather", compression="uncompressed")
+        write_feather(
+            build_filter_index(df, filter_fields),
+            index_dir / f"{barrier_type}_filters.feather",
+            compression="uncompressed",
+        )
+
+        # query cube fields and ranked records must match those used in
+        # api/internal/barriers/query.py
+        query_fields = filter_fields
+        if barrier_type in ("combined_barriers", "largefish_barriers", "smallfish_barriers"):
+            query_fields = ["BarrierType"] + filter_fields
+
+        write_feather(
+            build_query_cube(df, query_fields, ranked_only=barrier_type != "road_crossings"),
+            index_dir / f"{barrier_type}_cube.feather",
+            compression="uncompressed",
+        )
+
+        # written as a single chunk so that the arrays of the tree can be
+        # memory-mapped without copying
+        spatial_index = build_spatial_index(df)
+        write_feather(
+            spatial_index,
+            index_dir / f"{barrier_type}_spatial.feather",
+            compression="uncompressed",
+            chunksize=max(len(spatial_index), 1),
+        )
+
+        # global ranks of metrics for calculating custom tiers (not applicable to
+        # road crossings)
+        if barrier_type != "road_crossings":
+            write_feather(
+                build_metric_ranks(df, METRICS),
+                index_dir / f"{barrier_type}_ranks.feather",
+                compression="uncompressed",
+            )
+
+    df = dataset(api_dir / "search_barriers.feather", format="feather").to_table(columns=["search_key"])
+    write_feather(build_search_index(df), index_dir / "search_barriers_words.feather", compression="uncompressed")
+
+
+def create_public_shards(api_dir):
+    """Create pre-rendered CSV shards for public state query API.
+
+    NOTE: columns must match those used in api/public/query.py
+
+    Parameters
+    ----------
+    api_dir : Path
+    """
+    for barrier_type, columns in PUBLIC_EXPORT_FIELDS.items():
+        df = dataset(api_dir / f"{barrier_type}.feather", format="feather").to_table(columns=columns)
+        build_state_shards(df, api_dir / "public" / barrier_type)
@@ -2,7 +2,6 @@ from pathlib import Path
 import pyarrow as pa
 
 import pandas as pd
-import pyarrow.compute as pc
 import numpy as np
 
 from analysis.lib.io import read_arrow_tables
@@ -299,15 +298,14 @@ def get_network_results(df, network_type, state_ranks=False):
     ### Calculate state tiers for each of total and perennial
     # (exclude unranked invasive spp. barriers / no structure diversions)
     # NOTE: tiers are calculated using a pyarrow Table
-    to_rank = pa.Table.from_pandas(networks.loc[~networks.Unranked, ["State"] + METRICS].reset_index())
-
-    merged = []
-    for state in to_rank["State"].unique():
-        subset = to_rank.filter(pc.equal(to_rank["State"], state))
-        tiers = calculate_tiers(subset).add_column(0, subset.schema.field("id"), subset["id"])
-        merged.append(tiers)
+    # (barriers outside states are not ranked)
+    to_rank = pa.Table.from_pandas(
+        networks.loc[~networks.Unranked & networks.State.notnull(), ["State"] + METRICS].reset_index()
+    )
 
-    state_tiers = pa.concat_tables(merged).combine_chunks().to_pandas().set_index("id")
+    # tiers are calculated within each state
+    tiers = calculate_tiers(to_rank, group_field="State")
+    state_tiers = tiers.add_column(0, to_rank.schema.field("id"), to_rank["id"]).to_pandas().set_index("id")
     state_tiers.rename(columns={col: f"State_{col}" for col in state_tiers.columns}, inplace=True)
 
     networks = networks.join(state_tiers)
@@ -64,6 +64,11 @@ class Layers(str, Enum):
 
 class Formats(str, Enum):
     csv = "csv"
+    # CSV compressed using zstd, which is faster to create than deflated CSV
+    csv_zst = "csv.zst"
+    # columnar formats that are compressed using zstd (see api.lib.download)
+    parquet = "parquet"
+    arrows = "arrows"
 
 
 class Scenarios(str, Enum):
@@ -1,41 +1,386 @@
+from functools import partial
 from pathlib import Path
+from time import perf_counter
 
 import duckdb
-from pyarrow.dataset import dataset
+import numpy as np
+import pyarrow as pa
+from pyarrow.dataset import dataset, InMemoryDataset
 
+from api.constants import FullySupportedBarrierTypes, NetworkTypes, RankedBarrierTypes, SUMMARY_UNIT_FIELDS
+from api.lib.lazy import LazyValue, LazyMapping
+from api.lib.indexes import (
+    UnitIndex,
+    FilterIndex,
+    QueryCube,
+    MetricRanks,
+    SearchIndex,
+    UnitSearchIndex,
+    SARPIDIndex,
+    SpatialIndex,
+)
+from api.lib.shards import StateShards
 from api.logger import log
+from api.settings import RESIDENT_TABLES
 
 
 data_dir = Path("data/api")
 
-try:
-    db = duckdb.connect(str(data_dir / "api.db"), read_only=True)
-
-    dams = dataset(data_dir / "dams.feather", format="feather")
-    small_barriers = dataset(data_dir / "small_barriers.feather", format="feather")
-    combined_barriers = dataset(data_dir / "combined_barriers.feather", format="feather")
-    largefish_barriers = dataset(data_dir / "largefish_barriers.feather", format="feather")
-    smallfish_barriers = dataset(data_dir / "smallfish_barriers.feather", format="feather")
-    road_crossings = dataset(data_dir / "road_crossings.feather", format="feather")
-    waterfalls = dataset(data_dir / "waterfalls.feather", format="feather")
-
-    barrier_datasets = {
-        "dams": dams,
-        "small_barriers": small_barriers,
-        "combined_barriers": combined_barriers,
-        "largefish_barriers": largefish_barriers,
-        "smallfish_barriers": smallfish_barriers,
-        "road_crossings": road_crossings,
-        "waterfalls": waterfalls,
-    }
-
-    search_barriers = dataset(data_dir / "search_barriers.feather", format="feather")
-
-    units = dataset(data_dir / "map_units.feather", format="feather")
-
-    # removed dams for public API; not used internally
-    removed_dams = dataset(data_dir / "removed_dams.feather", format="feather")
-
-except Exception as e:
-    print("ERROR: not able to load data")
-    log.error(e)
+# uncompressed Arrow IPC copies of the barrier tables, created in aggregate_networks.py
+mmap_dir = data_dir / "mmap"
+
+# indexes of barrier tables, created in aggregate_networks.py
+index_dir = data_dir / "indexes"
+
+# pre-rendered CSV shards for public state query API, created in aggregate_networks.py
+shard_dir = data_dir / "public"
+
+BARRIER_TYPES = [
+    "dams",
+    "small_barriers",
+    "combined_barriers",
+    "largefish_barriers",
+    "smallfish_barriers",
+    "road_crossings",
+    "waterfalls",
+]
+
+# columns of barrier tables read by most requests (query, rank, details); these
+# are read during warmup so that they are in the OS page cache
+WARMUP_COLUMNS = ["id", "lat", "lon", "SARPID", "HasNetwork", "Ranked"]
+
+
+INDEX_CLASSES = {
+    "units": UnitIndex,
+    "filters": FilterIndex,
+    "cube": QueryCube,
+    "ranks": MetricRanks,
+    "words": SearchIndex,
+    "spatial": SpatialIndex,
+}
+
+
+def open_memory_mapped_table(path):
+    """Open an uncompressed Arrow IPC file as a memory-mapped pyarrow Table.
+
+    The buffers of the table point directly into the memory map, so nothing is
+    copied or decompressed on read.  Pages are loaded on demand by the OS and
+    are shared between all processes that map the same file.
+
+    Parameters
+    ----------
+    path : Path
+
+    Returns
+    -------
+    pyarrow.Table
+    """
+    return pa.ipc.open_file(pa.memory_map(str(path), "r")).read_all()
+
+
+def load_barrier_table(barrier_type):
+    """Load the memory-mapped uncompressed table for barrier_type, if
+    RESIDENT_TABLES is set and the table is available.
+
+    Parameters
+    ----------
+    barrier_type : str
+
+    Returns
+    -------
+    pyarrow.Table or None
+    """
+    if not RESIDENT_TABLES:
+        return None
+
+    path = mmap_dir / f"{barrier_type}.feather"
+    if not path.exists():
+        log.warning(f"uncompressed table not found for {barrier_type}; falling back to feather dataset")
+        return None
+
+    return open_memory_mapped_table(path)
+
+
+def load_barrier_dataset(barrier_type):
+    """Load dataset for barrier_type.
+
+    If the resident table is available, an in-memory dataset is returned that
+    wraps it without copying.  Otherwise, the dataset is opened from the
+    compressed feather file.
+
+    Parameters
+    ----------
+    barrier_type : str
+
+    Returns
+    -------
+    pyarrow.dataset.Dataset
+    """
+    table = barrier_tables.get(barrier_type)
+    if table is not None:
+        return InMemoryDataset(table)
+
+    return dataset(data_dir / f"{barrier_type}.feather", format="feather")
+
+
+def load_index(barrier_type, kind, num_rows):
+    """Load a memory-mapped index for barrier_type, if available.
+
+    Parameters
+    ----------
+    barrier_type : str
+    kind : {"units", "filters", "cube", "ranks", "words", "spatial"}
+    num_rows : int
+        number of rows in the barrier dataset, used to verify that the index
+        was built for the same version of the data
+
+    Returns
+    -------
+    UnitIndex, FilterIndex, QueryCube, MetricRanks, SearchIndex, SpatialIndex, or None
+    """
+    path = index_dir / f"{barrier_type}_{kind}.feather"
+    if not path.exists():
+        log.warning(f"{kind} index not found for {barrier_type}")
+        return None
+
+    index = INDEX_CLASSES[kind](open_memory_mapped_table(path))
+    if index.num_rows != num_rows:
+        log.warning(f"{kind} index for {barrier_type} does not match number of rows in dataset; not using index")
+        return None
+
+    return index
+
+
+def load_barrier_index(barrier_type, kind):
+    """Load a memory-mapped index for barrier_type that matches its dataset, if
+    available.
+
+    Parameters
+    ----------
+    barrier_type : str
+    kind : {"units", "filters", "cube", "ranks", "spatial"}
+
+    Returns
+    -------
+    UnitIndex, FilterIndex, QueryCube, MetricRanks, SpatialIndex, or None
+    """
+    return load_index(barrier_type, kind, barrier_datasets[barrier_type].count_rows())
+
+
+def load_sarpid_index(barrier_type):
+    """Build SARPID index of the resident table for barrier_type, if available.
+
+    Parameters
+    ----------
+    barrier_type : str
+
+    Returns
+    -------
+    SARPIDIndex or None
+    """
+    table = barrier_tables.get(barrier_type)
+    if table is None:
+        return None
+
+    return SARPIDIndex(table["SARPID"])
+
+
+def load_search_table():
+    """Load the memory-mapped uncompressed search_barriers table, if available.
+
+    The search index returns positions of rows, which are only fast to read
+    from the uncompressed table.
+
+    Returns
+    -------
+    pyarrow.Table or None
+    """
+    path = mmap_dir / "search_barriers.feather"
+    if not path.exists():
+        log.warning("uncompressed table not found for search_barriers; not using search index")
+        return None
+
+    return open_memory_mapped_table(path)
+
+
+def load_search_index():
+    """Load the word index of search_barriers, if available.
+
+    Returns
+    -------
+    SearchIndex or None
+    """
+    table = search_table.load()
+    if table is None:
+        return None
+
+    return load_index("search_barriers", "words", len(table))
+
+
+def load_state_shards(barrier_type):
+    """Load the pre-rendered CSV shards for the public state query API for
+    barrier_type, if available and built for the same version of the data.
+
+    Parameters
+    ----------
+    barrier_type : str
+
+    Returns
+    -------
+    StateShards or None
+    """
+    path = shard_dir / barrier_type
+    if not (path / "manifest.json").exists():
+        log.warning(f"public CSV shards not found for {barrier_type}")
+        return None
+
+    shards = StateShards(path)
+    if shards.num_rows != barrier_datasets[barrier_type].count_rows():
+        log.warning(f"public CSV shards for {barrier_type} do not match number of rows in dataset; not using shards")
+        return None
+
+    return shards
+
+
+# Datasets and indexes are loaded on first use (or during warmup), so that
+# importing the API is fast.  Handles to datasets can be used in place of the
+# datasets; mappings only contain barrier types where values are available.
+
+db = LazyValue("api.db", lambda: duckdb.connect(str(data_dir / "api.db"), read_only=True))
+
+# resident (memory-mapped) tables; only available if RESIDENT_TABLES is set
+barrier_tables = LazyMapping("barrier_tables", {t: partial(load_barrier_table, t) for t in BARRIER_TYPES})
+
+barrier_datasets = LazyMapping("barrier_datasets", {t: partial(load_barrier_dataset, t) for t in BARRIER_TYPES})
+
+dams = barrier_datasets.handles["dams"]
+small_barriers = barrier_datasets.handles["small_barriers"]
+combined_barriers = barrier_datasets.handles["combined_barriers"]
+largefish_barriers = barrier_datasets.handles["largefish_barriers"]
+smallfish_barriers = barrier_datasets.handles["smallfish_barriers"]
+road_crossings = barrier_datasets.handles["road_crossings"]
+waterfalls = barrier_datasets.handles["waterfalls"]
+
+# summary unit and filter field indexes, query cubes, and global ranks of
+# metrics; only available for barrier types where these were created
+unit_indexes, filter_indexes, query_cubes = [
+    LazyMapping(name, {t.value: partial(load_barrier_index, t.value, kind) for t in FullySupportedBarrierTypes})
+    for name, kind in [("unit_indexes", "units"), ("filter_indexes", "filters"), ("query_cubes", "cube")]
+]
+metric_ranks = LazyMapping(
+    "metric_ranks", {t.value: partial(load_barrier_index, t.value, "ranks") for t in RankedBarrierTypes}
+)
+
+# packed Hilbert R-trees of the locations of barriers, used for spatial filters
+spatial_indexes = LazyMapping(
+    "spatial_indexes", {t.value: partial(load_barrier_index, t.value, "spatial") for t in FullySupportedBarrierTypes}
+)
+
+# hash indexes of SARPID to rows of resident tables used for barrier details;
+# only available if RESIDENT_TABLES is set
+sarpid_indexes = LazyMapping(
+    "sarpid_indexes",
+    {t: partial(load_sarpid_index, t) for t in [n.value for n in NetworkTypes] + ["road_crossings", "waterfalls"]},
+)
+
+search_barriers = LazyValue("search_barriers", partial(dataset, data_dir / "search_barriers.feather", format="feather"))
+
+# uncompressed (memory-mapped) search_barriers table and its word index; these
+# must be accessed using load(), which returns None if not available
+search_table = LazyValue("search_table", load_search_table)
+search_index = LazyValue("search_index", load_search_index)
+
+units = LazyValue("units", partial(dataset, data_dir / "map_units.feather", format="feather"))
+
+# search index of summary units, built in memory
+unit_search_index = LazyValue(
+    "unit_search_index", lambda: UnitSearchIndex(units.to_table(columns=SUMMARY_UNIT_FIELDS + ["key", "priority"]))
+)
+
+# pre-rendered CSV shards for public state query API; only available for
+# barrier types where these were created
+state_shards = LazyMapping("state_shards", {t: partial(load_state_shards, t) for t in ["dams", "small_barriers"]})
+
+# removed dams for public API; not used internally
+removed_dams = LazyValue("removed_dams", partial(dataset, data_dir / "removed_dams.feather", format="feather"))
+
+# all handles, in order of loading during warmup
+HANDLES = [
+    db,
+    *barrier_tables.handles.values(),
+    *barrier_datasets.handles.values(),
+    *unit_indexes.handles.values(),
+    *filter_indexes.handles.values(),
+    *query_cubes.handles.values(),
+    *metric_ranks.handles.values(),
+    *spatial_indexes.handles.values(),
+    *sarpid_indexes.handles.values(),
+    search_barriers,
+    search_table,
+    search_index,
+    units,
+    unit_search_index,
+    *state_shards.handles.values(),
+    removed_dams,
+]
+
+# state of warmup; status is one of "pending", "running", "complete"
+warmup_state = {"status": "pending", "time": None}
+
+
+def _touch_pages(array):
+    """Read one byte of every page of the buffers of array, so that pages of
+    memory-mapped tables are loaded.
+    """
+    for chunk in array.chunks:
+        for buffer in chunk.buffers():
+            if buffer is not None and buffer.size > 0:
+                np.frombuffer(buffer, dtype="uint8")[::4096].max()
+
+
+def warmup():
+    """Load all datasets and indexes, and read the columns of barrier tables
+    that are used by most requests, so that the first requests are not slowed
+    down by loading data.
+
+    Errors loading a dataset or index are logged and reported by
+    get_load_status(); they do not stop warmup.
+    """
+    warmup_state["status"] = "running"
+    start = perf_counter()
+
+    for handle in HANDLES:
+        try:
+            handle.load()
+        except Exception:
+            # error is logged and reported by the handle
+            continue
+
+    for barrier_type in BARRIER_TYPES:
+        try:
+            table = barrier_tables.get(barrier_type)
+            if table is not None:
+                for column in [c for c in WARMUP_COLUMNS if c in table.column_names]:
+                    _touch_pages(table[column])
+
+            else:
+                ds = barrier_datasets[barrier_type]
+                ds.to_table(columns=[c for c in WARMUP_COLUMNS if c in ds.schema.names])
+
+        except Exception as ex:
+            log.error(f"could not warm up {barrier_type}: {ex}")
+
+    warmup_state["time"] = perf_counter() - start
+    warmup_state["status"] = "complete"
+    log.info(f"warmup completed in {warmup_state['time']:.2f} seconds")
+
+
+def get_load_status():
+    """Get the load status of each dataset and index.
+
+    Returns
+    -------
+    dict
+        {<name>: {"status": ..., "load_time": ..., "error": ...}, ...}
+    """
+    return {handle.name: handle.get_status() for handle in HANDLES}
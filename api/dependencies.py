@@ -11,6 +11,7 @@ from api.constants import (
     BOOLEAN_FILTER_FIELDS,
     FullySupportedBarrierTypes,
 )
+from api.lib.geometry import parse_bbox, parse_wkb_polygon
 
 
 def get_unit_ids(
@@ -83,6 +84,11 @@ def get_filter_params(
     """Parse request query parameters into field-level parameters that can be
     used to filter the pyarrow Dataset
 
+    Records can also be selected by location using bbox ("xmin,ymin,xmax,ymax"
+    in longitude and latitude) and / or polygon (hex-encoded WKB Polygon or
+    MultiPolygon in longitude and latitude); these are returned as spatial
+    filters (see api.lib.geometry).
+
     Parameters
     ----------
     request : fastapi.requests.Request
@@ -158,4 +164,14 @@ def get_filter_params(
                     [int(x) for x in request.query_params.get(key).split(",")],
                 )
 
+    try:
+        if "bbox" in request.query_params:
+            filters["bbox"] = ("in_bbox", parse_bbox(request.query_params.get("bbox")))
+
+        if "polygon" in request.query_params:
+            filters["polygon"] = ("in_polygon", parse_wkb_polygon(request.query_params.get("polygon")))
+
+    except ValueError as ex:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(ex))
+
     return filters
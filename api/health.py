@@ -0,0 +1,49 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from api.data import get_load_status, warmup_state
+from api.settings import WARMUP
+
+
+router = APIRouter()
+
+
+def get_health():
+    """Get the status of warmup and of loading each dataset and index.
+
+    Returns
+    -------
+    (bool, dict)
+        True if ready to process requests, and status
+    """
+    datasets = get_load_status()
+    failed = [name for name, status in datasets.items() if status["status"] == "failed"]
+
+    # if warmup is disabled, data are loaded on first use
+    ready = (warmup_state["status"] == "complete" or not WARMUP) and not failed
+
+    return ready, {
+        "ready": ready,
+        "warmup": {
+            "status": warmup_state["status"] if WARMUP else "disabled",
+            "time": round(warmup_state["time"], 4) if warmup_state["time"] is not None else None,
+        },
+        "failed": failed,
+        "datasets": datasets,
+    }
+
+
+@router.get("/healthz")
+async def healthz():
+    """Return 200 if the API is running, regardless of whether data are loaded."""
+    _, content = get_health()
+    return JSONResponse(content=content)
+
+
+@router.get("/readyz")
+async def readyz():
+    """Return 200 if warmup is complete and all datasets and indexes were
+    loaded without errors, otherwise 503.
+    """
+    ready, content = get_health()
+    return JSONResponse(content=content, status_code=200 if ready else 503)
@@ -4,24 +4,66 @@ from fastapi.responses import JSONResponse
 import pyarrow.compute as pc
 
 from api.constants import NetworkTypes
-from api.data import db, waterfalls
+from api.data import db, waterfalls, barrier_tables, sarpid_indexes
+from api.lib.executor import admit, load_in_thread, run_in_thread
 from api.logger import log_request
 
 
 router = APIRouter()
 
 
-@router.get("/{network_type}/details/{sarp_id}")
-async def details(
-    request: Request,
-    network_type: NetworkTypes,
-    sarp_id: str,
-):
-    log_request(request)
+def get_table_name(network_type, sarp_id):
+    """Get the name of the table that contains the record for sarp_id.
 
-    network_type = network_type.value
+    Parameters
+    ----------
+    network_type : str
+    sarp_id : str
 
+    Returns
+    -------
+    str
+    """
     if sarp_id.startswith("f"):
+        return "waterfalls"
+
+    if sarp_id.startswith("cr"):
+        return "road_crossings"
+
+    return network_type
+
+
+def get_record(network_type, sarp_id):
+    """Get the record for sarp_id from the table for network_type.
+
+    Parameters
+    ----------
+    network_type : str
+    sarp_id : str
+
+    Returns
+    -------
+    pyarrow.Table
+        table with 1 row, or 0 rows if not found
+    """
+    table = get_table_name(network_type, sarp_id)
+
+    # use zero-copy slice of resident table if available
+    index = sarpid_indexes.get(table)
+    if index is not None:
+        rows = index.get_rows(sarp_id)
+
+        if table == "waterfalls":
+            # waterfalls store one record per network type
+            network_types = barrier_tables[table]["network_type"]
+            rows = [row for row in rows if network_types[row].as_py() == network_type]
+
+        if not len(rows):
+            return barrier_tables[table].slice(0, 0)
+
+        return barrier_tables[table].slice(rows[0], 1)
+
+    if table == "waterfalls":
         # waterfalls use pyarrow search because we store one record per network type
         # and can't store them in the barrier search index
         dataset = waterfalls
@@ -30,12 +72,29 @@ async def details(
         record = dataset.to_table(filter=filter).slice(0)
 
     else:
-        if sarp_id.startswith("cr"):
-            table = "road_crossings"
-        else:
-            table = network_type
+        # NOTE: connections cannot be shared between threads; use a cursor instead
+        with db.cursor() as con:
+            record = con.sql(f"SELECT * FROM {table} WHERE SARPID=? LIMIT 1", params=(sarp_id,)).arrow()
+
+    return record
 
-        record = db.sql(f"SELECT * FROM {table} WHERE SARPID=? LIMIT 1", params=(sarp_id,)).arrow()
+
+@router.get("/{network_type}/details/{sarp_id}")
+async def details(
+    request: Request,
+    network_type: NetworkTypes,
+    sarp_id: str,
+):
+    log_request(request)
+
+    index = await load_in_thread(sarpid_indexes.handles[get_table_name(network_type.value, sarp_id)])
+    if index is not None:
+        # lookups from the index are fast enough to run directly on the event loop
+        record = get_record(network_type.value, sarp_id)
+
+    else:
+        async with admit(1):
+            record = await run_in_thread(get_record, network_type.value, sarp_id)
 
     if not len(record):
         raise HTTPException(404, detail=f"record not found for SARPID: {sarp_id}")
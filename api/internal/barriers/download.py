@@ -1,17 +1,19 @@
+import asyncio
+from contextlib import AsyncExitStack
 from datetime import datetime
-from io import BytesIO
-import os
-from pathlib import Path
-from time import time
-import tempfile
-from zipfile import ZipFile, ZIP_DEFLATED
-
-import arq
+from functools import partial
+import json
+import threading
+from time import perf_counter
+from types import SimpleNamespace
+
+from arq.constants import result_key_prefix
 from arq.jobs import Job, JobStatus
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import iterate_in_threadpool
 from fastapi.requests import Request
-from fastapi.responses import JSONResponse
-from pyarrow.csv import write_csv
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 
 from api.constants import (
     FullySupportedBarrierTypes,
@@ -22,20 +24,51 @@ from api.constants import (
     SB_EXPORT_FIELDS,
     COMBINED_EXPORT_FIELDS,
     ROAD_CROSSING_EXPORT_FIELDS,
-    LOGO_PATH,
 )
 from api.logger import log, log_request
 from api.dependencies import get_unit_ids, get_filter_params
-from api.lib.download import extract_for_download
+from api.lib.download import (
+    DownloadCancelled,
+    extract_download_batches,
+    get_archive,
+    get_archive_path,
+    get_download_key,
+    stream_download_zip,
+    write_download_zip,
+)
+from api.lib.executor import admit, run_in_pool, run_in_thread
 from api.lib.extract import get_record_count
-from api.lib.progress import get_progress, set_progress
+from api.lib.jobs import detach_job_client, enqueue_download_job, get_queue_position, is_job_polled, set_job_polled
+from api.lib.metrics import collect_request_stats
+from api.lib.progress import get_progress, get_progress_channel, set_progress
+from api.lib.redis_pool import get_redis_pool
 from api.metadata import get_readme, get_terms
-from api.settings import MAX_IMMEDIATE_DOWNLOAD_RECORDS, CUSTOM_DOWNLOAD_DIR, REDIS, REDIS_QUEUE
+from api.metrics import archive_requests, record_job, save_metrics
+from api.settings import MAX_IMMEDIATE_DOWNLOAD_RECORDS, REDIS_QUEUE
 
 
 router = APIRouter()
 
 
+# seconds between refreshing the status of a job while streaming it, if no
+# progress is published in the meantime
+STATUS_STREAM_INTERVAL = 2
+
+# seconds between checking if the status of a job in progress is still
+# requested by any client
+POLL_CHECK_INTERVAL = 5
+
+# seconds between publishing the progress of a job while its download is created
+PROGRESS_INTERVAL = 1
+
+
+def get_client(request):
+    """Get the IP address of the client of request, which is used to schedule
+    download jobs and track which clients are waiting for them.
+    """
+    return request.client.host if request.client else ""
+
+
 @router.post("/{barrier_type}/{format}")
 async def download(
     request: Request,
@@ -46,6 +79,7 @@ async def download(
     custom_rank: bool = False,
     include_unranked: bool = False,
     sort: Scenarios = "NCWC",
+    stream: bool = False,
 ):
     """Download subset of barrier_type data.
 
@@ -56,7 +90,10 @@ async def download(
     * custom_rank: bool (default: False); set to true to perform custom ranking of subset defined here
     * include_unranked: bool (default: False); set to true to include unranked barriers in output
     * sort: Scenarios
+    * stream: bool (default: False); set to true to stream the zip file in the response instead of returning the path
+      to the zip file (only applies to immediate downloads)
     * filters are defined using a lowercased version of column name and a comma-delimited list of values (see get_filters())
+    * bbox: xmin,ymin,xmax,ymax and / or polygon: hex-encoded WKB, to select barriers by location (see get_filter_params())
     """
 
     log_request(request)
@@ -69,41 +106,71 @@ async def download(
 
     # ranking is not applicable to road crossings
     ranked_only = not (include_unranked or barrier_type == "road_crossings")
-    count = get_record_count(barrier_type, unit_ids=unit_ids, filters=filters, ranked_only=ranked_only)
+    count = await run_in_thread(
+        get_record_count, barrier_type, unit_ids=unit_ids, filters=filters, ranked_only=ranked_only
+    )
+
+    # identical requests reuse the same archive
+    key = get_download_key(barrier_type, format, unit_ids, filters, ranked_only, custom_rank, sort)
 
     if count > MAX_IMMEDIATE_DOWNLOAD_RECORDS:
+        path = get_archive(key, barrier_type.value)
+        archive_requests.inc((barrier_type.value, "hit" if path is not None else "miss"))
+        if path is not None:
+            log.info(f"reusing existing download of {count:,} {barrier_type.replace('_', ' ')}")
+            return JSONResponse(content={"status": "success", "path": f"/downloads/custom/{path}"})
+
         log.info(f"selected {count:,} {barrier_type.replace('_', ' ')} for download via background task")
 
         # create custom download task and do this in the background
+        # NOTE: the key is used as the job ID so that identical requests reuse
+        # the job if it is already queued or in progress; the job is scheduled
+        # according to its number of records and the other jobs of the client
+        client = get_client(request)
+        job_kwargs = {
+            "record_count": count,
+            "client": client,
+            "barrier_type": barrier_type,
+            "format": format,
+            "unit_ids": unit_ids,
+            "filters": filters,
+            "custom_rank": custom_rank,
+            "ranked_only": ranked_only,
+            "sort": sort,
+        }
         try:
-            redis = await arq.create_pool(REDIS)
-            job = await redis.enqueue_job(
-                "custom_download_task",
-                barrier_type=barrier_type,
-                format=format,
-                unit_ids=unit_ids,
-                filters=filters,
-                custom_rank=custom_rank,
-                ranked_only=ranked_only,
-                sort=sort,
-                _queue_name=REDIS_QUEUE,
-            )
+            redis = await get_redis_pool()
+            job = await enqueue_download_job(redis, key, **job_kwargs)
+
+            if job is None:
+                # if the job already completed, its archive was deleted or it
+                # failed; clear its result so that it can be run again
+                job_status = await Job(key, redis=redis, _queue_name=REDIS_QUEUE).status()
+                if job_status == JobStatus.complete:
+                    await redis.delete(f"{result_key_prefix}{key}")
+                    await enqueue_download_job(redis, key, **job_kwargs)
 
-            return JSONResponse(content={"job": job.job_id})
+            # the job is cancelled if no client requests its status
+            await set_job_polled(redis, key, client)
+
+            return JSONResponse(content={"job": key})
 
         except Exception as ex:
             log.error(f"Error creating background task, is Redis offline?  {ex}")
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal server error")
 
-        finally:
-            await redis.aclose()
-
     log.info(f"selected {count:,} {barrier_type.replace('_', ' ')} for immediate download")
 
     barrier_type = barrier_type.value
     format = format.value
     sort = sort.value
 
+    if not stream:
+        path = get_archive(key, barrier_type)
+        archive_requests.inc((barrier_type, "hit" if path is not None else "miss"))
+        if path is not None:
+            return JSONResponse(content={"status": "success", "path": f"/downloads/custom/{path}"})
+
     columns = ["id"]
     warnings = None
     match barrier_type:
@@ -119,46 +186,64 @@ async def download(
 
     columns = [c for c in columns if c not in CUSTOM_TIER_FIELDS]
 
-    df = extract_for_download(
-        barrier_type,
-        unit_ids=unit_ids,
-        filters=filters,
-        columns=columns,
-        ranked_only=ranked_only,
-        custom_rank=custom_rank,
-        sort=sort,
-    )
-
-    tmp_dir = Path(tempfile.mkdtemp(dir=CUSTOM_DOWNLOAD_DIR))
-    # grant permissions to Caddy to read from this directory; the default is too restrictive
-    os.chmod(tmp_dir, 0o755)
-
     filename = f"road_stream_crossings.{format}" if barrier_type == "road_crossings" else f"{barrier_type}.{format}"
 
-    ### Get metadata
-    readme = get_readme(
-        filename=filename,
-        barrier_type=barrier_type,
-        fields=df.column_names,
-        unit_ids=unit_ids,
-        warnings=warnings,
-    )
-    terms = get_terms()
+    async with AsyncExitStack() as stack:
+        await stack.enter_async_context(admit(count))
+
+        schema, batches = await run_in_thread(
+            extract_download_batches,
+            barrier_type,
+            unit_ids=unit_ids,
+            filters=filters,
+            columns=columns,
+            ranked_only=ranked_only,
+            custom_rank=custom_rank,
+            sort=sort,
+        )
 
-    # other types will be rejected above
-    if format == "csv":
-        with open(tmp_dir / f"{barrier_type}.zip", "wb") as out:
-            with ZipFile(out, "w", compression=ZIP_DEFLATED, compresslevel=5) as zf:
-                csv_stream = BytesIO()
-                write_csv(df, csv_stream)
-                zf.writestr(filename, csv_stream.getvalue())
-                zf.writestr("README.txt", readme)
-                zf.writestr("TERMS_OF_USE.txt", terms)
-                zf.write(LOGO_PATH, "SARP_logo.png")
-
-        return JSONResponse(
-            content={"status": "success", "path": f"/downloads/custom/{tmp_dir.name}/{barrier_type}.zip"}
+        ### Get metadata
+        readme = get_readme(
+            filename=filename,
+            barrier_type=barrier_type,
+            fields=schema.names,
+            unit_ids=unit_ids,
+            warnings=warnings,
         )
+        terms = get_terms()
+
+        if stream:
+            # NOTE: the zip file is written while streaming the response,
+            # which runs in the threadpool of the server; the request remains
+            # admitted until the response is complete or aborted
+            admission = stack.pop_all()
+            return StreamingResponse(
+                _release_after(stream_download_zip(filename, schema, batches, readme, terms, format), admission),
+                media_type="application/zip",
+                headers={"Content-Disposition": f'attachment; filename="{barrier_type}.zip"'},
+                background=BackgroundTask(admission.aclose),
+            )
+
+        await run_in_thread(
+            write_download_zip, get_archive_path(key, barrier_type), filename, schema, batches, readme, terms, format
+        )
+
+        return JSONResponse(content={"status": "success", "path": f"/downloads/custom/{key}/{barrier_type}.zip"})
+
+
+async def _release_after(chunks, stack):
+    """Yield the chunks of a streamed response body from the threadpool, then
+    close stack once the body is complete or the response is aborted.
+
+    stack is also closed by a background task of the response in case the
+    body is never iterated; closing it more than once has no effect.
+    """
+    try:
+        async for chunk in iterate_in_threadpool(chunks):
+            yield chunk
+
+    finally:
+        await stack.aclose()
 
 
 async def custom_download_task(
@@ -170,13 +255,182 @@ async def custom_download_task(
     custom_rank: bool,
     ranked_only: bool,
     sort: Scenarios,
+    record_count: int = None,
+    client: str = None,
+):
+    """Create custom download zip file in the background worker, and record
+    metrics of the job.
+
+    record_count is used to report the progress of the job.  record_count and
+    client are also used to schedule the job (see api.lib.jobs and
+    api.worker.DownloadWorker).
+    """
+    start = perf_counter()
+
+    enqueue_time = ctx.get("enqueue_time")
+    queue_time = (datetime.now(tz=enqueue_time.tzinfo) - enqueue_time).total_seconds() if enqueue_time else None
+
+    status = "failed"
+    with collect_request_stats() as stats:
+        try:
+            path = await _create_custom_download(
+                ctx, barrier_type, unit_ids, filters, format, custom_rank, ranked_only, sort, record_count
+            )
+            status = "success"
+            return path
+
+        except (DownloadCancelled, asyncio.CancelledError):
+            status = "cancelled"
+            raise
+
+        finally:
+            record_job(barrier_type, format, status, perf_counter() - start, queue_time, stats)
+            save_metrics("worker")
+
+
+def get_download_progress(rows, record_count):
+    """Return the progress percent of a download job that has written rows of
+    record_count records.
+
+    Writing the records accounts for most of the time of the job, so progress
+    is reported as the percent of records written, but held below 100 until
+    the zip file is complete.  If record_count is not known, progress is
+    reported as halfway done.
+
+    Parameters
+    ----------
+    rows : int
+    record_count : int or None
+
+    Returns
+    -------
+    str
+    """
+    if not record_count:
+        return "50"
+
+    return str(min(99, 100 * rows // record_count))
+
+
+async def _create_custom_download(
+    ctx,
+    barrier_type: FullySupportedBarrierTypes,
+    unit_ids: dict,
+    filters: dict,
+    format: Formats,
+    custom_rank: bool,
+    ranked_only: bool,
+    sort: Scenarios,
+    record_count: int = None,
 ):
     await set_progress(ctx["redis"], ctx["job_id"], "0", "Extracting data")
 
+    key = get_download_key(barrier_type, format, unit_ids, filters, ranked_only, custom_rank, sort)
+
     barrier_type = barrier_type.value
     format = format.value
     sort = sort.value
 
+    # archive may have been created by an identical request since this job was queued
+    path = get_archive(key, barrier_type)
+    if path is not None:
+        await set_progress(ctx["redis"], ctx["job_id"], "100", "All done")
+        return path
+
+    # the job may have been abandoned while it was queued
+    if not await is_job_polled(ctx["redis"], ctx["job_id"]):
+        log.info(f"cancelling job {ctx['job_id']}; its status is no longer requested")
+        raise DownloadCancelled("job status was not requested by any client")
+
+    args = (key, barrier_type, format, unit_ids, filters, custom_rank, ranked_only, sort)
+
+    # if the worker has a process pool, the download is created in one of its
+    # processes so that other jobs can run at the same time; otherwise it is
+    # created in a thread so that the job can be cancelled while it runs.
+    # The number of records written so far is shared with this job through
+    # the manager (process pool) or a plain object (thread), because only
+    # this job can publish progress to Redis.
+    executor = ctx.get("executor")
+    if executor is not None:
+        cancel = ctx["manager"].Event()
+        rows_written = ctx["manager"].Value("Q", 0)
+        progress = partial(setattr, rows_written, "value")
+        work = asyncio.ensure_future(
+            run_in_pool(executor, create_custom_download, *args, cancel=cancel, progress=progress)
+        )
+    else:
+        cancel = threading.Event()
+        rows_written = SimpleNamespace(value=0)
+        progress = partial(setattr, rows_written, "value")
+        work = asyncio.ensure_future(run_in_thread(create_custom_download, *args, cancel=cancel, progress=progress))
+
+    try:
+        last_rows = 0
+        last_poll_check = perf_counter()
+        while not (await asyncio.wait([work], timeout=PROGRESS_INTERVAL))[0]:
+            rows = rows_written.value
+            if rows != last_rows:
+                last_rows = rows
+                await set_progress(
+                    ctx["redis"], ctx["job_id"], get_download_progress(rows, record_count), "Creating zip file"
+                )
+
+            if perf_counter() - last_poll_check >= POLL_CHECK_INTERVAL:
+                last_poll_check = perf_counter()
+                if not await is_job_polled(ctx["redis"], ctx["job_id"]):
+                    log.info(f"cancelling job {ctx['job_id']}; its status is no longer requested")
+                    raise DownloadCancelled("job status was not requested by any client")
+
+        path = work.result()
+
+    except BaseException:
+        # cancelled by client, timed out, or no longer polled; stop creating
+        # the download before its next batch of records
+        cancel.set()
+        work.cancel()
+        raise
+
+    await set_progress(ctx["redis"], ctx["job_id"], "100", "All done")
+
+    return path
+
+
+def create_custom_download(
+    key: str,
+    barrier_type: str,
+    format: str,
+    unit_ids: dict,
+    filters: dict,
+    custom_rank: bool,
+    ranked_only: bool,
+    sort: str,
+    cancel=None,
+    progress=None,
+):
+    """Extract records and write custom download zip file.
+
+    Parameters
+    ----------
+    key : str
+        download key (see get_download_key())
+    barrier_type : str
+    format : str
+    unit_ids : dict
+    filters : dict
+    custom_rank : bool
+    ranked_only : bool
+    sort : str
+    cancel : threading.Event or multiprocessing Event proxy, optional (default: None)
+        if set, DownloadCancelled is raised before the next batch of records
+    progress : callable, optional (default: None)
+        called with the number of records written so far after each batch of
+        records; it must be picklable if this runs in a process pool
+
+    Returns
+    -------
+    str
+        path of zip file relative to CUSTOM_DOWNLOAD_DIR
+    """
     columns = ["id"]
     warnings = None
     match barrier_type:
@@ -192,7 +446,7 @@ async def custom_download_task(
 
     columns = [c for c in columns if c not in CUSTOM_TIER_FIELDS]
 
-    df = extract_for_download(
+    schema, batches = extract_download_batches(
         barrier_type,
         unit_ids=unit_ids,
         filters=filters,
@@ -200,51 +454,112 @@ async def custom_download_task(
         custom_rank=custom_rank,
         ranked_only=ranked_only,
         sort=sort,
+        cancel=cancel,
+        progress=progress,
     )
 
-    await set_progress(ctx["redis"], ctx["job_id"], "50", "Creating zip file")
-
-    tmp_dir = Path(tempfile.mkdtemp(dir=CUSTOM_DOWNLOAD_DIR))
-    # grant permissions to Caddy to read from this directory; the default is too restrictive
-    os.chmod(tmp_dir, 0o755)
-
     filename = f"road_stream_crossings.{format}" if barrier_type == "road_crossings" else f"{barrier_type}.{format}"
 
     ### Get metadata
     readme = get_readme(
         filename=filename,
         barrier_type=barrier_type,
-        fields=df.column_names,
+        fields=schema.names,
         unit_ids=unit_ids,
         warnings=warnings,
     )
     terms = get_terms()
 
-    # other types will be rejected before calling into this
-    if format == "csv":
-        with open(tmp_dir / f"{barrier_type}.zip", "wb") as out:
-            with ZipFile(out, "w", compression=ZIP_DEFLATED, compresslevel=5) as zf:
-                csv_stream = BytesIO()
-                write_csv(df, csv_stream)
-                zf.writestr(filename, csv_stream.getvalue())
-                zf.writestr("README.txt", readme)
-                zf.writestr("TERMS_OF_USE.txt", terms)
-                zf.write(LOGO_PATH, "SARP_logo.png")
+    write_download_zip(get_archive_path(key, barrier_type), filename, schema, batches, readme, terms, format)
 
-    await set_progress(ctx["redis"], ctx["job_id"], "100", "All done")
+    return f"{key}/{barrier_type}.zip"
 
-    return f"{tmp_dir.name}/{barrier_type}.zip"
 
-
-@router.get("/downloads/status/{job_id}")
-async def get_download_job_status(job_id: str):
-    """Return the status of a download job.
+async def get_job_status(redis, job_id, client):
+    """Get the status of a download job.
 
     Job status values derived from JobStatus enum at:
     https://github.com/samuelcolvin/arq/blob/master/arq/jobs.py
     ['deferred', 'queued', 'in_progress', 'complete', 'not_found']
 
-    We add ['success', 'failed'] status values here.
+    We add ['success', 'failed', 'cancelled'] status values here.
+
+    Parameters
+    ----------
+    redis : ArqRedis
+    job_id : str
+    client : str
+        IP address of client that requested the status
+
+    Returns
+    -------
+    dict
+        {"status": "...", "progress": 0-100, "path": "...only if complete...", "detail": "...only if failed, cancelled, or not found..."}
+    """
+    job = Job(job_id, redis=redis, _queue_name=REDIS_QUEUE)
+    job_status = await job.status()
+
+    if job_status == JobStatus.not_found:
+        return {
+            "status": job_status,
+            "detail": "Job not found; it may have been cancelled, timed out, or the server restarted.  Please try again.",
+        }
+
+    if job_status != JobStatus.complete:
+        # jobs are cancelled if their status is not requested by any client
+        await set_job_polled(redis, job_id, client)
+
+    # TODO: proof by turning off redis
+    if job_status == JobStatus.queued:
+        job_info = await job.info()
+        elapsed_time = datetime.now(tz=job_info.enqueue_time.tzinfo) - job_info.enqueue_time
+
+        return {
+            "status": job_status,
+            "progress": 0,
+            "queue_position": await get_queue_position(redis, job_id),
+            "elapsed_time": elapsed_time.seconds,
+        }
+
+    if job_status != JobStatus.complete:
+        progress, message = await get_progress(redis, job_id)
+
+        return {
+            "status": job_status,
+            "progress": progress,
+            "message": message,
+        }
+
+    # cancelled by a client or because its status was no longer requested
+    result = await job.result_info()
+    if (
+        result is not None
+        and not result.success
+        and isinstance(result.result, (asyncio.CancelledError, DownloadCancelled))
+    ):
+        return {"status": "cancelled", "detail": "Job was cancelled.  Please try again."}
+
+    try:
+        # this re-raises the underlying exception raised in the worker
+        zip_filename = await job.result()
+
+    # raise timeout to caller to retry
+    except TimeoutError as ex:
+        raise ex
+
+    except Exception as ex:
+        log.error(ex)
+        return {"status": "failed", "detail": "Internal server error"}
+
+    return {"status": "success", "progress": 100, "path": f"/downloads/custom/{zip_filename}"}
+
+
+@router.get("/downloads/status/{job_id}")
+async def get_download_job_status(request: Request, job_id: str):
+    """Return the status of a download job.
+
+    See get_job_status() for status values.  Use the /stream endpoint below to
+    receive updates as they happen instead of polling this endpoint.
 
     Parameters
     ----------
@@ -259,90 +574,123 @@ async def get_download_job_status(job_id: str):
     # loop until return or hit number of retries in case of redis timeout
     retry = 0
     while retry <= 5:
-        redis = None
-
         try:
-            redis = await arq.create_pool(REDIS)
+            redis = await get_redis_pool()
+            content = await get_job_status(redis, job_id, get_client(request))
 
-            job = Job(job_id, redis=redis, _queue_name=REDIS_QUEUE)
-            job_status = await job.status()
+            if content["status"] == JobStatus.not_found:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=content["detail"])
 
-            if job_status == JobStatus.not_found:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="Job not found; it may have been cancelled, timed out, or the server restarted.  Please try again.",
-                )
+            if content["status"] == "failed":
+                raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=content["detail"])
 
-            # TODO: proof by turning off redis
-            if job_status == JobStatus.queued:
-                job_info = await job.info()
-                elapsed_time = datetime.now(tz=job_info.enqueue_time.tzinfo) - job_info.enqueue_time
-
-                queued = [
-                    j[0]
-                    for j in sorted(
-                        [(job.job_id, job.enqueue_time) for job in await redis.queued_jobs(queue_name=REDIS_QUEUE)],
-                        key=lambda x: x[1],
-                    )
-                ]
-
-                return JSONResponse(
-                    content={
-                        "status": job_status,
-                        "progress": 0,
-                        "queue_position": queued.index(job_id),
-                        "elapsed_time": elapsed_time.seconds,
-                    }
-                )
+            if content["status"] == "cancelled":
+                raise HTTPException(status_code=status.HTTP_410_GONE, detail=content["detail"])
 
-            if job_status != JobStatus.complete:
-                progress, message = await get_progress(redis, job_id)
+            return JSONResponse(content=content)
 
-                return JSONResponse(
-                    content={
-                        "status": job_status,
-                        "progress": progress,
-                        "message": message,
-                    }
-                )
+        # in case we hit a Redis timeout while polling job status, make sure we don't break until connection cannot be re-established
+        except TimeoutError as ex:
+            retry += 1
+            log.error(f"Redis connection timeout, retry {retry}")
+            await asyncio.sleep(1)
 
-            info = await job.result_info()
+            if retry >= 5:
+                raise ex
 
-            try:
-                # this re-raises the underlying exception raised in the worker
-                zip_filename = await job.result()
 
-                if info.success:
-                    return JSONResponse(
-                        content={
-                            "status": "success",
-                            "path": f"/downloads/custom/{zip_filename}",
-                        }
-                    )
+async def _stream_job_status(redis, job_id, client):
+    """Yield Server-Sent Events with the status of a job until it is complete.
 
-            # raise timeout to outer retry loop
-            except TimeoutError as ex:
-                raise ex
+    Status is sent when the job starts and whenever progress is published by
+    the worker, and is refreshed at least every STATUS_STREAM_INTERVAL seconds
+    to update the position of queued jobs and detect completion.
+    """
+    pubsub = redis.pubsub()
+    # subscribe before reading the initial status so that no progress is missed
+    await pubsub.subscribe(get_progress_channel(job_id))
 
-            except Exception as ex:
-                log.error(ex)
-                message = "Internal server error"
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Internal server error",
-                )
+    try:
+        while True:
+            content = await get_job_status(redis, job_id, client)
+            yield f"data: {json.dumps(content)}\n\n"
 
-            return JSONResponse(content={"status": "failed", "detail": message})
+            if content["status"] in {"success", "failed", "cancelled", JobStatus.not_found}:
+                break
 
-        # in case we hit a Redis timeout while polling job status, make sure we don't break until connection cannot be re-established
-        except TimeoutError as ex:
-            retry += 1
-            log.error(f"Redis connection timeout, retry {retry}")
-            time.sleep(1)
+            await pubsub.get_message(ignore_subscribe_messages=True, timeout=STATUS_STREAM_INTERVAL)
 
-            if retry >= 5:
-                raise ex
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
 
-        finally:
-            if redis is not None:
-                await redis.aclose()
+
+@router.get("/downloads/status/{job_id}/stream")
+async def stream_download_job_status(request: Request, job_id: str):
+    """Stream the status of a download job as Server-Sent Events.
+
+    Each event contains the same JSON as returned by the polling endpoint
+    above; the stream ends once the job succeeds, fails, is cancelled, or is not
+    found.
+
+    Parameters
+    ----------
+    job_id : str
+    """
+    try:
+        redis = await get_redis_pool()
+
+    except Exception as ex:
+        log.error(f"Error connecting to Redis, is Redis offline?  {ex}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal server error")
+
+    return StreamingResponse(
+        _stream_job_status(redis, job_id, get_client(request)),
+        media_type="text/event-stream",
+        # prevent proxies from buffering events
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/downloads/cancel/{job_id}")
+async def cancel_download_job(request: Request, job_id: str):
+    """Cancel a download job that is queued or in progress.
+
+    Jobs are shared by all clients that make the same request, so the job is
+    only cancelled if no other client is still requesting its status;
+    otherwise the client stops waiting for it and the job continues.
+
+    The job is cancelled by the background worker, which stops creating the
+    download before its next batch of records; its status is "cancelled" once
+    this is complete.  Jobs that are already complete are not changed.
+
+    Parameters
+    ----------
+    job_id : str
+
+    Returns
+    -------
+    JSON
+        {"status": "cancelling"}, {"status": "detached"} if other clients are
+        waiting for the job, or the status of a complete job (see get_job_status())
+    """
+    try:
+        redis = await get_redis_pool()
+        job_status = await Job(job_id, redis=redis, _queue_name=REDIS_QUEUE).status()
+
+        if job_status == JobStatus.not_found:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+
+        client = get_client(request)
+        if job_status != JobStatus.complete:
+            cancelled = await detach_job_client(redis, job_id, client)
+            return JSONResponse(content={"status": "cancelling" if cancelled else "detached"})
+
+        return JSONResponse(content=await get_job_status(redis, job_id, client))
+
+    except HTTPException:
+        raise
+
+    except Exception as ex:
+        log.error(f"Error cancelling background task, is Redis offline?  {ex}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal server error")
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.requests import Request
+import numpy as np
 import pyarrow as pa
 import pyarrow.compute as pc
 
@@ -12,7 +13,9 @@ from api.constants import (
 )
 
 from api.dependencies import get_unit_ids, get_filter_params
-from api.lib.extract import extract_records
+from api.lib.cache import get_cache_key, get_cached_response, cache_response
+from api.lib.executor import admit, run_in_thread
+from api.lib.extract import estimate_record_count, extract_records, query_summary
 from api.logger import log, log_request
 from api.response import feather_response
 
@@ -20,6 +23,55 @@ from api.response import feather_response
 router = APIRouter()
 
 
+def summarize_records(barrier_type, unit_ids, filters, filter_fields, ranked_only):
+    """Count records for each unique combination of filter fields and calculate
+    the bounds of all records that meet the filter.
+
+    Parameters
+    ----------
+    barrier_type : str
+    unit_ids : dict
+        dict of {<unit type>:[...unit ids...], ...}
+    filters : dict
+        dict of {<field>: (<filter type>, <filter values>), ...}
+    filter_fields : list
+    ranked_only : bool
+
+    Returns
+    -------
+    (pyarrow.Table, list, int)
+        table of counts, bounds [xmin, ymin, xmax, ymax], number of records
+    """
+    summary = query_summary(barrier_type, unit_ids, filters, filter_fields, ranked_only=ranked_only)
+    if summary is not None:
+        return summary
+
+    df = extract_records(
+        barrier_type,
+        unit_ids=unit_ids,
+        filters=filters,
+        columns=["id", "lon", "lat"] + filter_fields,
+        ranked_only=ranked_only,
+    )
+    num_records = len(df)
+
+    # extract extent
+    xmin, xmax = pc.min_max(df["lon"]).as_py().values()
+    ymin, ymax = pc.min_max(df["lat"]).as_py().values()
+    bounds = [xmin, ymin, xmax, ymax]
+
+    # group by filter fields, in order of the first record in each group
+    # (the cube above returns them in the same order)
+    df = df.append_column("_row", pa.array(np.arange(num_records, dtype="uint32")))
+    counts = (
+        df.group_by(filter_fields, use_threads=False).aggregate([("id", "count"), ("_row", "min")]).sort_by("_row_min")
+    )
+    # cast count to uint32
+    counts = counts.select(filter_fields).append_column("_count", counts["id_count"].cast("uint32"))
+
+    return counts, bounds, num_records
+
+
 @router.get("/{barrier_type}/query")
 async def query(
     request: Request,
@@ -34,6 +86,7 @@ async def query(
 
     Query parameters:
     id: list of ids
+    bbox: xmin,ymin,xmax,ymax and / or polygon: hex-encoded WKB, to select barriers by location
     """
 
     log_request(request)
@@ -64,31 +117,25 @@ async def query(
                 status_code=status.HTTP_400_BAD_REQUEST, detail=f"query is not supported for {barrier_type}"
             )
 
-    # always extract ranked barriers unless type is road_crossings (not applicable)
-    df = extract_records(
-        barrier_type,
-        unit_ids=unit_ids,
-        filters=filters,
-        columns=["id", "lon", "lat"] + filter_fields,
-        ranked_only=barrier_type != "road_crossings",
-    )
+    cache_key = get_cache_key("query", barrier_type=barrier_type, unit_ids=unit_ids, filters=filters)
+    response = await get_cached_response(request, cache_key)
+    if response is not None:
+        return response
 
-    # extract extent
-    xmin, xmax = pc.min_max(df["lon"]).as_py().values()
-    ymin, ymax = pc.min_max(df["lat"]).as_py().values()
-    bounds = [xmin, ymin, xmax, ymax]
+    # always extract ranked barriers unless type is road_crossings (not applicable)
+    ranked_only = barrier_type != "road_crossings"
 
-    # group by filter fields
-    counts = df.group_by(filter_fields).aggregate([("id", "count")])
-    schema = counts.schema
-    # cast count to uint32
-    fields = [pa.field("id_count", "uint32") if c == "id_count" else schema.field(c) for c in schema.names]
-    counts = counts.cast(pa.schema(fields))
+    # the estimate reads the indexes, so it is calculated in the thread pool
+    cost = await run_in_thread(estimate_record_count, barrier_type, unit_ids, filters, ranked_only=ranked_only)
+    async with admit(cost):
+        counts, bounds, num_records = await run_in_thread(
+            summarize_records, barrier_type, unit_ids, filters, filter_fields, ranked_only
+        )
 
-    counts = counts.rename_columns(["_count" if c == "id_count" else c for c in counts.column_names])
+        log.info(
+            f"query selected {num_records:,} {barrier_type.replace('_', ' ')} ({len(counts):,} unique combinations of fields)"
+        )
 
-    log.info(
-        f"query selected {len(df):,} {barrier_type.replace('_', ' ')} ({len(counts):,} unique combinations of fields)"
-    )
+        response = await run_in_thread(feather_response, counts, bounds)
 
-    return feather_response(counts, bounds)
+    return await cache_response(cache_key, response)
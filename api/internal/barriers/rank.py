@@ -7,7 +7,10 @@ from api.lib.compression import pack_bits
 from api.lib.tiers import calculate_tiers, METRICS
 from api.constants import RankedBarrierTypes
 from api.dependencies import get_unit_ids, get_filter_params
-from api.lib.extract import extract_records
+from api.lib.cache import get_cache_key, get_cached_response, cache_response
+from api.lib.executor import admit, run_in_process, run_in_thread
+from api.lib.extract import estimate_record_count, extract_records
+from api.lib.profile import stage
 from api.logger import log, log_request
 from api.response import feather_response
 
@@ -15,6 +18,49 @@ from api.response import feather_response
 router = APIRouter()
 
 
+def tiers_response(df, tiers):
+    """Pack tiers of each record into a feather response, with the bounds of
+    the records.
+
+    Parameters
+    ----------
+    df : pyarrow.Table
+        records with id, lat, and lon columns
+    tiers : pyarrow.Table
+        tiers calculated by calculate_tiers
+
+    Returns
+    -------
+    fastapi Response
+    """
+    # extract extent
+    xmin, xmax = pc.min_max(df["lon"]).as_py().values()
+    ymin, ymax = pc.min_max(df["lat"]).as_py().values()
+    bounds = [xmin, ymin, xmax, ymax]
+
+    # pack each tier scenario into a separate 16 bit number to save space
+    # 5 bits holds values 0...21 after subtracting offset
+    tier_scenarios = ["NC", "WC", "NCWC"]
+    full_tier_pack_bits = [{"field": f"{scenario}_tier", "bits": 5, "value_shift": 1} for scenario in tier_scenarios]
+    perennial_tier_pack_bits = [
+        {"field": f"P{scenario}_tier", "bits": 5, "value_shift": 1} for scenario in tier_scenarios
+    ]
+    mainstem_tier_pack_bits = [
+        {"field": f"M{scenario}_tier", "bits": 5, "value_shift": 1} for scenario in tier_scenarios
+    ]
+
+    tiers = pa.Table.from_pydict(
+        {
+            "id": df["id"],
+            "full": pack_bits(tiers, full_tier_pack_bits),
+            "perennial": pack_bits(tiers, perennial_tier_pack_bits),
+            "mainstem": pack_bits(tiers, mainstem_tier_pack_bits),
+        }
+    )
+
+    return feather_response(tiers, bounds=bounds)
+
+
 @router.get("/{barrier_type}/rank")
 async def rank(
     request: Request,
@@ -30,6 +76,7 @@ async def rank(
     Query parameters:
     * id: list of ids
     * filters are defined using a lowercased version of column name and a comma-delimited list of values
+    * bbox: xmin,ymin,xmax,ymax and / or polygon: hex-encoded WKB, to select barriers by location
     """
 
     log_request(request)
@@ -42,36 +89,29 @@ async def rank(
 
     barrier_type = barrier_type.value
 
-    df = extract_records(
-        barrier_type, unit_ids=unit_ids, filters=filters, columns=["id", "lat", "lon"] + METRICS, ranked_only=True
-    )
-    log.info(f"selected {len(df):,} {barrier_type.replace('_', ' ')} for ranking")
+    cache_key = get_cache_key("rank", barrier_type=barrier_type, unit_ids=unit_ids, filters=filters)
+    response = await get_cached_response(request, cache_key)
+    if response is not None:
+        return response
+
+    # the estimate reads the indexes, so it is calculated in the thread pool
+    cost = await run_in_thread(estimate_record_count, barrier_type, unit_ids, filters, ranked_only=True)
+    async with admit(cost):
+        df = await run_in_thread(
+            extract_records,
+            barrier_type,
+            unit_ids=unit_ids,
+            filters=filters,
+            columns=["id", "lat", "lon"] + METRICS,
+            ranked_only=True,
+            with_metric_ranks=True,
+        )
+        log.info(f"selected {len(df):,} {barrier_type.replace('_', ' ')} for ranking")
 
-    # extract extent
-    xmin, xmax = pc.min_max(df["lon"]).as_py().values()
-    ymin, ymax = pc.min_max(df["lat"]).as_py().values()
-    bounds = [xmin, ymin, xmax, ymax]
+        # only send the columns used for ranking to the process pool
+        with stage("calculate_tiers"):
+            tiers = await run_in_process(calculate_tiers, df.drop(["id", "lat", "lon"]))
 
-    tiers = calculate_tiers(df)
+        response = await run_in_thread(tiers_response, df, tiers)
 
-    # pack each tier scenario into a separate 16 bit number to save space
-    # 5 bits holds values 0...21 after subtracting offset
-    tier_scenarios = ["NC", "WC", "NCWC"]
-    full_tier_pack_bits = [{"field": f"{scenario}_tier", "bits": 5, "value_shift": 1} for scenario in tier_scenarios]
-    perennial_tier_pack_bits = [
-        {"field": f"P{scenario}_tier", "bits": 5, "value_shift": 1} for scenario in tier_scenarios
-    ]
-    mainstem_tier_pack_bits = [
-        {"field": f"M{scenario}_tier", "bits": 5, "value_shift": 1} for scenario in tier_scenarios
-    ]
-
-    tiers = pa.Table.from_pydict(
-        {
-            "id": df["id"],
-            "full": pack_bits(tiers, full_tier_pack_bits),
-            "perennial": pack_bits(tiers, perennial_tier_pack_bits),
-            "mainstem": pack_bits(tiers, mainstem_tier_pack_bits),
-        }
-    )
-
-    return feather_response(tiers, bounds=bounds)
+    return await cache_response(cache_key, response)
@@ -3,13 +3,15 @@ import re
 
 from fastapi import APIRouter, Response
 from fastapi.requests import Request
+import numpy as np
 import pyarrow.compute as pc
 import pyarrow as pa
 from pyarrow.feather import write_feather
-from rapidfuzz import fuzz
+from rapidfuzz import fuzz, process
 
 from api.constants import BARRIER_SEARCH_RESULT_FIELDS
-from api.data import db, search_barriers
+from api.data import db, search_barriers, search_index, search_table
+from api.lib.executor import admit, run_in_thread
 from api.logger import log_request
 
 
@@ -20,23 +22,83 @@ SARPID_REGEX = re.compile(r"^\S\S\d+")
 
 NUM_BARRIER_SEARCH_RESULTS = 10
 
+# maximum number of matches that are ranked by similarity to the query
+MAX_BARRIER_SEARCH_MATCHES = 1000 + NUM_BARRIER_SEARCH_RESULTS
+
+# number of candidate rows from the search index that are checked against the
+# search regex at a time
+SEARCH_CANDIDATE_BATCH_SIZE = 4096
+
 
 def rank_similarity(values, query):
-    return pa.array([fuzz.WRatio(value, query) for value in values], type=pa.float32())
+    return pa.array(process.cdist(values, [query], scorer=fuzz.WRatio, workers=-1)[:, 0], type=pa.float32())
 
 
-@router.get("/barriers/search")
-async def search(request: Request, query: str):
-    """Return top 10 barriers based on text search of name fields or by SARPID
-    (combined name search field created in advance)
+def find_matches(query, filter, columns):
+    """Find the first MAX_BARRIER_SEARCH_MATCHES rows of search_barriers
+    where search_key matches filter.
 
-    Query parameters:
-    query: text search
+    If the search index is available, candidate rows are those that contain a
+    word that starts with the first word of the query and words that contain
+    each of the other words of the query; only these are read from the
+    uncompressed table and checked against filter.  Otherwise, all rows are
+    checked.
+
+    Parameters
+    ----------
+    query : str
+    filter : str
+        regular expression
+    columns : list-like
+
+    Returns
+    -------
+    pyarrow.Table
     """
+    index = search_index.load()
+    if index is None:
+        return search_barriers.to_table(
+            filter=pc.match_substring_regex(pc.field("search_key"), filter, ignore_case=True),
+            columns=columns,
+        )[:MAX_BARRIER_SEARCH_MATCHES]
+
+    # commas are removed from filter, and words may be separated by any whitespace
+    words = re.split(r"\s", query.replace(",", "").lower())
+    table = search_table.load()
+    candidates = index.iter_rows(words[0], [word for word in words[1:] if word], batch_size=SEARCH_CANDIDATE_BATCH_SIZE)
+
+    rows = []
+    num_matches = 0
+    for batch in candidates:
+        if len(batch) == 0:
+            continue
+
+        keys = table["search_key"].take(batch)
+        batch = batch[
+            pc.match_substring_regex(keys, filter, ignore_case=True).fill_null(False).to_numpy(zero_copy_only=False)
+        ]
+
+        rows.append(batch)
+        num_matches += len(batch)
+        if num_matches >= MAX_BARRIER_SEARCH_MATCHES:
+            break
+
+    rows = np.concatenate(rows)[:MAX_BARRIER_SEARCH_MATCHES] if rows else np.empty(0, dtype="uint32")
+
+    return table.select(columns).take(rows)
 
-    log_request(request)
 
-    query = query.strip()
+def search_barriers_response(query):
+    """Find top 10 barriers based on text search of name fields or by SARPID.
+
+    Parameters
+    ----------
+    query : str
+
+    Returns
+    -------
+    fastapi Response
+    """
     total = 0
 
     # search on SARPID
@@ -46,17 +108,19 @@ async def search(request: Request, query: str):
         # strip whitespace if user copy/pasted from sidebar
         query = query.replace(" ", "") + "%"
 
-        total = db.sql("SELECT COUNT(*) FROM search_barriers WHERE SARPID LIKE ?", params=(query,)).fetchone()[0]
+        # NOTE: connections cannot be shared between threads; use a cursor instead
+        with db.cursor() as con:
+            total = con.sql("SELECT COUNT(*) FROM search_barriers WHERE SARPID LIKE ?", params=(query,)).fetchone()[0]
 
-        col_expr = ", ".join([f"{col} AS {col.lower()}" for col in BARRIER_SEARCH_RESULT_FIELDS])
+            col_expr = ", ".join([f"{col} AS {col.lower()}" for col in BARRIER_SEARCH_RESULT_FIELDS])
 
-        matches = db.sql(
-            f"""SELECT {col_expr} FROM search_barriers
-            WHERE SARPID LIKE ?
-            ORDER BY length(SARPID) ASC, SARPID ASC
-            LIMIT {NUM_BARRIER_SEARCH_RESULTS}""",
-            params=(query,),
-        ).arrow()
+            matches = con.sql(
+                f"""SELECT {col_expr} FROM search_barriers
+                WHERE SARPID LIKE ?
+                ORDER BY length(SARPID) ASC, SARPID ASC
+                LIMIT {NUM_BARRIER_SEARCH_RESULTS}""",
+                params=(query,),
+            ).arrow()
 
         # discard pandas metadata and store total count
         matches = matches.replace_schema_metadata({"count": str(total)})
@@ -67,10 +131,7 @@ async def search(request: Request, query: str):
         filter = re.escape(query).replace(",", "").replace("\\ ", r"(((\s)+(\s|\S|\d)*)|(\s))+")
         filter = rf"(^|\s){filter}"
 
-        matches = search_barriers.to_table(
-            filter=pc.match_substring_regex(pc.field("search_key"), filter, ignore_case=True),
-            columns=BARRIER_SEARCH_RESULT_FIELDS + ["search_key", "priority"],
-        )[: 1000 + NUM_BARRIER_SEARCH_RESULTS]
+        matches = find_matches(query, filter, columns=BARRIER_SEARCH_RESULT_FIELDS + ["search_key", "priority"])
 
         total = len(matches)
 
@@ -100,3 +161,18 @@ async def search(request: Request, query: str):
         compression="uncompressed",
     )
     return Response(content=stream.getvalue(), media_type="application/octet-stream")
+
+
+@router.get("/barriers/search")
+async def search(request: Request, query: str):
+    """Return top 10 barriers based on text search of name fields or by SARPID
+    (combined name search field created in advance)
+
+    Query parameters:
+    query: text search
+    """
+
+    log_request(request)
+
+    async with admit(1):
+        return await run_in_thread(search_barriers_response, query.strip())
@@ -0,0 +1,17 @@
+from fastapi import APIRouter
+
+from api.lib.cache import result_cache
+
+
+router = APIRouter()
+
+
+@router.get("/cache/stats")
+async def cache_stats():
+    """Return hit / miss counters and size of the result cache of this worker.
+
+    Returns
+    -------
+    JSON
+    """
+    return result_cache.stats()
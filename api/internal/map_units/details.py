@@ -5,6 +5,7 @@ import pyarrow.compute as pc
 
 from api.constants import Layers, SUMMARY_UNIT_FIELDS
 from api.data import units
+from api.lib.executor import run_in_thread
 from api.logger import log_request
 
 
@@ -19,7 +20,8 @@ async def unit_details(request: Request, layer: Layers, id: str):
 
     filter = (pc.field("layer") == layer) & (pc.field("id") == id)
 
-    record = units.to_table(columns=SUMMARY_UNIT_FIELDS, filter=filter).slice(0)
+    # units are loaded on first use, so these are read in the thread pool
+    record = (await run_in_thread(units.to_table, columns=SUMMARY_UNIT_FIELDS, filter=filter)).slice(0)
 
     if not len(record):
         raise HTTPException(404, detail=f"record not found for {layer}: {id}")
@@ -8,6 +8,8 @@ from pyarrow.feather import write_feather
 
 from api.constants import Layers, SUMMARY_UNIT_FIELDS
 from api.data import units
+from api.lib.cache import get_cache_key, get_cached_response, cache_response
+from api.lib.executor import run_in_thread
 from api.logger import log_request
 
 
@@ -33,9 +35,15 @@ async def unit_list(request: Request, layer: Layers, id: str):
 
     layer = layer.value
 
+    cache_key = get_cache_key("units/list", layer=layer, id=id.split(","))
+    response = await get_cached_response(request, cache_key)
+    if response is not None:
+        return response
+
     filter = (pc.field("layer") == layer) & (pc.field("id").isin(pa.array(id.split(","))))
 
-    records = units.to_table(columns=SUMMARY_UNIT_FIELDS, filter=filter)
+    # units are loaded on first use, so these are read in the thread pool
+    records = await run_in_thread(units.to_table, columns=SUMMARY_UNIT_FIELDS, filter=filter)
 
     if len(records) > MAX_RECORDS:
         raise HTTPException(400, "Too many records requested")
@@ -46,4 +54,4 @@ async def unit_list(request: Request, layer: Layers, id: str):
         stream,
         compression="uncompressed",
     )
-    return Response(content=stream.getvalue(), media_type="application/octet-stream")
+    return await cache_response(cache_key, Response(content=stream.getvalue(), media_type="application/octet-stream"))
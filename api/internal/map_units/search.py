@@ -2,12 +2,12 @@ from io import BytesIO
 
 from fastapi import APIRouter, HTTPException, Response
 from fastapi.requests import Request
-import pyarrow.compute as pc
-import pyarrow as pa
 from pyarrow.feather import write_feather
 
 from api.constants import UNIT_FIELDS, SUMMARY_UNIT_FIELDS
-from api.data import units
+from api.data import unit_search_index
+from api.lib.cache import get_cache_key, get_cached_response, cache_response
+from api.lib.executor import load_in_thread
 from api.logger import log_request
 
 
@@ -38,34 +38,17 @@ async def search_units(request: Request, layer: str, query: str):
     if invalid_layers:
         raise HTTPException(400, detail=f"invalid layers: {', '.join(invalid_layers)}")
 
-    # use case-insensitive search
-    matches = units.to_table(
-        filter=pc.field("layer").isin(layers) & pc.match_substring(pc.field("key"), query.lower(), ignore_case=True)
-    )
-
-    total_count = len(matches)
+    cache_key = get_cache_key("units/search", layers=layers, query=query)
+    response = await get_cached_response(request, cache_key)
+    if response is not None:
+        return response
 
     # find those where the substring is closest to the left of the name and
     # have the shortest names, based on priority order of different unit types
-    matches = (
-        pa.Table.from_pydict(
-            {
-                **{col: matches[col] for col in matches.column_names},
-                "name_ipos": pc.find_substring(matches["key"], query, ignore_case=True),
-                "name_len": pc.utf8_length(matches["name"]),
-            }
-        )
-        .sort_by(
-            [
-                ["priority", "ascending"],
-                ["name_ipos", "ascending"],
-                ["name_len", "ascending"],
-                ["state", "ascending"],
-            ]
-        )
-        .select(SUMMARY_UNIT_FIELDS)[:10]
-        .replace_schema_metadata({"count": str(total_count)})
-    )
+    index = await load_in_thread(unit_search_index)
+    rows, total_count = index.search(layers, query, limit=10)
+
+    matches = index.table.select(SUMMARY_UNIT_FIELDS).take(rows).replace_schema_metadata({"count": str(total_count)})
 
     stream = BytesIO()
     write_feather(
@@ -73,4 +56,4 @@ async def search_units(request: Request, layer: str, query: str):
         stream,
         compression="uncompressed",
     )
-    return Response(content=stream.getvalue(), media_type="application/octet-stream")
+    return await cache_response(cache_key, Response(content=stream.getvalue(), media_type="application/octet-stream"))
@@ -0,0 +1,274 @@
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+from threading import Lock
+
+import pyarrow as pa
+from fastapi.responses import Response
+from redis.exceptions import RedisError
+
+from api.lib.redis_pool import get_redis_pool
+from api.settings import (
+    data_version,
+    RESULT_CACHE_MAX_BYTES,
+    RESULT_CACHE_MAX_ENTRIES,
+    RESULT_CACHE_REDIS,
+    RESULT_CACHE_EXPIRATION,
+)
+
+log = logging.getLogger("api")
+
+
+CACHE_PREFIX = "result-cache:"
+
+
+def _canonical(value):
+    """Convert value to a JSON-serializable value that does not depend on the
+    order of ids or filter values, since these are all evaluated as sets.
+    """
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items()}
+
+    if isinstance(value, pa.Array):
+        value = value.to_pylist()
+
+    if isinstance(value, (list, set)):
+        return sorted({json.dumps(v) for v in value})
+
+    if isinstance(value, tuple):
+        return [_canonical(v) for v in value]
+
+    if hasattr(value, "value"):
+        # enums
+        return value.value
+
+    return value
+
+
+def get_cache_key(endpoint, **params):
+    """Create a canonical key for the result of an endpoint.
+
+    The key includes the data version so that results are not reused across
+    data releases.
+
+    Parameters
+    ----------
+    endpoint : str
+    **params
+        parameters that determine the result, e.g., barrier_type, unit_ids,
+        filters
+
+    Returns
+    -------
+    str
+    """
+    content = json.dumps(
+        {"endpoint": endpoint, "data_version": data_version, **_canonical(params)},
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(content.encode("UTF8")).hexdigest()
+
+
+class ResultCache:
+    """Bounded LRU cache of serialized responses, optionally shared across
+    workers via Redis.
+
+    Parameters
+    ----------
+    max_bytes : int
+        maximum total size of cached response bodies in this process; 0 disables
+        the cache
+    max_entries : int
+        maximum number of cached responses in this process
+    use_redis : bool, optional (default: False)
+        if True, responses are also stored to and retrieved from Redis
+    """
+
+    def __init__(self, max_bytes, max_entries, use_redis=False):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.use_redis = use_redis
+        self.enabled = max_bytes > 0 and max_entries > 0
+
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+        self.size = 0
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        """Return counters of cache usage.
+
+        Returns
+        -------
+        dict
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.size,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _put_local(self, key, media_type, content):
+        size = len(content)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self.size -= len(self._entries.pop(key)[1])
+
+            self._entries[key] = (media_type, content)
+            self.size += size
+
+            while self.size > self.max_bytes or len(self._entries) > self.max_entries:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    async def get(self, key):
+        """Get a cached response, checking this process first and then Redis.
+
+        Parameters
+        ----------
+        key : str
+
+        Returns
+        -------
+        (str, bytes) or None
+            tuple of media type and content, or None if not cached
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        if self.use_redis:
+            try:
+                value = await (await get_redis_pool()).get(f"{CACHE_PREFIX}{key}")
+                if value is not None:
+                    media_type, _, content = value.partition(b"|")
+                    entry = (media_type.decode("UTF8"), content)
+                    self._put_local(key, *entry)
+                    with self._lock:
+                        self.redis_hits += 1
+                    return entry
+
+            except RedisError as ex:
+                log.error(f"Error reading from result cache in Redis: {ex}")
+
+        with self._lock:
+            self.misses += 1
+
+        return None
+
+    async def set(self, key, media_type, content):
+        """Store a response in the cache.
+
+        Parameters
+        ----------
+        key : str
+        media_type : str
+        content : bytes
+        """
+        if not self.enabled:
+            return
+
+        self._put_local(key, media_type, content)
+
+        if self.use_redis:
+            try:
+                await (await get_redis_pool()).setex(
+                    f"{CACHE_PREFIX}{key}", RESULT_CACHE_EXPIRATION, media_type.encode("UTF8") + b"|" + content
+                )
+
+            except RedisError as ex:
+                log.error(f"Error writing to result cache in Redis: {ex}")
+
+
+result_cache = ResultCache(RESULT_CACHE_MAX_BYTES, RESULT_CACHE_MAX_ENTRIES, use_redis=RESULT_CACHE_REDIS)
+
+
+def get_etag(key):
+    """Create a strong ETag for the response identified by key.
+
+    Responses are fully determined by their key (which includes the data
+    version), so the key itself is used as the entity tag.
+
+    Parameters
+    ----------
+    key : str
+
+    Returns
+    -------
+    str
+    """
+    return f'"{key}"'
+
+
+async def get_cached_response(request, key):
+    """Return a response for key from the cache, if available.
+
+    If the request has an If-None-Match header that matches the ETag for key,
+    a 304 (Not Modified) response is returned without checking the cache.
+
+    Parameters
+    ----------
+    request : Request
+    key : str
+
+    Returns
+    -------
+    Response or None
+    """
+    etag = get_etag(key)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and (
+        if_none_match.strip() == "*" or etag in (tag.strip() for tag in if_none_match.split(","))
+    ):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    entry = await result_cache.get(key)
+    if entry is None:
+        return None
+
+    media_type, content = entry
+    return Response(content=content, media_type=media_type, headers={"ETag": etag})
+
+
+async def cache_response(key, response):
+    """Store response in the cache and add ETag header.
+
+    Parameters
+    ----------
+    key : str
+    response : Response
+
+    Returns
+    -------
+    Response
+    """
+    await result_cache.set(key, response.media_type, response.body)
+    response.headers["ETag"] = get_etag(key)
+    return response
@@ -1,73 +1,141 @@
-import numpy as np
 import pyarrow as pa
+import pyarrow.compute as pc
 
 from api.constants import DOMAINS, MULTI_VALUE_DOMAINS
+from api.lib.profile import stage
 
 
-def unpack_field(arr, lookup):
-    """Unpack domain codes to string values for a single field, using numpy.
-    Values that are not present in lookup are assigned empty string.
+def build_lookup(lookup):
+    """Build Arrow arrays of the codes and values of a domain lookup, so that
+    codes can be decoded to values without converting them to Python objects.
 
     Parameters
     ----------
-    column : array-like
     lookup : dict
         lookup of codes to values
 
     Returns
     -------
-    np.array
+    (pyarrow.Array, pyarrow.Array)
+        codes and values of lookup; values has an additional empty string at
+        the end for codes that are not present in lookup
     """
-    u, inv = np.unique(arr, return_inverse=True)
-    return np.array([lookup.get(x, "") for x in u], dtype=str)[inv].reshape(inv.shape)
+    return pa.array(list(lookup.keys())), pa.array(list(lookup.values()) + [""], type="string")
+
+
+# lookups of codes and values of each domain field, built once on import
+DOMAIN_LOOKUPS = {field: build_lookup(lookup) for field, lookup in DOMAINS.items()}
+
+
+def _to_dictionary(indices, values):
+    """Create dictionary array from indices and values, preserving chunks.
+
+    Parameters
+    ----------
+    indices : pyarrow.Array or pyarrow.ChunkedArray
+        int32 indices into values
+    values : pyarrow.Array
+
+    Returns
+    -------
+    pyarrow.DictionaryArray or pyarrow.ChunkedArray
+    """
+    if isinstance(indices, pa.ChunkedArray):
+        return pa.chunked_array(
+            [pa.DictionaryArray.from_arrays(chunk, values) for chunk in indices.chunks],
+            type=pa.dictionary(pa.int32(), values.type),
+        )
+
+    return pa.DictionaryArray.from_arrays(indices, values)
+
+
+def unpack_field(arr, codes, values):
+    """Unpack domain codes to string values for a single field, as a dictionary
+    array of values.  Values that are not present in codes are assigned empty
+    string.
+
+    Codes are matched to values using a hash lookup in Arrow, so this does not
+    create Python or numpy string values for each record.
+
+    Parameters
+    ----------
+    arr : pyarrow.Array or pyarrow.ChunkedArray
+    codes : pyarrow.Array
+    values : pyarrow.Array
+        values of each code, followed by an empty string (see build_lookup)
+
+    Returns
+    -------
+    pyarrow.DictionaryArray or pyarrow.ChunkedArray
+    """
+    indices = pc.index_in(arr.cast(codes.type), value_set=codes).fill_null(len(codes))
+    return _to_dictionary(indices, values)
 
 
 def unpack_multivalue_field(arr, lookup):
-    """Unpack multi-value domain codes to string values for a single field,
-    using numpy. Values that are not present in lookup are assigned empty string.
+    """Unpack multi-value domain codes to string values for a single field, as
+    a dictionary array of values. Values that are not present in lookup are
+    assigned empty string.
 
-    This first finds all unique values of the multi-value field, then creates
-    a new lookup table for those to their expanded string versions
+    This first dictionary-encodes the unique combinations of codes, then
+    expands only those to their string versions
 
     Parameters
     ----------
-    column : array-like
+    arr : pyarrow.Array or pyarrow.ChunkedArray
     lookup : dict
         lookup of codes to values
 
     Returns
     -------
-    np.array
+    pyarrow.DictionaryArray
     """
+    if isinstance(arr, pa.ChunkedArray):
+        arr = arr.combine_chunks()
+
+    # expand unique combinations of codes to combinations of values
+    encoded = pc.dictionary_encode(arr)
+    values = pa.array(
+        [
+            ", ".join([lookup[k] for k in combination.split(",") if combination])
+            for combination in encoded.dictionary.to_pylist()
+        ]
+        + [""],
+        type="string",
+    )
 
-    # expand unique combinations of codes to combinations of values for lookup
-    u, inv = np.unique(arr, return_inverse=True)
-    expanded_lookup = {
-        combination: ", ".join([lookup[k] for k in combination.split(",") if combination]) for combination in u
-    }
-    return np.array([expanded_lookup.get(x, "") for x in u], dtype=str)[inv].reshape(inv.shape)
+    indices = encoded.indices.cast("int32").fill_null(len(values) - 1)
+    return _to_dictionary(indices, values)
 
 
+@stage("unpack_domains")
 def unpack_domains(df):
     """Unpack domain codes to values.
 
+    Domain fields are returned as dictionary arrays of string values, which
+    are written to CSV as their values.
+
     See analysis.export.lib for version for Pandas DataFrames
 
     Parameters
     ----------
-    df : pyarrow.Table
+    df : pyarrow.Table or pyarrow.RecordBatch
+
+    Returns
+    -------
+    pyarrow.Table
     """
 
     schema = df.schema.remove_metadata()
     arrays = []
     for i, field in enumerate(schema.names):
         if field in DOMAINS:
-            unpacked = unpack_field(df[field], DOMAINS[field])
-            # force domain fields to string type
-            schema = schema.set(i, pa.field(field, "string"))
+            unpacked = unpack_field(df[field], *DOMAIN_LOOKUPS[field])
+            schema = schema.set(i, pa.field(field, unpacked.type))
 
         elif field in MULTI_VALUE_DOMAINS:
             unpacked = unpack_multivalue_field(df[field], MULTI_VALUE_DOMAINS[field])
+            schema = schema.set(i, pa.field(field, unpacked.type))
 
         else:
             unpacked = df[field]
@@ -1,10 +1,282 @@
+from itertools import chain
+import os
+from pathlib import Path
+import shutil
+import tempfile
+from time import localtime, time
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED
+
+import numpy as np
 import pyarrow as pa
 import pyarrow.compute as pc
+from pyarrow.csv import CSVWriter
+import pyarrow.parquet as pq
 
-from api.constants import FullySupportedBarrierTypes, Scenarios, CUSTOM_TIER_FIELDS
+from api.constants import FullySupportedBarrierTypes, Scenarios, LOGO_PATH
+from api.data import barrier_datasets, barrier_tables
+from api.lib.cache import get_cache_key
 from api.lib.domains import unpack_domains
-from api.lib.extract import extract_records
-from api.lib.tiers import calculate_tiers
+from api.lib.extract import extract_records, get_record_count, scan_rows, select_rows, take_rows
+from api.lib.metrics import add_request_stat
+from api.lib.profile import sample_thread, stage
+from api.lib.tiers import calculate_tiers, METRIC_RANK_FIELDS
+from api.lib.zip import open_zip_entry
+from api.settings import CUSTOM_DOWNLOAD_DIR
+
+
+# maximum number of records converted to CSV at a time when writing downloads
+DOWNLOAD_BATCH_SIZE = 65536
+
+
+def _slice_batches(batches, batch_size):
+    """Split record batches into tables of at most batch_size records, skipping
+    empty batches.
+    """
+    for batch in batches:
+        for offset in range(0, len(batch), batch_size):
+            yield pa.Table.from_batches([batch.slice(offset, batch_size)])
+
+
+def _scan_batches(barrier_type, rows, unit_ids, filters, columns, ranked_only):
+    """Scan the selected rows in batches if rows were selected using the
+    indexes or resident table, otherwise scan the dataset using the filter.
+    """
+    if rows is not None:
+        return scan_rows(barrier_type, rows, columns).to_batches()
+
+    return extract_records(
+        barrier_type, unit_ids=unit_ids, filters=filters, columns=columns, ranked_only=ranked_only, as_table=False
+    ).to_batches()
+
+
+def _get_empty_habitat_columns(batches, spp_cols):
+    """Find species habitat columns that have no useful data for the selected
+    records, by scanning only those columns in batches.
+    """
+    max_values = dict.fromkeys(spp_cols)
+    for batch in batches:
+        if len(batch) == 0:
+            continue
+
+        for col in spp_cols:
+            value = pc.max(batch[col]).as_py()
+            if value is not None and (max_values[col] is None or value > max_values[col]):
+                max_values[col] = value
+
+    return [c for c in spp_cols if max_values[c] is None or max_values[c] <= 0]
+
+
+def _split_rows_by_network(barrier_type, rows):
+    """Split the positions of selected rows into those with networks and those
+    without networks.
+    """
+    table = barrier_tables.get(barrier_type)
+    if table is not None:
+        has_network = table["HasNetwork"].take(rows)
+    else:
+        has_network = barrier_datasets[barrier_type].take(rows, columns=["HasNetwork"])["HasNetwork"]
+
+    has_network = has_network.to_numpy(zero_copy_only=False)
+    return rows.filter(pa.array(has_network)), rows.filter(pa.array(~has_network))
+
+
+def _iter_ranked_batches(df, sort, batch_size):
+    """Calculate custom tiers for the ranked records in df, then yield batches
+    in order of HasNetwork and tier for the sort scenario, with tiers appended
+    to each batch.
+
+    Unlike the other download batches, this requires all selected records in
+    memory because tiers are relative to all ranked records.
+    """
+    ranked_ix = np.flatnonzero(df["Ranked"].to_numpy(zero_copy_only=False))
+    with stage("calculate_tiers"):
+        tiers = calculate_tiers(df.take(ranked_ix))
+
+    # use -1 for records that are not ranked
+    tier_arrays = {}
+    for col in tiers.column_names:
+        values = np.full(len(df), -1, dtype="int8")
+        values[ranked_ix] = tiers[col].to_numpy()
+        tier_arrays[col] = pa.array(values)
+
+    tiers = pa.Table.from_pydict(tier_arrays)
+
+    order = pc.sort_indices(
+        pa.Table.from_pydict({"HasNetwork": df["HasNetwork"], "tier": tiers[f"{sort}_tier"]}),
+        sort_keys=[("HasNetwork", "descending"), ("tier", "ascending")],
+    )
+
+    for offset in range(0, len(df), batch_size):
+        ix = order.slice(offset, batch_size)
+        batch = df.take(ix)
+        for col in tiers.column_names:
+            batch = batch.append_column(col, tiers[col].take(ix))
+
+        yield batch
+
+
+class DownloadCancelled(Exception):
+    """Raised when a download is cancelled before it is complete."""
+
+
+def _check_cancelled(batches, cancel):
+    for batch in batches:
+        if cancel.is_set():
+            raise DownloadCancelled("download was cancelled")
+
+        yield batch
+
+
+def _report_progress(batches, progress):
+    rows = 0
+    for batch in batches:
+        yield batch
+
+        # the next batch is requested after this one has been written
+        rows += len(batch)
+        progress(rows)
+
+
+def extract_download_batches(
+    barrier_type: FullySupportedBarrierTypes,
+    unit_ids: dict,
+    filters: dict,
+    columns: list,
+    ranked_only: bool,
+    custom_rank: bool,
+    sort: Scenarios,
+    batch_size: int = DOWNLOAD_BATCH_SIZE,
+    cancel=None,
+    progress=None,
+):
+    """Extract records for download as a stream of tables with domains unpacked,
+    so that only one batch of records needs to be converted to CSV at a time.
+
+    The selected records are resolved once using the indexes or resident
+    table if possible (see api.lib.extract.select_rows()), and only those
+    records are scanned in batches; otherwise the barrier dataset is scanned
+    using the filter.  Records with networks are scanned before those without
+    networks (same order as sorting by HasNetwork), except for road crossings
+    which are not sorted.
+
+    If custom_rank is True, the columns of the selected records are read into
+    memory in order to calculate tiers and sort by tier.
+
+    Parameters
+    ----------
+    barrier_type : FullySupportedBarrierTypes
+    unit_ids : dict
+        dict of {<unit type>:[...unit ids...], ...}
+    filters : dict
+        dict of {<field>: (<filter type>, <filter values>), ...}
+    columns : list
+        list of column names to include in output; must include "id"
+    ranked_only : bool
+    custom_rank : bool
+    sort : Scenarios
+    batch_size : int, optional (default: DOWNLOAD_BATCH_SIZE)
+        maximum number of records in each batch
+    cancel : threading.Event or multiprocessing Event proxy, optional (default: None)
+        if set, DownloadCancelled is raised before the next batch is extracted
+    progress : callable, optional (default: None)
+        called with the number of records written so far after each batch has
+        been consumed by the caller
+
+    Returns
+    -------
+    (pyarrow.Schema, iterator of pyarrow.Table)
+        schema of output tables and iterator of output tables
+    """
+    # resolve the selected rows once using the indexes or resident table, if
+    # possible; otherwise the dataset is scanned using the filter
+    with stage("select"):
+        rows = select_rows(barrier_type, unit_ids, filters, ranked_only=ranked_only)
+
+    if rows is not None:
+        count = len(rows)
+    else:
+        count = get_record_count(barrier_type, unit_ids=unit_ids, filters=filters, ranked_only=ranked_only)
+
+    if count == 0:
+        # output only the header of the (packed) columns
+        schema = barrier_datasets[barrier_type].schema
+        return pa.schema([schema.field(c) for c in columns]), iter([])
+
+    drop_cols = []
+    if barrier_type == "road_crossings":
+        # road crossings are not sorted
+        batches = _slice_batches(
+            _scan_batches(barrier_type, rows, unit_ids, filters, columns, ranked_only),
+            batch_size,
+        )
+
+    else:
+        # drop species habitat columns that have no useful data
+        spp_cols = [c for c in columns if "Habitat" in c and c != "FishHabitatPartnership"]
+        if spp_cols:
+            drop_cols = _get_empty_habitat_columns(
+                _scan_batches(barrier_type, rows, unit_ids, filters, spp_cols, ranked_only), spp_cols
+            )
+
+        # calculate custom ranks
+        # NOTE: can only calculate ranks for those that have networks and are not excluded from ranking
+        if custom_rank:
+            output_cols = [c for c in columns if c not in drop_cols]
+            if rows is not None:
+                with stage("scan"):
+                    df = take_rows(barrier_type, rows, columns=output_cols, with_metric_ranks=True)
+
+            else:
+                df = extract_records(
+                    barrier_type,
+                    unit_ids=unit_ids,
+                    filters=filters,
+                    columns=output_cols,
+                    ranked_only=ranked_only,
+                    with_metric_ranks=True,
+                )
+
+            batches = _iter_ranked_batches(df, sort, batch_size)
+
+        elif rows is not None:
+            # scan records with networks before those without networks
+            batches = chain.from_iterable(
+                _slice_batches(scan_rows(barrier_type, network_rows, columns).to_batches(), batch_size)
+                for network_rows in _split_rows_by_network(barrier_type, rows)
+            )
+
+        else:
+            batches = chain.from_iterable(
+                _slice_batches(
+                    _scan_batches(
+                        barrier_type,
+                        None,
+                        unit_ids,
+                        {**filters, "HasNetwork": ("in_array", [has_network])},
+                        columns,
+                        ranked_only,
+                    ),
+                    batch_size,
+                )
+                for has_network in (True, False)
+            )
+
+    def unpack(df):
+        return unpack_domains(
+            df.drop([c for c in ["id"] + drop_cols + list(METRIC_RANK_FIELDS.values()) if c in df.column_names])
+        )
+
+    if cancel is not None:
+        batches = _check_cancelled(batches, cancel)
+
+    batches = map(unpack, batches)
+
+    if progress is not None:
+        batches = _report_progress(batches, progress)
+
+    # use the first batch to determine the output schema
+    first = next(batches)
+    return first.schema, chain([first], batches)
 
 
 def extract_for_download(
@@ -15,54 +287,310 @@ def extract_for_download(
     ranked_only: bool,
     custom_rank: bool,
     sort: Scenarios,
+    cancel=None,
 ):
-    df = extract_records(
+    """Extract all records for download into a single table.
+
+    See extract_download_batches() for parameters.
+
+    Returns
+    -------
+    pyarrow.Table
+    """
+    schema, batches = extract_download_batches(
         barrier_type,
         unit_ids=unit_ids,
         filters=filters,
         columns=columns,
         ranked_only=ranked_only,
+        custom_rank=custom_rank,
+        sort=sort,
+        cancel=cancel,
     )
 
-    if len(df) == 0:
-        return df
+    return pa.Table.from_batches([batch for table in batches for batch in table.to_batches()], schema=schema)
 
-    if barrier_type != "road_crossings":
-        # drop species habitat columns that have no useful data
-        spp_cols = [c for c in df.column_names if "Habitat" in c and c != "FishHabitatPartnership"]
-        drop_cols = [c for c in spp_cols if pc.max(df[c]).as_py() <= 0]
-        if len(drop_cols) > 0:
-            df = df.drop(drop_cols)
 
-        # calculate custom ranks
-        # NOTE: can only calculate ranks for those that have networks and are not excluded from ranking
-        if custom_rank:
-            to_rank = df.filter(pc.equal(df["Ranked"], True))
-            tiers = calculate_tiers(to_rank)
-            # cast to int8 to allow setting -1 null values
-            tiers = tiers.cast(pa.schema([pa.field(c, "int8") for c in tiers.column_names])).add_column(
-                0, to_rank.schema.field("id"), to_rank["id"]
-            )
+class _StreamBuffer:
+    """Write-only, non-seekable file-like object that accumulates bytes written
+    to it until they are read out using pop(), so that ZipFile writes entries
+    in streaming mode (with data descriptors after the data).
+    """
 
-            # join back to full data frame
-            df = df.join(tiers, "id")
+    def __init__(self):
+        self._buffer = bytearray()
 
-            if len(to_rank) < len(df):
-                # fill missing values
-                df = pa.Table.from_pydict(
-                    {
-                        **{col: df[col] for col in df.column_names if col not in CUSTOM_TIER_FIELDS},
-                        **{col: df[col].fill_null(-1) for col in df.column_names if col in CUSTOM_TIER_FIELDS},
-                    }
-                )
+    def write(self, data):
+        self._buffer += data
+        return len(data)
 
-            # Sort by HasNetwork, tier
-            df = df.sort_by([("HasNetwork", "descending"), (f"{sort}_tier", "ascending")])
+    def flush(self):
+        pass
 
-        else:
-            # sort only HasNetwork
-            df = df.sort_by([("HasNetwork", "descending")])
+    def pop(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+# formats that are compressed by their writer, so that the data file is stored
+# in the zip file without deflating it again
+STORED_FORMATS = {"csv.zst", "parquet", "arrows"}
+
+
+def _open_data_entry(zf, filename, format):
+    if format in STORED_FORMATS:
+        info = ZipInfo(filename, date_time=localtime()[:6])
+        info.compress_type = ZIP_STORED
+        info.external_attr = 0o644 << 16
+        # force ZIP64 because the size of the file is not known in advance
+        entry = zf.open(info, "w", force_zip64=True)
+
+        if format == "csv.zst":
+            return pa.CompressedOutputStream(entry, "zstd")
+
+        return entry
+
+    return open_zip_entry(zf, filename)
+
+
+def _open_data_writer(entry, schema, format):
+    """Open a writer of tables in format to entry.
+
+    Domain fields are dictionary-encoded (see unpack_domains()); these are
+    written as dictionary-encoded columns in Parquet and Arrow IPC.  The
+    dictionaries of multi-value domain fields differ between batches, so Arrow
+    IPC uses the stream format, which allows replacing dictionaries, rather
+    than the file format.
+
+    Returns
+    -------
+    writer with write_table() and close()
+    """
+    match format:
+        case "parquet":
+            return pq.ParquetWriter(entry, schema, compression="zstd")
+
+        case "arrows":
+            return pa.ipc.new_stream(entry, schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+
+        case _:
+            return CSVWriter(entry, schema)
+
+
+def _write_zip(out, filename, schema, batches, readme, terms, format="csv"):
+    """Write batches to a data file in format within a zip file, followed by
+    metadata files.
+
+    This is a generator that yields after writing each batch, so that the
+    caller can consume the compressed bytes written to out.
+    """
+    with ZipFile(out, "w", compression=ZIP_DEFLATED, compresslevel=5) as zf:
+        with _open_data_entry(zf, filename, format) as entry:
+            writer = _open_data_writer(entry, schema, format)
+            for batch in batches:
+                writer.write_table(batch)
+                add_request_stat("rows_returned", len(batch))
+                yield
+
+            writer.close()
+
+        zf.writestr("README.txt", readme)
+        zf.writestr("TERMS_OF_USE.txt", terms)
+        zf.write(LOGO_PATH, "SARP_logo.png")
+
+    yield
+
+
+def write_download_zip(path, filename, schema, batches, readme, terms, format="csv"):
+    """Write download batches to a data file within a zip file, along with
+    README, terms of use, and logo.
+
+    CSV files are deflated using ZIP_THREADS threads (see api.lib.zip).  Other
+    formats are compressed using zstd and stored in the zip file without
+    further compression: "csv.zst" (CSV), "parquet" (Parquet with one row
+    group per batch), or "arrows" (Arrow IPC stream).
+
+    The zip file is written to a temporary file in the same directory and then
+    moved into place, so that a partially written zip file is never visible
+    at path.
+
+    Parameters
+    ----------
+    path : str or Path
+        output zip filename
+    filename : str
+        name of CSV file within zip file
+    schema : pyarrow.Schema
+    batches : iterator of pyarrow.Table
+    readme : str
+    terms : str
+    format : {"csv", "csv.zst", "parquet", "arrows"}, optional (default: "csv")
+    """
+    path = Path(path)
+    fd, tmp_filename = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as out, stage("zip"):
+            for _ in _write_zip(out, filename, schema, batches, readme, terms, format):
+                pass
+
+        add_request_stat("bytes_serialized", os.path.getsize(tmp_filename))
+
+        # grant permissions to Caddy to read this file; the default is too restrictive
+        os.chmod(tmp_filename, 0o644)
+        os.replace(tmp_filename, path)
+
+    except BaseException:
+        os.unlink(tmp_filename)
+        raise
+
+
+def stream_download_zip(filename, schema, batches, readme, terms, format="csv"):
+    """Stream the contents of a download zip file as it is created.
+
+    See write_download_zip() for parameters.
+
+    Yields
+    ------
+    bytes
+    """
+    out = _StreamBuffer()
+    steps = _write_zip(out, filename, schema, batches, readme, terms, format)
+    while True:
+        # each step may run in a different thread of the server
+        with sample_thread(), stage("zip"):
+            if next(steps, StopIteration) is StopIteration:
+                break
+
+        data = out.pop()
+        if data:
+            add_request_stat("bytes_serialized", len(data))
+            yield data
+
+
+def get_download_key(
+    barrier_type: FullySupportedBarrierTypes,
+    format: str,
+    unit_ids: dict,
+    filters: dict,
+    ranked_only: bool,
+    custom_rank: bool,
+    sort: Scenarios,
+):
+    """Create a key that identifies the download archive for a request.
+
+    This is a hash of the normalized request and the data version; it is used
+    as the directory name of the archive and as the ID of the background job
+    that creates it, so that identical requests reuse the same archive or job.
+
+    Returns
+    -------
+    str
+    """
+    return get_cache_key(
+        "download",
+        barrier_type=barrier_type,
+        format=format,
+        unit_ids=unit_ids,
+        filters=filters,
+        ranked_only=ranked_only,
+        custom_rank=custom_rank,
+        # sort only affects the output of custom ranks
+        sort=sort if custom_rank else None,
+    )
+
+
+def get_archive_path(key, barrier_type):
+    """Return the path of the download archive for key.
+
+    The directory for the archive is created if it does not already exist.
+
+    Parameters
+    ----------
+    key : str
+        download key from get_download_key()
+    barrier_type : str
+
+    Returns
+    -------
+    Path
+    """
+    path = CUSTOM_DOWNLOAD_DIR / key
+    if not path.exists():
+        path.mkdir(exist_ok=True)
+        # grant permissions to Caddy to read from this directory
+        os.chmod(path, 0o755)
+
+    return path / f"{barrier_type}.zip"
+
+
+def get_archive(key, barrier_type):
+    """Return the path of an existing download archive relative to
+    CUSTOM_DOWNLOAD_DIR, and mark it as recently used.
+
+    Parameters
+    ----------
+    key : str
+        download key from get_download_key()
+    barrier_type : str
+
+    Returns
+    -------
+    str or None
+        relative path, or None if the archive does not exist
+    """
+    path = CUSTOM_DOWNLOAD_DIR / key / f"{barrier_type}.zip"
+    try:
+        # the modification time is used as the last access time for retention
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+
+    return f"{key}/{barrier_type}.zip"
+
+
+def evict_archives(download_dir, max_bytes, retention_time):
+    """Delete the least recently used download archives until the total size of
+    archives is within max_bytes.
+
+    Archives used within the last retention_time seconds are never deleted,
+    so that they are available to download after they are returned.
+
+    Parameters
+    ----------
+    download_dir : Path
+    max_bytes : int
+    retention_time : int
+        seconds
+
+    Returns
+    -------
+    list of Path
+        directories that were deleted
+    """
+    archives = []
+    for path in download_dir.iterdir():
+        if not path.is_dir():
+            continue
+
+        try:
+            stats = [path.stat()] + [f.stat() for f in path.iterdir()]
+        except FileNotFoundError:
+            continue
+
+        last_used = max(s.st_mtime for s in stats)
+        archives.append((last_used, sum(s.st_size for s in stats[1:]), path))
+
+    total = sum(size for _, size, _ in archives)
+    min_time = time() - retention_time
+
+    deleted = []
+    for last_used, size, path in sorted(archives):
+        if total <= max_bytes or last_used >= min_time:
+            break
 
-    df = unpack_domains(df.drop(["id"]))
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        deleted.append(path)
 
-    return df
+    return deleted
@@ -0,0 +1,243 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import contextvars
+from functools import partial
+import multiprocessing
+from threading import Lock
+from time import thread_time
+
+from fastapi import HTTPException, status
+
+from api.lib.metrics import add_request_stat, collect_request_stats, set_request_label
+from api.lib.profile import get_stage_path, sample_thread
+from api.settings import (
+    EXECUTOR_THREADS,
+    EXECUTOR_PROCESSES,
+    EXECUTOR_MAX_REQUESTS,
+    EXECUTOR_MAX_RECORDS,
+    EXECUTOR_RETRY_AFTER,
+)
+
+
+class AdmissionControl:
+    """Limit the number of requests and their total estimated cost (number of
+    records) that are processed at a time.
+
+    A request is always admitted if no other requests are being processed, so
+    that requests larger than max_cost can still be processed one at a time.
+
+    Parameters
+    ----------
+    max_requests : int
+    max_cost : int
+    """
+
+    def __init__(self, max_requests, max_cost):
+        self.max_requests = max_requests
+        self.max_cost = max_cost
+
+        self._lock = Lock()
+        self.requests = 0
+        self.cost = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    def try_acquire(self, cost):
+        """Admit a request if it fits within the limits.
+
+        Parameters
+        ----------
+        cost : int
+
+        Returns
+        -------
+        bool
+            True if admitted, in which case release() must be called when done
+        """
+        with self._lock:
+            if self.requests > 0 and (self.requests >= self.max_requests or self.cost + cost > self.max_cost):
+                self.rejected += 1
+                return False
+
+            self.requests += 1
+            self.cost += cost
+            self.admitted += 1
+            return True
+
+    def release(self, cost):
+        with self._lock:
+            self.requests -= 1
+            self.cost -= cost
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "cost": self.cost,
+                "max_requests": self.max_requests,
+                "max_cost": self.max_cost,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+            }
+
+
+admission = AdmissionControl(EXECUTOR_MAX_REQUESTS, EXECUTOR_MAX_RECORDS)
+
+thread_executor = ThreadPoolExecutor(EXECUTOR_THREADS, thread_name_prefix="api") if EXECUTOR_THREADS > 0 else None
+
+# created on first use, so that worker processes are only started if needed
+_process_executor = None
+
+
+def _get_process_executor():
+    global _process_executor
+
+    if _process_executor is None:
+        # use spawn instead of fork, because the API worker has other threads
+        _process_executor = ProcessPoolExecutor(EXECUTOR_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+
+    return _process_executor
+
+
+@asynccontextmanager
+async def admit(cost):
+    """Admit a request with the estimated cost (number of records) for
+    processing, or reject it with a 503 response and Retry-After header if the
+    API worker is already at capacity.
+
+    Parameters
+    ----------
+    cost : int
+    """
+    if not admission.try_acquire(cost):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please try again later",
+            headers={"Retry-After": str(EXECUTOR_RETRY_AFTER)},
+        )
+
+    try:
+        yield
+
+    finally:
+        admission.release(cost)
+
+
+async def load_in_thread(handle):
+    """Get the value of a lazily loaded handle (see api.lib.lazy), loading it
+    in the thread pool if needed.
+
+    This must be used instead of accessing the handle directly in coroutines,
+    so that the event loop is not blocked while the value is loaded, or while
+    waiting for another thread (e.g., warmup) to load it.
+
+    Parameters
+    ----------
+    handle : LazyValue
+
+    Returns
+    -------
+    object or None
+        None if value is not available
+    """
+    if handle.loaded:
+        return handle.load()
+
+    return await run_in_thread(handle.load)
+
+
+def _run_with_cpu_time(parent_stages, func, *args, **kwargs):
+    # thread CPU time does not include time spent waiting for the GIL or I/O
+    start = thread_time()
+    try:
+        with sample_thread(parent_stages):
+            return func(*args, **kwargs)
+
+    finally:
+        add_request_stat("cpu_seconds", thread_time() - start)
+
+
+async def run_in_thread(func, *args, **kwargs):
+    """Run func in the thread pool, so that it does not block the event loop.
+
+    This is intended for Arrow compute and I/O that release the GIL.  If
+    EXECUTOR_THREADS is 0, func is called directly.
+
+    func is run in a copy of the context of the caller, so that it can add to
+    the stats of the current request, and its CPU time is added to these.  If
+    the request is profiled, the stack of the thread is sampled while func runs.
+
+    Parameters
+    ----------
+    func : callable
+    *args, **kwargs
+        passed to func
+    """
+    parent_stages = get_stage_path()
+
+    if thread_executor is None:
+        return _run_with_cpu_time(parent_stages, func, *args, **kwargs)
+
+    return await asyncio.get_running_loop().run_in_executor(
+        thread_executor,
+        partial(contextvars.copy_context().run, _run_with_cpu_time, parent_stages, func, *args, **kwargs),
+    )
+
+
+def _run_with_stats(func, *args, **kwargs):
+    with collect_request_stats() as stats:
+        return func(*args, **kwargs), stats
+
+
+async def run_in_pool(executor, func, *args, **kwargs):
+    """Run func in a process pool executor.
+
+    func and its arguments must be picklable.  The stats and labels collected
+    while func runs in the other process are added to those of the current
+    request or job.
+
+    Parameters
+    ----------
+    executor : ProcessPoolExecutor
+    func : callable
+    *args, **kwargs
+        passed to func
+    """
+    result, stats = await asyncio.get_running_loop().run_in_executor(
+        executor, partial(_run_with_stats, func, *args, **kwargs)
+    )
+
+    for name, value in stats.items():
+        if isinstance(value, (int, float)):
+            add_request_stat(name, value)
+        else:
+            set_request_label(name, value)
+
+    return result
+
+
+async def run_in_process(func, *args, **kwargs):
+    """Run func in the process pool, for Python-heavy steps that hold the GIL.
+
+    func and its arguments must be picklable.  If EXECUTOR_PROCESSES is 0, this
+    uses the thread pool instead.
+
+    Parameters
+    ----------
+    func : callable
+    *args, **kwargs
+        passed to func
+    """
+    if EXECUTOR_PROCESSES == 0:
+        return await run_in_thread(func, *args, **kwargs)
+
+    return await run_in_pool(_get_process_executor(), func, *args, **kwargs)
+
+
+def shutdown_executors():
+    if thread_executor is not None:
+        thread_executor.shutdown(wait=False, cancel_futures=True)
+
+    if _process_executor is not None:
+        _process_executor.shutdown(wait=False, cancel_futures=True)
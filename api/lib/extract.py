@@ -1,10 +1,30 @@
+import numpy as np
 import pyarrow as pa
 import pyarrow.compute as pc
+from pyarrow.dataset import Scanner
 
 from api.constants import FullySupportedBarrierTypes
-from api.data import barrier_datasets
+from api.data import (
+    barrier_datasets,
+    barrier_tables,
+    unit_indexes,
+    filter_indexes,
+    query_cubes,
+    metric_ranks,
+    spatial_indexes,
+)
+from api.lib.geometry import SPATIAL_FILTER_TYPES, get_filter_bounds, select_points
+from api.lib.metrics import add_request_stat, set_request_label
+from api.lib.profile import stage
+from api.lib.tiers import METRIC_RANK_FIELDS
 
 
+# number of records in each batch of selected rows that are scanned (same as
+# the default batch size of pyarrow scanners)
+SCAN_BATCH_SIZE = 131072
+
+
+@stage("filter")
 def _construct_filter_expr(
     unit_ids: dict,
     filters: dict,
@@ -54,6 +74,329 @@ def _construct_filter_expr(
     return ix
 
 
+def _set_query_labels(barrier_type, unit_ids, filters):
+    """Set the barrier type and fields used to select records as labels of
+    the metrics of the current request.
+    """
+    set_request_label("barrier_type", barrier_type)
+    set_request_label("fields", sorted(unit_ids.keys()) + sorted(filters.keys()))
+
+
+def _split_spatial_filters(filters):
+    """Split spatial filters (see api.lib.geometry) from other filters.
+
+    Spatial filters cannot be evaluated as pyarrow expressions, so they are
+    always resolved to the positions of rows before other filters.
+
+    Parameters
+    ----------
+    filters : dict
+        dict of {<field>: (<filter type>, <filter values>), ...}
+
+    Returns
+    -------
+    (dict, dict)
+        spatial filters and other filters
+    """
+    spatial = {key: value for key, value in filters.items() if value[0] in SPATIAL_FILTER_TYPES}
+    return spatial, {key: value for key, value in filters.items() if key not in spatial}
+
+
+@stage("spatial")
+def _select_spatial_rows(barrier_type, spatial):
+    """Select the positions of rows that meet all spatial filters.
+
+    If a spatial index is available, points within the bounds of each filter
+    are found using the index; otherwise the locations of all rows are read
+    and tested.
+
+    Parameters
+    ----------
+    barrier_type : FullySupportedBarrierTypes
+    spatial : dict
+        dict of {<field>: (<filter type>, <filter values>), ...} of spatial
+        filters
+
+    Returns
+    -------
+    ndarray of uint32
+        positions of rows in ascending order
+    """
+    spatial_index = spatial_indexes.get(barrier_type)
+    if spatial_index is None:
+        table = barrier_tables.get(barrier_type)
+        if table is not None:
+            points = table.select(["lon", "lat"])
+        else:
+            points = barrier_datasets[barrier_type].to_table(columns=["lon", "lat"])
+
+        add_request_stat("rows_scanned", len(points))
+        x = points["lon"].to_numpy()
+        y = points["lat"].to_numpy()
+
+    rows = None
+    for match_type, values in spatial.values():
+        if spatial_index is not None:
+            selected = spatial_index.get_rows(match_type, values)
+        else:
+            selected = np.flatnonzero(select_points(x, y, match_type, values)).astype("uint32")
+
+        rows = selected if rows is None else np.intersect1d(rows, selected, assume_unique=True)
+
+    return rows
+
+
+def _filter_rows(barrier_type, rows, unit_ids, filters, ranked_only=False):
+    """Select the positions of rows among rows that are within the units and
+    meet the filters.
+
+    Unit ids and filters are resolved using the summary unit and filter
+    indexes if available; otherwise only the columns referenced by them are
+    read for the selected rows and evaluated.
+
+    Parameters
+    ----------
+    barrier_type : FullySupportedBarrierTypes
+    rows : ndarray of uint32
+        positions of rows in ascending order
+    unit_ids : dict
+        dict of {<unit type>:[...unit ids...], ...}
+    filters : dict
+        dict of {<field>: (<filter type>, <filter values>), ...}
+    ranked_only : bool, optional (default: False)
+        If true, will limit results to ranked barriers
+
+    Returns
+    -------
+    pyarrow.Array
+        uint32 positions of rows in ascending order
+    """
+    unit_index = unit_indexes.get(barrier_type)
+    if len(rows) and unit_index is not None and unit_index.can_select(unit_ids, ranked_only=ranked_only):
+        rows = np.intersect1d(rows, unit_index.get_rows(unit_ids, ranked_only=ranked_only), assume_unique=True)
+        unit_ids = {}
+        ranked_only = False
+
+    filter_index = filter_indexes.get(barrier_type)
+    if (
+        len(rows)
+        and (filters or ranked_only)
+        and filter_index is not None
+        and filter_index.can_filter(filters, ranked_only=ranked_only)
+    ):
+        rows = filter_index.get_rows(filters, ranked_only=ranked_only, rows=rows)
+        filters = {}
+        ranked_only = False
+
+    fields = list(unit_ids.keys()) + list(filters.keys()) + (["Ranked"] if ranked_only else [])
+    if len(rows) == 0 or not fields:
+        return pa.array(rows, type="uint32")
+
+    # evaluate remaining filters against the selected rows only
+    rows = pa.array(rows, type="uint32")
+    add_request_stat("rows_scanned", len(rows))
+    table = barrier_tables.get(barrier_type)
+    if table is not None:
+        candidates = table.select(fields).take(rows)
+    else:
+        candidates = barrier_datasets[barrier_type].take(rows, columns=fields)
+
+    filter = _construct_filter_expr(unit_ids, filters, ranked_only=ranked_only)
+    return candidates.append_column("_row", rows).filter(filter)["_row"].combine_chunks()
+
+
+def scan_rows(barrier_type, rows, columns=None):
+    """Create a scanner of the rows at the selected positions, in order.
+
+    If the table is resident, the rows are taken from it in batches;
+    otherwise the dataset is read in batches and the selected rows are taken
+    from each batch, so that all rows are not read into memory at once.
+
+    Parameters
+    ----------
+    barrier_type : FullySupportedBarrierTypes
+    rows : pyarrow.Array
+        uint32 positions of rows in ascending order
+    columns : list, optional (default: None)
+        list of column names to include in output; if None, will return all columns
+
+    Returns
+    -------
+    pyarrow.dataset.Scanner
+    """
+    table = barrier_tables.get(barrier_type)
+    dataset = barrier_datasets[barrier_type]
+    schema = dataset.schema if columns is None else pa.schema([dataset.schema.field(c) for c in columns])
+    rows = rows.to_numpy()
+
+    def get_batches():
+        if table is not None:
+            add_request_stat("rows_scanned", len(rows))
+            source = table if columns is None else table.select(columns)
+            for offset in range(0, len(rows), SCAN_BATCH_SIZE):
+                yield from source.take(rows[offset : offset + SCAN_BATCH_SIZE]).to_batches()
+
+            return
+
+        add_request_stat("rows_scanned", dataset.count_rows())
+        offset = 0
+        for batch in dataset.to_batches(columns=columns, batch_size=SCAN_BATCH_SIZE):
+            start, end = np.searchsorted(rows, [offset, offset + len(batch)])
+            if end > start:
+                yield batch.take(pa.array(rows[start:end] - offset))
+
+            offset += len(batch)
+
+    return Scanner.from_batches(get_batches(), schema=schema)
+
+
+def take_rows(barrier_type: FullySupportedBarrierTypes, rows, columns=None, with_metric_ranks: bool = False):
+    """Read the rows at the selected positions into a Table (with chunks
+    combined).
+
+    Parameters
+    ----------
+    barrier_type : FullySupportedBarrierTypes
+    rows : pyarrow.Array
+        uint32 positions of rows in ascending order
+    columns : list, optional (default: None)
+        list of column names to include in output; if None, will return all columns
+    with_metric_ranks : bool, optional (default: False)
+        If True and the global ranks of metrics are available for barrier_type,
+        these are added to the Table as METRIC_RANK_FIELDS for use in
+        calculate_tiers.
+
+    Returns
+    -------
+    pyarrow.Table
+    """
+    add_request_stat("rows_scanned", len(rows))
+    table = barrier_tables.get(barrier_type)
+    if table is None:
+        df = barrier_datasets[barrier_type].take(rows, columns=columns)
+
+    else:
+        if columns is not None:
+            table = table.select(columns)
+
+        # use zero-copy view if all rows are selected
+        df = table if len(rows) == len(table) else table.take(rows)
+
+    ranks = metric_ranks.get(barrier_type) if with_metric_ranks else None
+    if ranks is not None:
+        rank_table = ranks.take(rows)
+        for field in rank_table.schema:
+            df = df.append_column(field.with_name(METRIC_RANK_FIELDS[field.name]), rank_table[field.name])
+
+    return df.combine_chunks()
+
+
+def select_rows(
+    barrier_type: FullySupportedBarrierTypes,
+    unit_ids: dict,
+    filters: dict,
+    ranked_only: bool = False,
+):
+    """Select the positions of rows that meet the filter, without scanning the
+    full dataset.
+
+    Spatial filters are always resolved first, using the spatial index if
+    available (see _select_spatial_rows()).  If a summary unit index is
+    available, unit ids are resolved by unioning the postings lists of each
+    unit.  If a filter index is available, filters are resolved using bitmaps
+    of the values of each field (limited to the rows in the units, if any).
+    Otherwise, if the table is resident, only the columns referenced by the
+    filter are evaluated.
+
+    Parameters
+    ----------
+    barrier_type : FullySupportedBarrierTypes
+    unit_ids : dict
+        dict of {<unit type>:[...unit ids...], ...}
+    filters : dict
+        dict of {<field>: (<filter type>, <filter values>), ...}
+    ranked_only : bool, optional (default: False)
+        If true, will limit results to ranked barriers
+
+    Returns
+    -------
+    pyarrow.Array or None
+        uint32 positions of rows in ascending order, or None if rows cannot
+        be selected without scanning the dataset
+    """
+    _set_query_labels(barrier_type, unit_ids, filters)
+
+    unit_index = unit_indexes.get(barrier_type)
+    filter_index = filter_indexes.get(barrier_type)
+    table = barrier_tables.get(barrier_type)
+
+    spatial, filters = _split_spatial_filters(filters)
+    if spatial:
+        rows = _select_spatial_rows(barrier_type, spatial)
+        return _filter_rows(barrier_type, rows, unit_ids, filters, ranked_only=ranked_only)
+
+    if unit_index is not None and unit_index.can_select(unit_ids, ranked_only=ranked_only):
+        rows = unit_index.get_rows(unit_ids, ranked_only=ranked_only)
+        return _filter_rows(barrier_type, rows, {}, filters)
+
+    if not unit_ids and filter_index is not None and filter_index.can_filter(filters, ranked_only=ranked_only):
+        return pa.array(filter_index.get_rows(filters, ranked_only=ranked_only))
+
+    if table is not None:
+        rows = pa.array(np.arange(len(table), dtype="uint32"))
+
+        fields = list(unit_ids.keys()) + list(filters.keys()) + (["Ranked"] if ranked_only else [])
+        if not fields:
+            return rows
+
+        add_request_stat("rows_scanned", len(table))
+        filter = _construct_filter_expr(unit_ids, filters, ranked_only=ranked_only)
+        return table.select(fields).append_column("_row", rows).filter(filter)["_row"].combine_chunks()
+
+    return None
+
+
+@stage("query_cube")
+def query_summary(
+    barrier_type: FullySupportedBarrierTypes,
+    unit_ids: dict,
+    filters: dict,
+    fields: list,
+    ranked_only: bool = False,
+):
+    """Summarize the count and bounds of records that meet the filter by the
+    unique combinations of values in fields using the precomputed query cube,
+    without reading any records.
+
+    Parameters
+    ----------
+    barrier_type : FullySupportedBarrierTypes
+    unit_ids : dict
+        dict of {<unit type>:[...unit ids...], ...}
+    filters : dict
+        dict of {<field>: (<filter type>, <filter values>), ...}
+    fields : list
+        fields used to group records
+    ranked_only : bool, optional (default: False)
+        If true, will limit results to ranked barriers
+
+    Returns
+    -------
+    (pyarrow.Table, list, int) or None
+        table of fields and _count, bounds [xmin, ymin, xmax, ymax], and total
+        number of records, or None if the cube is not available for this query
+    """
+    _set_query_labels(barrier_type, unit_ids, filters)
+
+    cube = query_cubes.get(barrier_type)
+    if cube is None or not cube.can_query(unit_ids, filters, fields, ranked_only=ranked_only):
+        return None
+
+    # ranked records were already selected when building the cube
+    return cube.query(_construct_filter_expr(unit_ids, filters), fields)
+
+
+@stage("count")
 def get_record_count(
     barrier_type: FullySupportedBarrierTypes,
     unit_ids: dict,
@@ -75,16 +418,93 @@ def get_record_count(
 
     Returns
     -------
-    _type_
-        _description_
+    int
     """
+    _set_query_labels(barrier_type, unit_ids, filters)
+
+    # if only selecting by units or only by filters, this can be calculated
+    # directly from the indexes
+    unit_index = unit_indexes.get(barrier_type)
+    if not filters and unit_index is not None and unit_index.can_select(unit_ids, ranked_only=ranked_only):
+        return unit_index.count(unit_ids, ranked_only=ranked_only)
+
+    filter_index = filter_indexes.get(barrier_type)
+    if not unit_ids and filter_index is not None and filter_index.can_filter(filters, ranked_only=ranked_only):
+        return filter_index.count(filters, ranked_only=ranked_only)
+
+    rows = select_rows(barrier_type, unit_ids, filters, ranked_only=ranked_only)
+    if rows is not None:
+        return len(rows)
+
     dataset = barrier_datasets[barrier_type]
+    add_request_stat("rows_scanned", dataset.count_rows())
     filter = _construct_filter_expr(unit_ids, filters, ranked_only=ranked_only)
     scanner = dataset.scanner(columns=[], filter=filter)
 
     return scanner.count_rows()
 
 
+def estimate_record_count(
+    barrier_type: FullySupportedBarrierTypes,
+    unit_ids: dict,
+    filters: dict,
+    ranked_only: bool = False,
+):
+    """Estimate an upper bound of the number of rows in dataset that meet the
+    filter, using only the indexes.  This is used to estimate the cost of a
+    request before processing it.
+
+    This loads the indexes if needed, combines the bitmaps of filters, and
+    searches the spatial index, so it must be run in the thread pool rather
+    than on the event loop (see api.lib.executor.run_in_thread()).
+
+    Parameters
+    ----------
+    barrier_type : FullySupportedBarrierTypes
+    unit_ids : dict
+        dict of {<unit type>:[...unit ids...], ...}
+    filters : dict
+        dict of {<field>: (<filter type>, <filter values>), ...}
+    ranked_only : bool, optional (default: False)
+        If true, will limit results to ranked barriers (ones with networks that
+        allow ranking, excludes invasive species barriers)
+
+    Returns
+    -------
+    int
+    """
+    estimates = []
+
+    unit_index = unit_indexes.get(barrier_type)
+    if unit_index is not None:
+        estimates.append(unit_index.num_rows)
+        if unit_ids and unit_index.can_select(unit_ids, ranked_only=ranked_only):
+            # rows within units in more than one layer are counted more than once
+            estimates.append(
+                sum(unit_index.count({layer: ids}, ranked_only=ranked_only) for layer, ids in unit_ids.items())
+            )
+
+    filter_index = filter_indexes.get(barrier_type)
+    if filter_index is not None:
+        estimates.append(filter_index.num_rows)
+        if filters and filter_index.can_filter(filters, ranked_only=ranked_only):
+            estimates.append(filter_index.count(filters, ranked_only=ranked_only))
+
+    spatial, _ = _split_spatial_filters(filters)
+    spatial_index = spatial_indexes.get(barrier_type)
+    if spatial and spatial_index is not None:
+        # number of points within the bounds of each spatial filter
+        estimates.extend(
+            len(spatial_index.search(get_filter_bounds(match_type, values))) for match_type, values in spatial.values()
+        )
+
+    if estimates:
+        return min(estimates)
+
+    return barrier_datasets[barrier_type].count_rows()
+
+
+@stage("scan")
 def extract_records(
     barrier_type: FullySupportedBarrierTypes,
     unit_ids: dict,
@@ -92,6 +512,7 @@ def extract_records(
     columns: list | None = None,
     ranked_only: bool = False,
     as_table: bool = True,
+    with_metric_ranks: bool = False,
 ):
     """Extract records from the pyarrow dataset corresponding to barrier_type,
     and return the associated pyarrow Scanner or Table (with chunks combined)
@@ -111,13 +532,33 @@ def extract_records(
     as_table : bool, optional (default: True)
         If True, will return the pyarrow Table, which will materialize all records.
         If False, will return the pyarrow Scanner, which can be scanned in batches.
+    with_metric_ranks : bool, optional (default: False)
+        If True and the global ranks of metrics are available for barrier_type,
+        these are added to the Table as METRIC_RANK_FIELDS for use in
+        calculate_tiers.
 
     Returns
     -------
     pyarrow Dataset or Scanner
     """
 
+    _set_query_labels(barrier_type, unit_ids, filters)
+
+    if as_table:
+        rows = select_rows(barrier_type, unit_ids, filters, ranked_only=ranked_only)
+
+        if rows is not None:
+            return take_rows(barrier_type, rows, columns=columns, with_metric_ranks=with_metric_ranks)
+
+    elif _split_spatial_filters(filters)[0]:
+        # spatial filters cannot be evaluated by the scanner, so only the
+        # selected rows are scanned
+        rows = select_rows(barrier_type, unit_ids, filters, ranked_only=ranked_only)
+        return scan_rows(barrier_type, rows, columns)
+
+    # all rows of the dataset are read to evaluate the filter
     dataset = barrier_datasets[barrier_type]
+    add_request_stat("rows_scanned", dataset.count_rows())
     filter = _construct_filter_expr(unit_ids, filters, ranked_only=ranked_only)
     scanner = dataset.scanner(columns=columns, filter=filter)
 
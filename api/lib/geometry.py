@@ -0,0 +1,316 @@
+import struct
+
+import numpy as np
+
+
+# spatial filter types (see api.dependencies.get_filter_params); values are
+# (xmin, ymin, xmax, ymax) for in_bbox and rings of (x, y) coordinates for
+# in_polygon
+SPATIAL_FILTER_TYPES = {"in_bbox", "in_polygon"}
+
+# maximum number of pairs of points and polygon edges tested at a time
+MAX_EDGE_PAIRS = 4_000_000
+
+WKB_POLYGON = 3
+WKB_MULTIPOLYGON = 6
+
+# flags of geometry types in extended (PostGIS) WKB
+EWKB_Z = 0x80000000
+EWKB_M = 0x40000000
+EWKB_SRID = 0x20000000
+
+INVALID_WKB = "polygon must be hex-encoded WKB"
+
+
+def parse_bbox(value):
+    """Parse a comma-delimited bounding box.
+
+    Parameters
+    ----------
+    value : str
+        "xmin,ymin,xmax,ymax" in longitude and latitude
+
+    Returns
+    -------
+    tuple of (xmin, ymin, xmax, ymax)
+
+    Raises
+    ------
+    ValueError
+        if value is not a valid bounding box
+    """
+    try:
+        bounds = tuple(float(v) for v in value.split(","))
+    except ValueError:
+        raise ValueError("bbox must be 4 comma-delimited numbers: xmin,ymin,xmax,ymax")
+
+    if len(bounds) != 4 or not np.isfinite(bounds).all():
+        raise ValueError("bbox must be 4 comma-delimited numbers: xmin,ymin,xmax,ymax")
+
+    xmin, ymin, xmax, ymax = bounds
+    if xmin > xmax or ymin > ymax:
+        raise ValueError("bbox must have xmin <= xmax and ymin <= ymax")
+
+    return bounds
+
+
+def _read_polygons(data, offset):
+    """Read the rings of a WKB Polygon or MultiPolygon starting at offset.
+
+    Returns
+    -------
+    (list of ndarray, int)
+        rings as arrays of shape (n, 2) and offset of the end of the geometry
+    """
+    byteorder = "<" if data[offset] == 1 else ">"
+    (geom_type,) = struct.unpack_from(f"{byteorder}I", data, offset + 1)
+    offset += 5
+
+    # Z and M values are present in extended WKB if flagged, or in ISO WKB
+    # if geometry type is in the 1000s (Z), 2000s (M), or 3000s (ZM)
+    dims = 2 + bool(geom_type & EWKB_Z) + bool(geom_type & EWKB_M)
+    if geom_type & EWKB_SRID:
+        # coordinates are always assumed to be longitude and latitude
+        offset += 4
+
+    geom_type &= 0x0FFFFFFF
+    dims += (0, 1, 1, 2)[min(geom_type // 1000, 3)]
+    geom_type %= 1000
+
+    rings = []
+    if geom_type == WKB_POLYGON:
+        (num_rings,) = struct.unpack_from(f"{byteorder}I", data, offset)
+        offset += 4
+        for _ in range(num_rings):
+            (num_points,) = struct.unpack_from(f"{byteorder}I", data, offset)
+            offset += 4
+            if offset + num_points * dims * 8 > len(data):
+                raise ValueError(INVALID_WKB)
+
+            coords = np.frombuffer(data, dtype=f"{byteorder}f8", count=num_points * dims, offset=offset)
+            rings.append(coords.reshape(num_points, dims)[:, :2].astype("float64"))
+            offset += num_points * dims * 8
+
+    elif geom_type == WKB_MULTIPOLYGON:
+        (num_polygons,) = struct.unpack_from(f"{byteorder}I", data, offset)
+        offset += 4
+        for _ in range(num_polygons):
+            polygon_rings, offset = _read_polygons(data, offset)
+            rings.extend(polygon_rings)
+
+    else:
+        raise ValueError("polygon must be a WKB Polygon or MultiPolygon")
+
+    return rings, offset
+
+
+def parse_wkb_polygon(value):
+    """Parse a hex-encoded WKB (or PostGIS extended WKB) Polygon or
+    MultiPolygon in longitude and latitude.
+
+    Parameters
+    ----------
+    value : str
+
+    Returns
+    -------
+    tuple of rings
+        each ring is a tuple of (x, y) coordinates; the rings of all polygons
+        are returned together, since points are tested against them using the
+        even-odd rule
+
+    Raises
+    ------
+    ValueError
+        if value is not a valid hex-encoded WKB Polygon or MultiPolygon
+    """
+    try:
+        data = bytes.fromhex(value)
+    except ValueError:
+        raise ValueError(INVALID_WKB)
+
+    try:
+        rings, offset = _read_polygons(data, 0)
+    except (IndexError, struct.error):
+        raise ValueError(INVALID_WKB)
+
+    if offset != len(data):
+        raise ValueError(INVALID_WKB)
+
+    if not rings:
+        raise ValueError("polygon must not be empty")
+
+    for ring in rings:
+        if len(ring) < 4 or not np.isfinite(ring).all():
+            raise ValueError("polygon rings must have at least 4 valid coordinates")
+
+    return tuple(tuple(map(tuple, ring.tolist())) for ring in rings)
+
+
+def get_filter_bounds(match_type, values):
+    """Get the bounds of a spatial filter.
+
+    Parameters
+    ----------
+    match_type : {"in_bbox", "in_polygon"}
+    values : tuple
+        bounds or rings of polygon
+
+    Returns
+    -------
+    tuple of (xmin, ymin, xmax, ymax)
+    """
+    if match_type == "in_bbox":
+        return values
+
+    coords = np.concatenate([np.asarray(ring, dtype="float64") for ring in values])
+    return (*coords.min(axis=0).tolist(), *coords.max(axis=0).tolist())
+
+
+def points_in_polygon(x, y, rings):
+    """Test if points are within polygon rings using the even-odd rule.
+
+    Each point is only tested against the edges that span its y coordinate:
+    points are sorted by y so that these are found using binary search, and
+    all pairs of points and edges are tested at once (in chunks of at most
+    MAX_EDGE_PAIRS pairs).
+
+    Parameters
+    ----------
+    x : ndarray
+    y : ndarray
+    rings : list-like of rings
+        each ring is a sequence of (x, y) coordinates; it is closed if its last
+        coordinate is not the same as its first
+
+    Returns
+    -------
+    ndarray of bool
+    """
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+
+    edges = []
+    for ring in rings:
+        ring = np.asarray(ring, dtype="float64")
+        edges.append(np.column_stack([ring, np.roll(ring, -1, axis=0)]))
+
+    x0, y0, x1, y1 = np.concatenate(edges).T
+    # horizontal edges are never crossed
+    ix = y0 != y1
+    x0, y0, x1, y1 = x0[ix], y0[ix], x1[ix], y1[ix]
+
+    order = np.argsort(y, kind="stable")
+    xs = x[order]
+    ys = y[order]
+
+    # a ray from each point towards +x crosses an edge if ylow <= y < yhigh
+    # and the point is left of the edge at y
+    start = np.searchsorted(ys, np.minimum(y0, y1), side="left")
+    end = np.searchsorted(ys, np.maximum(y0, y1), side="left")
+    counts = end - start
+
+    crossings = np.zeros(len(xs), dtype="int64")
+    total = np.cumsum(counts)
+    chunk_start = 0
+    while chunk_start < len(counts):
+        # include at least one edge per chunk
+        base = total[chunk_start - 1] if chunk_start > 0 else 0
+        chunk_end = max(int(np.searchsorted(total, base + MAX_EDGE_PAIRS, side="right")), chunk_start + 1)
+        edge_ix = np.arange(chunk_start, chunk_end)
+        edge_counts = counts[edge_ix]
+
+        pair_edges = np.repeat(edge_ix, edge_counts)
+        offsets = np.arange(edge_counts.sum()) - np.repeat(np.cumsum(edge_counts) - edge_counts, edge_counts)
+        pair_points = start[pair_edges] + offsets
+
+        ex0, ey0, ex1, ey1 = x0[pair_edges], y0[pair_edges], x1[pair_edges], y1[pair_edges]
+        crosses = xs[pair_points] < ex0 + (ys[pair_points] - ey0) * (ex1 - ex0) / (ey1 - ey0)
+        crossings += np.bincount(pair_points[crosses], minlength=len(xs))
+
+        chunk_start = chunk_end
+
+    inside = np.empty(len(x), dtype="bool")
+    inside[order] = crossings % 2 == 1
+    return inside
+
+
+def select_points(x, y, match_type, values):
+    """Test if points meet a spatial filter.
+
+    Parameters
+    ----------
+    x : ndarray
+    y : ndarray
+    match_type : {"in_bbox", "in_polygon"}
+    values : tuple
+        bounds or rings of polygon
+
+    Returns
+    -------
+    ndarray of bool
+    """
+    xmin, ymin, xmax, ymax = get_filter_bounds(match_type, values)
+    ix = (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+
+    if match_type == "in_polygon":
+        candidates = np.flatnonzero(ix)
+        ix[candidates] = points_in_polygon(x[candidates], y[candidates], values)
+
+    return ix
+
+
+def hilbert_values(x, y, bounds):
+    """Calculate the position of points along a Hilbert curve that fills bounds
+    on a 2^16 x 2^16 grid.
+
+    Based on the non-recursive algorithm used by flatbush
+    (https://github.com/mourner/flatbush).
+
+    Parameters
+    ----------
+    x : ndarray
+    y : ndarray
+    bounds : tuple of (xmin, ymin, xmax, ymax)
+
+    Returns
+    -------
+    ndarray of uint32
+    """
+    xmin, ymin, xmax, ymax = bounds
+    x = np.floor((np.asarray(x, dtype="float64") - xmin) / max(xmax - xmin, 1e-12) * 0xFFFF).astype("uint32")
+    y = np.floor((np.asarray(y, dtype="float64") - ymin) / max(ymax - ymin, 1e-12) * 0xFFFF).astype("uint32")
+
+    a = x ^ y
+    b = 0xFFFF ^ a
+    c = 0xFFFF ^ (x | y)
+    d = x & (y ^ 0xFFFF)
+
+    A = a | (b >> 1)
+    B = (a >> 1) ^ a
+    C = ((c >> 1) ^ (b & (d >> 1))) ^ c
+    D = ((a & (c >> 1)) ^ (d >> 1)) ^ d
+
+    for shift in (2, 4):
+        a, b, c, d = A, B, C, D
+        A = (a & (a >> shift)) ^ (b & (b >> shift))
+        B = (a & (b >> shift)) ^ (b & ((a ^ b) >> shift))
+        C = C ^ ((a & (c >> shift)) ^ (b & (d >> shift)))
+        D = D ^ ((b & (c >> shift)) ^ ((a ^ b) & (d >> shift)))
+
+    a, b, c, d = A, B, C, D
+    C = C ^ ((a & (c >> 8)) ^ (b & (d >> 8)))
+    D = D ^ ((b & (c >> 8)) ^ ((a ^ b) & (d >> 8)))
+
+    a = C ^ (C >> 1)
+    b = D ^ (D >> 1)
+
+    i0 = x ^ y
+    i1 = b | (0xFFFF ^ (i0 | a))
+
+    # interleave bits
+    for shift, mask in ((8, 0x00FF00FF), (4, 0x0F0F0F0F), (2, 0x33333333), (1, 0x55555555)):
+        i0 = (i0 | (i0 << shift)) & mask
+        i1 = (i1 | (i1 << shift)) & mask
+
+    return ((i1 << 1) | i0).astype("uint32")
@@ -0,0 +1,1299 @@
+from bisect import bisect_left
+import re
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from api.lib.geometry import get_filter_bounds, hilbert_values, points_in_polygon
+
+
+# summary unit fields of barrier tables that are indexed; these must match the
+# keys returned by api.dependencies::get_unit_ids
+INDEXED_UNIT_FIELDS = [
+    "HUC2",
+    "HUC6",
+    "HUC8",
+    "HUC10",
+    "HUC12",
+    "State",
+    "COUNTYFIPS",
+    "CongressionalDistrict",
+]
+
+
+def _group_rows(codes, num_groups, rows):
+    """Group row positions by integer code.
+
+    Parameters
+    ----------
+    codes : ndarray
+        integer code of each row in rows
+    num_groups : int
+    rows : ndarray
+        row positions, in ascending order
+
+    Returns
+    -------
+    (ndarray, ndarray)
+        tuple of offsets (length num_groups + 1) and row positions grouped by
+        code; row positions are in ascending order within each group
+    """
+    # stable sort keeps row positions in ascending order within each group
+    order = np.argsort(codes, kind="stable")
+    offsets = np.zeros(num_groups + 1, dtype="int32")
+    offsets[1:] = np.cumsum(np.bincount(codes, minlength=num_groups))
+
+    return offsets, rows[order]
+
+
+def build_unit_index(df):
+    """Build an inverted index of each summary unit id to the positions of the
+    rows within that unit.
+
+    Row positions are stored for all rows and for ranked rows only (if Ranked is
+    present), so that ranked_only selections do not need to read the Ranked
+    column.
+
+    Parameters
+    ----------
+    df : pyarrow.Table
+        barrier table, in the same row order as is used by the API
+
+    Returns
+    -------
+    pyarrow.Table
+        contains layer, id, rows (list of uint32), and ranked_rows (list of uint32,
+        if Ranked is present in df)
+    """
+    rows = np.arange(len(df), dtype="uint32")
+    ranked = df["Ranked"].to_numpy() if "Ranked" in df.column_names else None
+
+    tables = []
+    for layer in INDEXED_UNIT_FIELDS:
+        values = df[layer].combine_chunks().dictionary_encode()
+        codes = values.indices.to_numpy()
+        num_ids = len(values.dictionary)
+
+        offsets, grouped = _group_rows(codes, num_ids, rows)
+        index = {
+            "layer": pa.array(np.repeat(layer, num_ids)),
+            "id": values.dictionary,
+            "rows": pa.ListArray.from_arrays(pa.array(offsets), pa.array(grouped)),
+        }
+
+        if ranked is not None:
+            offsets, grouped = _group_rows(codes[ranked], num_ids, rows[ranked])
+            index["ranked_rows"] = pa.ListArray.from_arrays(pa.array(offsets), pa.array(grouped))
+
+        tables.append(pa.Table.from_pydict(index))
+
+    return pa.concat_tables(tables).combine_chunks().replace_schema_metadata({"num_rows": str(len(df))})
+
+
+def _union(postings, disjoint=False):
+    """Union postings lists of row positions into a single sorted array of
+    unique row positions.
+
+    Parameters
+    ----------
+    postings : list of ndarray
+        each array must be sorted in ascending order
+    disjoint : bool, optional (default: False)
+        if True, postings are known to not overlap (e.g., from different ids
+        within the same layer), so deduplication is skipped
+
+    Returns
+    -------
+    ndarray
+    """
+    if len(postings) == 0:
+        return np.empty(0, dtype="uint32")
+
+    if len(postings) == 1:
+        return postings[0]
+
+    # stable sort of uint32 uses radix sort, which is O(n)
+    rows = np.sort(np.concatenate(postings), kind="stable")
+
+    if not disjoint and len(rows):
+        rows = rows[np.concatenate([[True], rows[1:] != rows[:-1]])]
+
+    return rows
+
+
+class UnitIndex:
+    """Inverted index of summary unit ids to positions of rows in a barrier table.
+
+    Postings lists are views into the (memory-mapped) index table and are not
+    copied.
+
+    Parameters
+    ----------
+    table : pyarrow.Table
+        index table created by build_unit_index
+    """
+
+    def __init__(self, table):
+        self.num_rows = int(table.schema.metadata[b"num_rows"])
+        self.has_ranked = "ranked_rows" in table.column_names
+
+        postings = {"rows": table["rows"].combine_chunks()}
+        if self.has_ranked:
+            postings["ranked_rows"] = table["ranked_rows"].combine_chunks()
+
+        self._offsets = {key: values.offsets.to_numpy() for key, values in postings.items()}
+        self._rows = {key: values.values.to_numpy() for key, values in postings.items()}
+
+        # sorted ids and their positions within the index table for each layer,
+        # for binary search
+        layers = table["layer"].combine_chunks()
+        self._ids = {}
+        for layer in pc.unique(layers).to_pylist():
+            positions = pc.indices_nonzero(pc.equal(layers, layer)).to_numpy()
+            ids = np.asarray(table["id"].take(positions).to_numpy(zero_copy_only=False), dtype=str)
+            order = np.argsort(ids)
+            self._ids[layer] = (ids[order], positions[order])
+
+    def get_postings(self, layer, ids, ranked_only=False):
+        """Get postings lists for ids within layer.
+
+        Parameters
+        ----------
+        layer : str
+        ids : list-like of str
+        ranked_only : bool, optional (default: False)
+            if True, will only return positions of ranked rows
+
+        Returns
+        -------
+        list of ndarray
+        """
+        key = "ranked_rows" if ranked_only else "rows"
+        offsets = self._offsets[key]
+        rows = self._rows[key]
+        layer_ids, positions = self._ids[layer]
+
+        if isinstance(ids, (pa.Array, pa.ChunkedArray)):
+            ids = ids.to_pylist()
+
+        ids = np.unique(np.asarray(ids, dtype=str))
+        ix = np.minimum(np.searchsorted(layer_ids, ids), max(len(layer_ids) - 1, 0))
+        found = positions[ix[layer_ids[ix] == ids]] if len(layer_ids) else []
+
+        return [rows[offsets[i] : offsets[i + 1]] for i in found]
+
+    def can_select(self, unit_ids, ranked_only=False):
+        """Return True if all unit layers are indexed and ranked rows are
+        available (if ranked_only)
+
+        Parameters
+        ----------
+        unit_ids : dict
+            dict of {<unit type>:[...unit ids...], ...}
+        ranked_only : bool, optional (default: False)
+
+        Returns
+        -------
+        bool
+        """
+        return len(unit_ids) > 0 and (self.has_ranked or not ranked_only) and set(unit_ids).issubset(self._ids)
+
+    def get_rows(self, unit_ids, ranked_only=False):
+        """Get sorted positions of rows within any of the units.
+
+        Parameters
+        ----------
+        unit_ids : dict
+            dict of {<unit type>:[...unit ids...], ...}
+        ranked_only : bool, optional (default: False)
+            if True, will only return positions of ranked rows
+
+        Returns
+        -------
+        ndarray of uint32
+        """
+        layers = [
+            _union(self.get_postings(layer, ids, ranked_only=ranked_only), disjoint=True)
+            for layer, ids in unit_ids.items()
+        ]
+
+        return _union(layers)
+
+    def count(self, unit_ids, ranked_only=False):
+        """Count rows within any of the units.
+
+        If only a single layer is present, this is the sum of the lengths of the
+        postings lists, because rows can only be in one unit per layer.
+
+        Parameters
+        ----------
+        unit_ids : dict
+            dict of {<unit type>:[...unit ids...], ...}
+        ranked_only : bool, optional (default: False)
+            if True, will only count ranked rows
+
+        Returns
+        -------
+        int
+        """
+        if len(unit_ids) == 1:
+            layer, ids = next(iter(unit_ids.items()))
+            return sum(len(postings) for postings in self.get_postings(layer, ids, ranked_only=ranked_only))
+
+        return len(self.get_rows(unit_ids, ranked_only=ranked_only))
+
+
+def _to_bitmap(rows, num_rows):
+    """Create a packed bitmap (1 bit per row) where bits for rows are set.
+
+    Parameters
+    ----------
+    rows : ndarray
+        positions of rows
+    num_rows : int
+
+    Returns
+    -------
+    ndarray of uint8
+    """
+    ix = np.zeros(num_rows, dtype="bool")
+    ix[rows] = True
+    return np.packbits(ix, bitorder="little")
+
+
+def build_filter_index(df, fields):
+    """Build a bitmap index for each value of each filter field.
+
+    Each value is stored in the smaller of two containers: a sorted array of
+    row positions (if fewer than 1 in 32 rows have that value) or a packed
+    bitmap with 1 bit per row.
+
+    Multi-value fields are indexed by each unique combination of values, so that
+    matching a value within the combination can be resolved against the unique
+    combinations before any bitmaps are read.
+
+    Parameters
+    ----------
+    df : pyarrow.Table
+        barrier table, in the same row order as is used by the API
+    fields : list-like
+        fields to index; fields not present in df are ignored.  Ranked is always
+        indexed if present.
+
+    Returns
+    -------
+    pyarrow.Table
+        contains field, value (as string), rows (list of uint32, empty if
+        stored as bitmap), and bitmap (binary, empty if stored as rows)
+    """
+    num_rows = len(df)
+    row_ids = np.arange(num_rows, dtype="uint32")
+    empty_bitmap = b""
+    empty_rows = np.empty(0, dtype="uint32")
+
+    fields = [f for f in fields if f in df.column_names and f != "Ranked"]
+    if "Ranked" in df.column_names:
+        fields.append("Ranked")
+
+    index = {"field": [], "value": [], "rows": [], "bitmap": []}
+    for field in fields:
+        values = df[field].combine_chunks().dictionary_encode()
+        num_values = len(values.dictionary)
+        # nulls are assigned to an extra group that is not indexed
+        codes = values.indices.fill_null(num_values).to_numpy()
+        offsets, grouped = _group_rows(codes, num_values + 1, row_ids)
+
+        for i, value in enumerate(values.dictionary.to_pylist()):
+            rows = grouped[offsets[i] : offsets[i + 1]]
+            index["field"].append(field)
+            index["value"].append(str(value))
+
+            if len(rows) * 32 < num_rows:
+                index["rows"].append(rows)
+                index["bitmap"].append(empty_bitmap)
+            else:
+                index["rows"].append(empty_rows)
+                index["bitmap"].append(_to_bitmap(rows, num_rows).tobytes())
+
+    return pa.Table.from_pydict(
+        {
+            "field": pa.array(index["field"], type=pa.string()),
+            "value": pa.array(index["value"], type=pa.string()),
+            "rows": pa.array(index["rows"], type=pa.list_(pa.uint32())),
+            "bitmap": pa.array(index["bitmap"], type=pa.binary()),
+        },
+        metadata={"num_rows": str(num_rows)},
+    )
+
+
+class FilterIndex:
+    """Bitmap index of the values of filter fields in a barrier table.
+
+    Filters are resolved by OR-ing the bitmaps of matching values within each
+    field and AND-ing the result across fields, without reading any columns of
+    the barrier table.  Bitmaps are views into the (memory-mapped) index table
+    and are not copied.
+
+    Parameters
+    ----------
+    table : pyarrow.Table
+        index table created by build_filter_index
+    """
+
+    def __init__(self, table):
+        self.num_rows = int(table.schema.metadata[b"num_rows"])
+
+        rows = table["rows"].combine_chunks()
+        self._row_offsets = rows.offsets.to_numpy()
+        self._rows = rows.values.to_numpy()
+
+        bitmaps = table["bitmap"].combine_chunks()
+        _, offsets, data = bitmaps.buffers()
+        self._bitmap_offsets = np.frombuffer(offsets, dtype="int32")[bitmaps.offset : bitmaps.offset + len(bitmaps) + 1]
+        self._bitmap_data = np.frombuffer(data, dtype="uint8") if data is not None else np.empty(0, dtype="uint8")
+
+        # lookup of field to {value: position in index table}
+        self._values = {}
+        for i, (field, value) in enumerate(zip(table["field"].to_pylist(), table["value"].to_pylist())):
+            self._values.setdefault(field, {})[value] = i
+
+    def can_filter(self, filters, ranked_only=False):
+        """Return True if all fields in filters (and Ranked, if ranked_only) are indexed.
+
+        Parameters
+        ----------
+        filters : dict
+            dict of {<field>: (<filter type>, <filter values>), ...}
+        ranked_only : bool, optional (default: False)
+
+        Returns
+        -------
+        bool
+        """
+        return set(filters).issubset(self._values) and (not ranked_only or "Ranked" in self._values)
+
+    def _get_bitmap(self, i):
+        start, end = self._bitmap_offsets[i], self._bitmap_offsets[i + 1]
+        if end > start:
+            return self._bitmap_data[start:end]
+
+        return _to_bitmap(self._rows[self._row_offsets[i] : self._row_offsets[i + 1]], self.num_rows)
+
+    def _get_field_bitmap(self, field, match_type, values):
+        """Get bitmap of rows where field matches any of values.
+
+        Parameters
+        ----------
+        field : str
+        match_type : {"in_string", "in_array"}
+            in_string matches values as substrings of the field value;
+            in_array matches values exactly
+        values : list-like
+
+        Returns
+        -------
+        ndarray of uint8
+        """
+        field_values = self._values[field]
+
+        if match_type == "in_string":
+            matches = [i for value, i in field_values.items() if any(v in value for v in values)]
+        else:
+            matches = [field_values[value] for value in set(str(v) for v in values) if value in field_values]
+
+        if len(matches) == 1:
+            return self._get_bitmap(matches[0])
+
+        bitmap = np.zeros((self.num_rows + 7) // 8, dtype="uint8")
+        for i in matches:
+            bitmap |= self._get_bitmap(i)
+
+        return bitmap
+
+    def get_bitmap(self, filters, ranked_only=False):
+        """Get bitmap of rows that match all filters.
+
+        Parameters
+        ----------
+        filters : dict
+            dict of {<field>: (<filter type>, <filter values>), ...}
+        ranked_only : bool, optional (default: False)
+            if True, will only include ranked rows
+
+        Returns
+        -------
+        ndarray of uint8 or None
+            None if there are no filters
+        """
+        bitmaps = [self._get_field_bitmap(field, match_type, values) for field, (match_type, values) in filters.items()]
+
+        if ranked_only:
+            bitmaps.append(self._get_field_bitmap("Ranked", "in_array", [True]))
+
+        if not bitmaps:
+            return None
+
+        bitmap = bitmaps[0].copy()
+        for other in bitmaps[1:]:
+            bitmap &= other
+
+        return bitmap
+
+    def get_rows(self, filters, ranked_only=False, rows=None):
+        """Get sorted positions of rows that match all filters.
+
+        Parameters
+        ----------
+        filters : dict
+            dict of {<field>: (<filter type>, <filter values>), ...}
+        ranked_only : bool, optional (default: False)
+            if True, will only include ranked rows
+        rows : ndarray, optional (default: None)
+            if provided, only these rows are tested against the filters
+
+        Returns
+        -------
+        ndarray of uint32
+        """
+        bitmap = self.get_bitmap(filters, ranked_only=ranked_only)
+
+        if rows is not None:
+            if bitmap is None:
+                return rows
+
+            return rows[((bitmap[rows >> 3] >> (rows & 7).astype("uint8")) & 1).astype("bool")]
+
+        if bitmap is None:
+            return np.arange(self.num_rows, dtype="uint32")
+
+        return np.flatnonzero(np.unpackbits(bitmap, count=self.num_rows, bitorder="little")).astype("uint32")
+
+    def count(self, filters, ranked_only=False):
+        """Count rows that match all filters.
+
+        Parameters
+        ----------
+        filters : dict
+            dict of {<field>: (<filter type>, <filter values>), ...}
+        ranked_only : bool, optional (default: False)
+            if True, will only count ranked rows
+
+        Returns
+        -------
+        int
+        """
+        bitmap = self.get_bitmap(filters, ranked_only=ranked_only)
+        if bitmap is None:
+            return self.num_rows
+
+        # unused trailing bits are never set
+        return int(np.bitwise_count(bitmap).sum())
+
+
+def build_query_cube(df, fields, ranked_only=False):
+    """Build a cube of the count and bounds of records for each unique
+    combination of summary units and filter field values.
+
+    Every record belongs to exactly one cell, so that counts can be summed
+    across any selection of cells without double-counting records.
+
+    Parameters
+    ----------
+    df : pyarrow.Table
+        barrier table, in the same row order as is used by the API
+    fields : list-like
+        filter fields returned by the query endpoint for this barrier type
+    ranked_only : bool, optional (default: False)
+        if True, only ranked records are included
+
+    Returns
+    -------
+    pyarrow.Table
+        contains summary unit fields, filter fields, _count, _first_row
+        (position of first record of the cell in df), and xmin, ymin, xmax,
+        ymax, sorted by _first_row
+    """
+    num_rows = len(df)
+    df = df.append_column("_row", pa.array(np.arange(num_rows, dtype="uint32")))
+    if ranked_only:
+        df = df.filter(pc.field("Ranked"))
+
+    keys = INDEXED_UNIT_FIELDS + [f for f in fields if f not in INDEXED_UNIT_FIELDS]
+    cube = df.group_by(keys, use_threads=False).aggregate(
+        [
+            ("_row", "count"),
+            ("_row", "min"),
+            ("lon", "min"),
+            ("lat", "min"),
+            ("lon", "max"),
+            ("lat", "max"),
+        ]
+    )
+
+    cube = (
+        cube.select(keys)
+        .append_column("_count", cube["_row_count"].cast("uint32"))
+        .append_column("_first_row", cube["_row_min"])
+        .append_column("xmin", cube["lon_min"])
+        .append_column("ymin", cube["lat_min"])
+        .append_column("xmax", cube["lon_max"])
+        .append_column("ymax", cube["lat_max"])
+        .sort_by("_first_row")
+    )
+
+    return cube.replace_schema_metadata({"num_rows": str(num_rows), "ranked_only": "1" if ranked_only else ""})
+
+
+class QueryCube:
+    """Cube of record counts and bounds for each combination of summary units
+    and filter field values, used to summarize records that match a query
+    without reading them.
+
+    Parameters
+    ----------
+    table : pyarrow.Table
+        cube table created by build_query_cube
+    """
+
+    def __init__(self, table):
+        self.num_rows = int(table.schema.metadata[b"num_rows"])
+        self.ranked_only = bool(table.schema.metadata[b"ranked_only"])
+        self.table = table
+
+    def can_query(self, unit_ids, filters, fields, ranked_only=False):
+        """Return True if the cube can be used to summarize records by fields.
+
+        Parameters
+        ----------
+        unit_ids : dict
+            dict of {<unit type>:[...unit ids...], ...}
+        filters : dict
+            dict of {<field>: (<filter type>, <filter values>), ...}
+        fields : list-like
+            fields used to group records
+        ranked_only : bool, optional (default: False)
+
+        Returns
+        -------
+        bool
+        """
+        columns = set(self.table.column_names)
+        return ranked_only == self.ranked_only and columns.issuperset(list(unit_ids) + list(filters) + list(fields))
+
+    def query(self, filter, fields):
+        """Summarize records in the cells that meet the filter.
+
+        Counts are grouped by fields in the order of the first record of each
+        group, which is the same order in which they are returned when grouping
+        the records directly.
+
+        Parameters
+        ----------
+        filter : pyarrow.compute.Expression
+            filter of summary units and filter fields
+        fields : list-like
+            fields used to group records
+
+        Returns
+        -------
+        (pyarrow.Table, list, int)
+            table of fields and _count (uint32), bounds [xmin, ymin, xmax, ymax]
+            (values are None if no records were selected), and total number of
+            records
+        """
+        cells = self.table.filter(filter)
+
+        bounds = [
+            pc.min(cells["xmin"]).as_py(),
+            pc.min(cells["ymin"]).as_py(),
+            pc.max(cells["xmax"]).as_py(),
+            pc.max(cells["ymax"]).as_py(),
+        ]
+
+        counts = (
+            cells.group_by(fields, use_threads=False)
+            .aggregate([("_count", "sum"), ("_first_row", "min")])
+            .sort_by("_first_row_min")
+        )
+        counts = counts.select(fields).append_column("_count", counts["_count_sum"].cast("uint32"))
+
+        return counts, bounds, pc.sum(cells["_count"]).as_py() or 0
+
+
+def build_metric_ranks(df, fields):
+    """Build a table of the dense rank of each value of each metric field
+    within the sorted unique values of that field across all rows.
+
+    These are used to calculate scores for any subset of rows without sorting
+    the values of the subset.
+
+    -0.0 and 0.0 are different unique values but are equal when sorted; if
+    both are present, they are assigned different ranks and the rank of 0.0
+    is stored as positive_zero_rank in the metadata of the field so that
+    scores can treat them the same as calculate_score.
+
+    Parameters
+    ----------
+    df : pyarrow.Table
+        barrier table, in the same row order as is used by the API
+    fields : list-like
+        metric fields to rank
+
+    Returns
+    -------
+    pyarrow.Table
+        contains a uint32 column of 0-based dense ranks for each field, in the
+        same order as df
+    """
+    columns = []
+    for field in fields:
+        values = df[field]
+        ranks = pc.subtract(pc.rank(values, sort_keys="ascending", tiebreaker="dense"), 1).to_numpy()
+        metadata = None
+
+        if pa.types.is_floating(values.type):
+            values = values.to_numpy()
+            is_negative_zero = (values == 0) & np.signbit(values)
+            is_positive_zero = (values == 0) & ~np.signbit(values)
+            if is_negative_zero.any() and is_positive_zero.any():
+                # shift 0.0 and all larger values up by 1
+                ranks = ranks + ~((values < 0) | is_negative_zero)
+                metadata = {"positive_zero_rank": str(ranks[is_positive_zero][0])}
+
+        columns.append((pa.field(field, "uint32", metadata=metadata), pa.array(ranks, type="uint32")))
+
+    schema = pa.schema([field for field, _ in columns], metadata={"num_rows": str(len(df))})
+    return pa.Table.from_arrays([values for _, values in columns], schema=schema)
+
+
+class MetricRanks:
+    """Global dense ranks of metric fields in a barrier table.
+
+    Parameters
+    ----------
+    table : pyarrow.Table
+        table created by build_metric_ranks
+    """
+
+    def __init__(self, table):
+        self.num_rows = int(table.schema.metadata[b"num_rows"])
+        self.table = table
+
+    def take(self, rows):
+        """Get ranks for rows; fields retain the metadata set in build_metric_ranks.
+
+        Parameters
+        ----------
+        rows : pyarrow.Array
+            positions of rows
+
+        Returns
+        -------
+        pyarrow.Table
+        """
+        if len(rows) == self.num_rows:
+            return self.table
+
+        return self.table.take(rows)
+
+
+# number of children of each node of the spatial index
+SPATIAL_NODE_SIZE = 16
+
+
+def build_spatial_index(df, node_size=SPATIAL_NODE_SIZE):
+    """Build a static packed Hilbert R-tree of the locations (lon, lat) of rows.
+
+    Points are sorted by their position along a Hilbert curve and grouped into
+    leaf nodes of node_size points; nodes are then grouped into parent nodes
+    of node_size nodes each, up to a single root node.  Nodes are stored as
+    flat arrays of their bounds, level by level starting with the points, so
+    that the tree can be memory-mapped and searched without building any
+    Python objects.
+
+    Rows without a location are not indexed.
+
+    Parameters
+    ----------
+    df : pyarrow.Table
+        barrier table, in the same row order as is used by the API
+    node_size : int, optional (default: SPATIAL_NODE_SIZE)
+
+    Returns
+    -------
+    pyarrow.Table
+        contains xmin, ymin, xmax, ymax (float32) of each node, and index
+        (uint32): position of row for points, or position of first child for
+        other nodes.  Metadata includes the end position of each level.
+    """
+    x = df["lon"].to_numpy(zero_copy_only=False).astype("float32")
+    y = df["lat"].to_numpy(zero_copy_only=False).astype("float32")
+    rows = np.flatnonzero(np.isfinite(x) & np.isfinite(y)).astype("uint32")
+    x, y = x[rows], y[rows]
+
+    if len(rows):
+        order = np.argsort(hilbert_values(x, y, (x.min(), y.min(), x.max(), y.max())), kind="stable")
+        rows, x, y = rows[order], x[order], y[order]
+
+    levels = [(x, y, x, y, rows)]
+    level_bounds = [len(rows)]
+    while len(levels[-1][0]) > 1:
+        xmin, ymin, xmax, ymax, _ = levels[-1]
+        starts = np.arange(0, len(xmin), node_size)
+        levels.append(
+            (
+                np.minimum.reduceat(xmin, starts),
+                np.minimum.reduceat(ymin, starts),
+                np.maximum.reduceat(xmax, starts),
+                np.maximum.reduceat(ymax, starts),
+                # position of first child within all nodes
+                (level_bounds[-1] - len(xmin) + starts).astype("uint32"),
+            )
+        )
+        level_bounds.append(level_bounds[-1] + len(starts))
+
+    return pa.Table.from_pydict(
+        {
+            name: pa.array(np.concatenate([level[i] for level in levels]))
+            for i, name in enumerate(["xmin", "ymin", "xmax", "ymax", "index"])
+        },
+        metadata={
+            "num_rows": str(len(df)),
+            "node_size": str(node_size),
+            "level_bounds": ",".join(str(bound) for bound in level_bounds),
+        },
+    )
+
+
+class SpatialIndex:
+    """Packed Hilbert R-tree of the locations of rows in a barrier table.
+
+    The tree is searched one level at a time starting from the root, testing
+    all nodes of a level that intersect the search bounds at once.  Arrays are
+    views into the (memory-mapped) index table and are not copied.
+
+    Parameters
+    ----------
+    table : pyarrow.Table
+        index table created by build_spatial_index
+    """
+
+    def __init__(self, table):
+        self.num_rows = int(table.schema.metadata[b"num_rows"])
+        self.node_size = int(table.schema.metadata[b"node_size"])
+        self._level_bounds = [int(bound) for bound in table.schema.metadata[b"level_bounds"].split(b",")]
+
+        self._xmin, self._ymin, self._xmax, self._ymax, self._index = [
+            table[name].combine_chunks().to_numpy() for name in ["xmin", "ymin", "xmax", "ymax", "index"]
+        ]
+
+    def search(self, bounds):
+        """Get the positions of points within bounds.
+
+        Parameters
+        ----------
+        bounds : tuple of (xmin, ymin, xmax, ymax)
+
+        Returns
+        -------
+        ndarray
+            positions of points in the index table (not rows), in Hilbert order
+        """
+        xmin, ymin, xmax, ymax = bounds
+        level = len(self._level_bounds) - 1
+        start = self._level_bounds[level - 1] if level > 0 else 0
+        nodes = np.arange(start, self._level_bounds[level])
+
+        while True:
+            nodes = nodes[
+                (self._xmin[nodes] <= xmax)
+                & (self._xmax[nodes] >= xmin)
+                & (self._ymin[nodes] <= ymax)
+                & (self._ymax[nodes] >= ymin)
+            ]
+
+            if level == 0 or len(nodes) == 0:
+                return nodes
+
+            # children of each node are consecutive nodes of the level below,
+            # starting at index; the last node of each level may have fewer
+            level -= 1
+            first = self._index[nodes].astype("int64")
+            counts = np.minimum(first + self.node_size, self._level_bounds[level]) - first
+            nodes = np.repeat(first, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+
+    def get_rows(self, match_type, values):
+        """Get sorted positions of rows that meet a spatial filter.
+
+        Points within the bounds of the filter are found using the tree, then
+        tested against the polygon (if in_polygon) using their coordinates in
+        the index.
+
+        Parameters
+        ----------
+        match_type : {"in_bbox", "in_polygon"}
+        values : tuple
+            bounds or rings of polygon
+
+        Returns
+        -------
+        ndarray of uint32
+        """
+        points = self.search(get_filter_bounds(match_type, values))
+
+        if match_type == "in_polygon" and len(points):
+            points = points[points_in_polygon(self._xmin[points], self._ymin[points], values)]
+
+        return np.sort(self._index[points])
+
+
+# whitespace between words of search keys; this must match \s of the RE2
+# regular expressions used to search them in api/internal/barriers/search.py
+SEARCH_WORD_SEPARATOR = re.compile(r"[\t\n\f\r ]+")
+
+
+def build_search_index(df):
+    """Build an inverted index of each word (lowercased) in the search keys of
+    search_barriers to the positions of the rows that contain that word.
+
+    Parameters
+    ----------
+    df : pyarrow.Table
+        search_barriers table, in the same row order as is used by the API
+
+    Returns
+    -------
+    pyarrow.Table
+        contains word (sorted in ascending order) and rows (list of uint32)
+    """
+    words = []
+    rows = []
+    for i, key in enumerate(df["search_key"].to_pylist()):
+        if key:
+            for word in set(SEARCH_WORD_SEPARATOR.split(key.lower())) - {""}:
+                words.append(word)
+                rows.append(i)
+
+    words = pa.array(words, type=pa.string())
+    vocabulary = pc.unique(words)
+    vocabulary = vocabulary.take(pc.array_sort_indices(vocabulary))
+    codes = pc.index_in(words, value_set=vocabulary).to_numpy()
+
+    offsets, grouped = _group_rows(codes, len(vocabulary), np.array(rows, dtype="uint32"))
+
+    return pa.Table.from_pydict(
+        {
+            "word": vocabulary,
+            "rows": pa.ListArray.from_arrays(pa.array(offsets), pa.array(grouped, type=pa.uint32())),
+        },
+        metadata={"num_rows": str(len(df))},
+    )
+
+
+class SearchIndex:
+    """Inverted index of words in the search keys of search_barriers to
+    positions of rows.
+
+    Words are sorted so that all words that start with a prefix are a
+    contiguous range of the index, and their postings lists are a contiguous
+    range of row positions.
+
+    Parameters
+    ----------
+    table : pyarrow.Table
+        index table created by build_search_index
+    """
+
+    def __init__(self, table):
+        self.num_rows = int(table.schema.metadata[b"num_rows"])
+
+        self._words = table["word"].combine_chunks()
+        # Python strings are used for binary search by prefix
+        self._word_list = self._words.to_pylist()
+
+        rows = table["rows"].combine_chunks()
+        self._offsets = rows.offsets.to_numpy()
+        self._rows = rows.values.to_numpy()
+
+    def iter_rows(self, prefix, substrings=None, batch_size=4096):
+        """Iterate over sorted positions of rows that contain a word that starts
+        with prefix and, for each of substrings, a word that contains it.
+
+        Rows are returned in batches that cover successively larger ranges of
+        row positions, starting with a range that is expected to contain about
+        batch_size rows, so that callers that only need the first matching rows
+        can stop early without finding all matching rows.
+
+        Substrings that are contained in words of more than 1/16 of rows are not
+        used to narrow down the rows, because it is faster for callers to check
+        the first few returned rows against these than to find all rows that
+        contain them.  Rows returned may not contain those substrings.
+
+        Parameters
+        ----------
+        prefix : str
+            lowercase; if empty, all rows are returned, including rows without
+            any words
+        substrings : list-like of str, optional (default: None)
+            lowercase; must not contain whitespace
+        batch_size : int, optional (default: 4096)
+
+        Yields
+        ------
+        ndarray of uint32
+        """
+        if prefix:
+            start = bisect_left(self._word_list, prefix)
+            end = bisect_left(self._word_list, prefix + "\U0010ffff")
+            # postings of all words that start with prefix are contiguous; rows
+            # may be present more than once
+            candidates = self._rows[self._offsets[start] : self._offsets[end]]
+            num_candidates = len(candidates)
+
+        else:
+            candidates = None
+            num_candidates = self.num_rows
+
+        # masks of rows that contain each substring, and number of postings
+        masks = []
+        for substring in substrings or []:
+            positions = pc.indices_nonzero(pc.match_substring(self._words, substring)).to_numpy()
+            starts = self._offsets[positions]
+            lengths = self._offsets[positions + 1] - starts
+            count = lengths.sum()
+            if count * 16 > self.num_rows:
+                continue
+
+            # positions within self._rows of the postings of all words
+            ix = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(count)
+            mask = np.zeros(self.num_rows, dtype="bool")
+            mask[self._rows[ix]] = True
+            masks.append((mask, count))
+
+        if num_candidates == 0 or any(count == 0 for _, count in masks):
+            return
+
+        # assume substrings are independent of prefix to estimate the number of
+        # rows returned in total
+        expected = num_candidates
+        for _, count in masks:
+            expected = expected * min(count / self.num_rows, 1)
+
+        window = max(int(self.num_rows * batch_size / max(expected, 1)), batch_size)
+        start = 0
+        while start < self.num_rows:
+            stop = min(start + window, self.num_rows)
+
+            if candidates is None:
+                rows = np.arange(start, stop, dtype="uint32")
+            else:
+                rows = np.unique(candidates[(candidates >= start) & (candidates < stop)])
+
+            for mask, _ in masks:
+                rows = rows[mask[rows]]
+
+            yield rows
+
+            start = stop
+            window *= 2
+
+
+def _trigram_codes(data, starts):
+    """Get integer codes of the trigrams of bytes that start at each position.
+
+    Parameters
+    ----------
+    data : ndarray of uint8
+        must contain at least 2 bytes after the last position
+    starts : ndarray
+        positions of first byte of each trigram
+
+    Returns
+    -------
+    ndarray of uint32
+    """
+    data = data.astype("uint32")
+    return (data[starts] << 16) | (data[starts + 1] << 8) | data[starts + 2]
+
+
+class UnitSearchIndex:
+    """Trigram index of the keys of summary units within each layer, used to
+    find the top units whose key contains a search query.
+
+    Trigrams are indexed from lowercase ASCII keys, padded with null bytes so
+    that the trigrams at the end of each key start with its last 1 or 2
+    characters.  Every occurrence of a query of up to 3 characters is the
+    start of a trigram within a range of trigrams, so units and the position
+    of the query within their key are found directly from the index.  Longer
+    queries are checked against the units that contain all of their trigrams.
+
+    Units with non-ASCII keys, and all units for queries with non-ASCII
+    characters, are checked while ignoring case, so that matching is not
+    affected by differences in case folding.
+
+    Units are ranked by priority, then position of the query in the key (left
+    is better), then length of name, then state, then position in table; all
+    except position of the query are precomputed.
+
+    Parameters
+    ----------
+    table : pyarrow.Table
+        summary units table; must contain layer, key, name, priority, and state
+    """
+
+    def __init__(self, table):
+        self.table = table.combine_chunks()
+        self.num_rows = len(table)
+
+        self._keys = self.table["key"].combine_chunks()
+        self._lower_keys = pc.utf8_lower(self._keys)
+        self._max_length = (pc.max(pc.binary_length(self._keys)).as_py() or 0) + 1
+
+        # rank of priority (lower is better) and rank of unit by priority, then
+        # length of name, then state; ties are kept in order of the table
+        self._priority_rank = pc.subtract(
+            pc.rank(self.table["priority"], sort_keys="ascending", tiebreaker="dense"), 1
+        ).to_numpy()
+        order = pc.sort_indices(
+            pa.table(
+                {
+                    "priority": self.table["priority"],
+                    "name_len": pc.utf8_length(self.table["name"]),
+                    "state": self.table["state"],
+                }
+            ),
+            sort_keys=[("priority", "ascending"), ("name_len", "ascending"), ("state", "ascending")],
+        ).to_numpy()
+        self._rank = np.empty(self.num_rows, dtype="uint64")
+        self._rank[order] = np.arange(self.num_rows, dtype="uint64")
+
+        keys = [key.lower() if key is not None else "" for key in self._keys.to_pylist()]
+        layers = self.table["layer"].to_numpy(zero_copy_only=False)
+
+        # for each layer: rows of layer, rows with non-ASCII keys, and sorted
+        # trigram codes with the row (as index into rows of layer) and position
+        # within the key of each
+        self._layers = {}
+        for layer in np.unique(layers):
+            rows = np.flatnonzero(layers == layer).astype("uint32")
+            is_ascii = np.array([keys[i].isascii() for i in rows], dtype="bool")
+
+            ascii_keys = [keys[i] for i in rows[is_ascii]]
+            lengths = np.array([len(key) for key in ascii_keys], dtype="int64")
+            data = np.frombuffer("".join(key + "\0\0" for key in ascii_keys).encode("ascii"), dtype="uint8")
+
+            # position of each character within its key and within data
+            num_chars = lengths.sum()
+            positions = np.arange(num_chars) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            starts = np.repeat(np.cumsum(lengths + 2) - (lengths + 2), lengths) + positions
+
+            codes = _trigram_codes(data, starts)
+            order = np.argsort(codes, kind="stable")
+
+            self._layers[layer] = (
+                rows,
+                rows[~is_ascii],
+                codes[order],
+                np.repeat(np.flatnonzero(is_ascii).astype("uint32"), lengths)[order],
+                positions.astype("int32")[order],
+            )
+
+    def _find_ascii(self, layer, query):
+        """Find units with ASCII keys within layer that contain query.
+
+        Parameters
+        ----------
+        layer : str
+        query : str
+            lowercase ASCII, not empty
+
+        Returns
+        -------
+        (ndarray of uint32, ndarray of int32)
+            positions of units and position of first occurrence of query within
+            the key of each
+        """
+        rows, _, codes, code_rows, code_positions = self._layers[layer]
+        padded = np.frombuffer(query.encode("ascii") + b"\0\0", dtype="uint8")
+
+        if len(query) <= 3:
+            # query is a prefix of the trigrams
+            start = _trigram_codes(padded, np.array([0]))[0]
+            end = start + (1 << (8 * (3 - len(query))))
+            ix = slice(np.searchsorted(codes, start), np.searchsorted(codes, end))
+
+            first = np.full(len(rows), np.iinfo("int32").max, dtype="int32")
+            np.minimum.at(first, code_rows[ix], code_positions[ix])
+            found = np.flatnonzero(first < np.iinfo("int32").max)
+
+            return rows[found], first[found]
+
+        query_codes = np.unique(_trigram_codes(padded, np.arange(len(query) - 2)))
+        starts = np.searchsorted(codes, query_codes)
+        ends = np.searchsorted(codes, query_codes + 1)
+
+        # intersect units of the rarest trigrams first, until there are few
+        # enough candidates to check directly
+        order = np.argsort(ends - starts)
+        candidates = np.unique(code_rows[starts[order[0]] : ends[order[0]]])
+        for i in order[1:]:
+            if len(candidates) <= 16:
+                break
+            candidates = candidates[np.isin(candidates, code_rows[starts[i] : ends[i]])]
+
+        candidates = rows[candidates]
+        positions = pc.find_substring(self._lower_keys.take(candidates), query).to_numpy()
+        found = positions >= 0
+
+        return candidates[found], positions[found]
+
+    def search(self, layers, query, limit=10):
+        """Find units within layers whose key contains query (ignoring case).
+
+        Parameters
+        ----------
+        layers : list-like of str
+        query : str
+        limit : int, optional (default: 10)
+            maximum number of units to return
+
+        Returns
+        -------
+        (ndarray of uint32, int)
+            positions of the top units in ranked order, and the total number of
+            units that contain query
+        """
+        use_index = len(query) > 0 and query.isascii()
+
+        matches = []
+        positions = []
+        for layer in set(layers).intersection(self._layers):
+            rows, other_rows, *_ = self._layers[layer]
+
+            if use_index:
+                layer_matches, layer_positions = self._find_ascii(layer, query.lower())
+                matches.append(layer_matches)
+                positions.append(layer_positions)
+                rows = other_rows
+
+            is_match = pc.match_substring(self._keys.take(rows), query.lower(), ignore_case=True)
+            rows = rows[is_match.fill_null(False).to_numpy(zero_copy_only=False)]
+            matches.append(rows)
+            positions.append(pc.find_substring(self._keys.take(rows), query, ignore_case=True).to_numpy())
+
+        if not matches:
+            return np.empty(0, dtype="uint32"), 0
+
+        matches = np.concatenate(matches)
+        sort_key = (
+            self._priority_rank[matches] * self._max_length + np.concatenate(positions).astype("uint64")
+        ) * self.num_rows + self._rank[matches]
+
+        # select top units without sorting all matches
+        top = np.argpartition(sort_key, limit)[:limit] if len(matches) > limit else np.arange(len(matches))
+        top = top[np.argsort(sort_key[top])]
+
+        return matches[top], len(matches)
+
+
+# constants of 64-bit FNV-1a hash
+FNV_OFFSET_BASIS = np.uint64(14695981039346656037)
+FNV_PRIME = np.uint64(1099511628211)
+
+
+def hash_strings(values):
+    """Calculate 64-bit FNV-1a hashes of the UTF-8 bytes of strings.
+
+    This is vectorized over the position of each byte, so it is fast for short
+    strings such as SARPIDs.  Null values have the same hash as empty strings.
+
+    Parameters
+    ----------
+    values : pyarrow.Array or pyarrow.ChunkedArray
+        string or large_string values
+
+    Returns
+    -------
+    ndarray of uint64
+    """
+    if isinstance(values, pa.ChunkedArray):
+        values = values.combine_chunks()
+
+    offset_type = "int64" if pa.types.is_large_string(values.type) else "int32"
+    _, offsets, data = values.buffers()
+    offsets = np.frombuffer(offsets, dtype=offset_type)[values.offset : values.offset + len(values) + 1]
+    data = np.frombuffer(data, dtype="uint8") if data is not None else np.empty(0, dtype="uint8")
+    lengths = np.diff(offsets)
+
+    hashes = np.full(len(values), FNV_OFFSET_BASIS, dtype="uint64")
+    for i in range(lengths.max() if len(values) else 0):
+        ix = np.flatnonzero(lengths > i)
+        hashes[ix] = (hashes[ix] ^ data[offsets[ix] + i]) * FNV_PRIME
+
+    return hashes
+
+
+def hash_string(value):
+    """Calculate 64-bit FNV-1a hash of the UTF-8 bytes of a single string; this
+    is the same as hash_strings but much faster for one value.
+
+    Parameters
+    ----------
+    value : str
+
+    Returns
+    -------
+    numpy.uint64
+    """
+    result = int(FNV_OFFSET_BASIS)
+    for byte in value.encode("utf-8"):
+        result = ((result ^ byte) * int(FNV_PRIME)) & 0xFFFFFFFFFFFFFFFF
+
+    return np.uint64(result)
+
+
+class SARPIDIndex:
+    """Hash index of SARPID to positions of rows in a barrier table.
+
+    Rows are stored in order of the hash of their SARPID, so that rows are
+    found by binary search of the hashes and then verified against the SARPID
+    of each (to rule out collisions).  This uses 12 bytes per row, which is much
+    less than a dict of SARPIDs.
+
+    Parameters
+    ----------
+    sarpids : pyarrow.Array or pyarrow.ChunkedArray
+        SARPID of each row in the barrier table
+    """
+
+    def __init__(self, sarpids):
+        if isinstance(sarpids, pa.ChunkedArray):
+            sarpids = sarpids.combine_chunks()
+
+        self.sarpids = sarpids
+        self.num_rows = len(sarpids)
+
+        hashes = hash_strings(sarpids)
+
+        # stable sort keeps rows with the same SARPID in ascending order
+        self._rows = np.argsort(hashes, kind="stable").astype("uint32")
+        self._hashes = hashes[self._rows]
+
+    def get_rows(self, sarp_id):
+        """Get positions of rows for sarp_id.
+
+        Parameters
+        ----------
+        sarp_id : str
+
+        Returns
+        -------
+        ndarray of uint32
+            positions of rows in ascending order; empty if not found
+        """
+        value = hash_string(sarp_id)
+        start = np.searchsorted(self._hashes, value, side="left")
+        end = np.searchsorted(self._hashes, value, side="right")
+
+        return np.array([row for row in self._rows[start:end] if self.sarpids[row].as_py() == sarp_id], dtype="uint32")
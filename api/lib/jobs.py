@@ -0,0 +1,262 @@
+from datetime import datetime, UTC
+from time import time
+
+from arq.constants import abort_jobs_ss, in_progress_key_prefix, job_key_prefix
+from arq.jobs import DeserializationError, deserialize_job
+
+from api.settings import DOWNLOAD_FAST_LANE_RECORDS, DOWNLOAD_JOB_POLL_TIMEOUT, DOWNLOAD_JOB_TIMEOUT, REDIS_QUEUE
+
+
+# arq runs queued jobs in order of their score in the queue (a sorted set),
+# which is normally the time they were enqueued.  Custom download jobs are
+# instead scored up to this many milliseconds before they were enqueued, so
+# that they can be ordered by size and client without deferring them.
+SCORE_WINDOW = 3600 * 1000
+
+# large jobs, and each job of a client that already has jobs queued or in
+# progress, are ordered after jobs enqueued up to this many milliseconds later
+JOB_DELAY = 2 * DOWNLOAD_JOB_TIMEOUT * 1000
+
+# key of a sorted set of the clients that requested the status of each job,
+# scored by the time of their last request in milliseconds since epoch
+POLL_PREFIX = "arq:job-polled:"
+
+# clients that requested the status of a job within this many seconds are
+# waiting for it; a job is only cancelled on request of a client if no other
+# client is waiting for it (see detach_job_client())
+CLIENT_POLL_TIMEOUT = DOWNLOAD_JOB_POLL_TIMEOUT or 60
+
+
+def is_small_job(record_count):
+    """Return True if a download of record_count records runs in the fast lane
+    for small jobs.
+
+    Parameters
+    ----------
+    record_count : int or None
+        estimated number of records; None for jobs enqueued without it
+
+    Returns
+    -------
+    bool
+    """
+    return record_count is None or record_count <= DOWNLOAD_FAST_LANE_RECORDS
+
+
+def get_job_score(enqueue_ms, record_count, client_jobs):
+    """Calculate the score of a custom download job in the queue.
+
+    Small jobs are ordered before large jobs enqueued up to JOB_DELAY earlier,
+    and each job that the client already has queued or in progress delays the
+    job by another JOB_DELAY, so that jobs of different clients are taken in
+    turn.  The score is never later than enqueue_ms.
+
+    Parameters
+    ----------
+    enqueue_ms : int
+        time job is enqueued, in milliseconds since epoch
+    record_count : int
+        estimated number of records
+    client_jobs : int
+        number of other jobs of the same client that are queued or in progress
+
+    Returns
+    -------
+    int
+    """
+    delay = client_jobs * JOB_DELAY
+    if not is_small_job(record_count):
+        delay += JOB_DELAY
+
+    return enqueue_ms - SCORE_WINDOW + min(delay, SCORE_WINDOW)
+
+
+async def get_job_defs(redis, job_ids):
+    """Get the definitions of jobs.
+
+    Parameters
+    ----------
+    redis : ArqRedis
+    job_ids : list of str
+
+    Returns
+    -------
+    list of arq.jobs.JobDef or None
+        None for jobs that no longer exist or cannot be read
+    """
+    if not job_ids:
+        return []
+
+    values = await redis.mget([f"{job_key_prefix}{job_id}" for job_id in job_ids])
+
+    job_defs = []
+    for value in values:
+        try:
+            job_defs.append(deserialize_job(value, deserializer=redis.job_deserializer) if value else None)
+
+        except DeserializationError:
+            job_defs.append(None)
+
+    return job_defs
+
+
+async def enqueue_download_job(redis, job_id, record_count, client, **kwargs):
+    """Enqueue custom_download_task, scored according to its estimated number
+    of records and the jobs of the same client (see get_job_score()).
+
+    Parameters
+    ----------
+    redis : ArqRedis
+    job_id : str
+    record_count : int
+        estimated number of records
+    client : str
+        IP address of client
+    **kwargs
+        passed to custom_download_task
+
+    Returns
+    -------
+    arq.jobs.Job or None
+        None if a job with the same id already exists
+    """
+    job_ids = [id.decode() for id in await redis.zrange(REDIS_QUEUE, 0, -1) if id.decode() != job_id]
+    client_jobs = sum(
+        1
+        for job_def in await get_job_defs(redis, job_ids)
+        if job_def is not None and job_def.kwargs.get("client") == client
+    )
+
+    score = get_job_score(int(time() * 1000), record_count, client_jobs)
+
+    return await redis.enqueue_job(
+        "custom_download_task",
+        record_count=record_count,
+        client=client,
+        _job_id=job_id,
+        _queue_name=REDIS_QUEUE,
+        _defer_until=datetime.fromtimestamp(score / 1000, tz=UTC),
+        **kwargs,
+    )
+
+
+async def set_job_polled(redis, job_id, client):
+    """Record that the status of a job was requested by a client.
+
+    Parameters
+    ----------
+    redis : ArqRedis
+    job_id : str
+    client : str
+        IP address of client
+    """
+    key = f"{POLL_PREFIX}{job_id}"
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.zadd(key, {client: int(time() * 1000)})
+        pipe.expire(key, CLIENT_POLL_TIMEOUT)
+        await pipe.execute()
+
+
+async def is_job_polled(redis, job_id):
+    """Return True if the status of a job was requested by any client within
+    the last DOWNLOAD_JOB_POLL_TIMEOUT seconds, or if jobs are not cancelled
+    when they are not polled.
+
+    Parameters
+    ----------
+    redis : ArqRedis
+    job_id : str
+
+    Returns
+    -------
+    bool
+    """
+    if DOWNLOAD_JOB_POLL_TIMEOUT == 0:
+        return True
+
+    min_time = int(time() * 1000) - DOWNLOAD_JOB_POLL_TIMEOUT * 1000
+    return bool(await redis.zcount(f"{POLL_PREFIX}{job_id}", min_time, "+inf"))
+
+
+async def detach_job_client(redis, job_id, client):
+    """Stop waiting for a job on behalf of a client, and cancel the job if no
+    other client requested its status within the last CLIENT_POLL_TIMEOUT
+    seconds.
+
+    Jobs are shared by all clients that make the same request (the job id is
+    the download key), so a job is not cancelled while other clients are still
+    waiting for it.
+
+    Parameters
+    ----------
+    redis : ArqRedis
+    job_id : str
+    client : str
+        IP address of client
+
+    Returns
+    -------
+    bool
+        True if the job was cancelled
+    """
+    key = f"{POLL_PREFIX}{job_id}"
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.zrem(key, client)
+        pipe.zcount(key, int(time() * 1000) - CLIENT_POLL_TIMEOUT * 1000, "+inf")
+        _, waiting = await pipe.execute()
+
+    if waiting:
+        return False
+
+    await cancel_job(redis, job_id)
+    return True
+
+
+async def cancel_job(redis, job_id):
+    """Request that the worker cancels a job.
+
+    This uses the same mechanism as arq.jobs.Job.abort() without waiting for
+    the result: queued jobs are not started, and jobs in progress are
+    cancelled, which in turn stops creating the download before its next
+    batch of records.
+
+    Parameters
+    ----------
+    redis : ArqRedis
+    job_id : str
+    """
+    await redis.zadd(abort_jobs_ss, {job_id: int(time() * 1000)})
+
+
+async def get_queue_position(redis, job_id):
+    """Get the number of jobs that are queued ahead of job_id.
+
+    Jobs remain in the queue while they are in progress; these and cancelled
+    jobs are not counted.
+
+    Parameters
+    ----------
+    redis : ArqRedis
+    job_id : str
+
+    Returns
+    -------
+    int
+    """
+    # ordered by score, same as the worker
+    job_ids = [id.decode() for id in await redis.zrange(REDIS_QUEUE, 0, -1)]
+    if job_id not in job_ids:
+        return 0
+
+    ahead = job_ids[: job_ids.index(job_id)]
+    if not ahead:
+        return 0
+
+    async with redis.pipeline(transaction=False) as pipe:
+        for id in ahead:
+            pipe.exists(f"{in_progress_key_prefix}{id}")
+            pipe.zscore(abort_jobs_ss, id)
+
+        values = await pipe.execute()
+
+    return sum(1 for in_progress, cancelled in zip(values[::2], values[1::2]) if not (in_progress or cancelled))
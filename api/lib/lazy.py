@@ -0,0 +1,130 @@
+from collections.abc import Mapping
+import threading
+from time import perf_counter
+
+from api.logger import log
+
+
+class LazyValue:
+    """Thread-safe handle to a value (e.g., a dataset or index) that is loaded
+    on first use.
+
+    Attributes of the handle are those of the loaded value, so that a handle to
+    a dataset can be used in place of the dataset.  Values that may not be
+    available (the loader returns None) must be accessed using load().
+
+    If loading fails, the error is logged and raised, and loading is retried
+    on next use.
+
+    Parameters
+    ----------
+    name : str
+        name used for logging and reporting load status
+    loader : callable
+        function without arguments that returns the value
+    """
+
+    def __init__(self, name, loader):
+        self.name = name
+        self.status = "pending"
+        self.load_time = None
+        self.error = None
+
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._value = None
+
+    def load(self):
+        """Get the value, loading it if needed.
+
+        Returns
+        -------
+        object or None
+            None if value is not available
+        """
+        if self._loaded:
+            return self._value
+
+        with self._lock:
+            # another thread may have loaded it while waiting for the lock
+            if self._loaded:
+                return self._value
+
+            self.status = "loading"
+            start = perf_counter()
+            try:
+                value = self._loader()
+
+            except Exception as ex:
+                self.status = "failed"
+                self.error = f"{type(ex).__name__}: {ex}"
+                self.load_time = perf_counter() - start
+                log.error(f"could not load {self.name}: {self.error}")
+                raise
+
+            self.load_time = perf_counter() - start
+            self.status = "loaded" if value is not None else "unavailable"
+            self.error = None
+            self._value = value
+            self._loaded = True
+
+        return self._value
+
+    @property
+    def loaded(self):
+        """True if the value was loaded (whether or not it is available), so
+        that load() returns without loading it or waiting for it to load.
+        """
+        return self._loaded
+
+    def get_status(self):
+        """Get load status, time to load in seconds, and error (if failed).
+
+        Returns
+        -------
+        dict
+        """
+        return {
+            "status": self.status,
+            "load_time": round(self.load_time, 4) if self.load_time is not None else None,
+            "error": self.error,
+        }
+
+    def __getattr__(self, name):
+        # only called for attributes that are not set on the handle
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        return getattr(self.load(), name)
+
+
+class LazyMapping(Mapping):
+    """Mapping of keys to values that are each loaded on first use.
+
+    Keys whose values are not available (the loader returns None) are treated
+    as missing, so that get() returns None for those.
+
+    Parameters
+    ----------
+    name : str
+        name used as prefix of the name of each handle
+    loaders : dict
+        dict of {<key>: <function without arguments that returns the value>}
+    """
+
+    def __init__(self, name, loaders):
+        self.handles = {key: LazyValue(f"{name}:{key}", loader) for key, loader in loaders.items()}
+
+    def __getitem__(self, key):
+        value = self.handles[key].load()
+        if value is None:
+            raise KeyError(key)
+
+        return value
+
+    def __iter__(self):
+        return (key for key, handle in self.handles.items() if handle.load() is not None)
+
+    def __len__(self):
+        return sum(1 for _ in self)
@@ -0,0 +1,348 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+import math
+import os
+from pathlib import Path
+
+
+class Counter:
+    """Counter of values by labels.
+
+    Metrics are only updated from the event loop thread of each process, so
+    no locking is needed; work done in other threads is accumulated in the
+    stats of the request (see add_request_stat()) and recorded when the
+    request is complete.
+
+    Parameters
+    ----------
+    name : str
+    description : str
+    labels : list-like of str, optional (default: ())
+    """
+
+    type = "counter"
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def inc(self, labels=(), amount=1):
+        """Increment counter for labels.
+
+        Parameters
+        ----------
+        labels : tuple, optional (default: ())
+            label values in same order as labels of counter
+        amount : int or float, optional (default: 1)
+        """
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def collect(self):
+        return [[list(labels), value] for labels, value in self.values.items()]
+
+
+class Histogram:
+    """Histogram of observed values by labels.
+
+    Values are counted in the first bucket with an upper bound greater than or
+    equal to the value; counts are made cumulative when rendered.
+
+    Parameters
+    ----------
+    name : str
+    description : str
+    labels : list-like of str
+    buckets : list-like of float
+        upper bounds of buckets, in increasing order; a bucket for +Inf is added
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, description, labels, buckets):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = list(buckets)
+        self.values = {}
+
+    def observe(self, labels, value):
+        """Record value for labels.
+
+        Parameters
+        ----------
+        labels : tuple
+            label values in same order as labels of histogram
+        value : float
+        """
+        entry = self.values.get(labels)
+        if entry is None:
+            # counts of each bucket (including +Inf), followed by sum of values
+            entry = self.values[labels] = [0] * (len(self.buckets) + 1) + [0]
+
+        entry[bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def collect(self):
+        return [[list(labels), list(entry)] for labels, entry in self.values.items()]
+
+
+class Callback:
+    """Metric whose values are read from other counters (e.g., of the result
+    cache) when collected.
+
+    Parameters
+    ----------
+    name : str
+    description : str
+    type : {"counter", "gauge"}
+    labels : list-like of str
+    func : callable
+        function without arguments that returns {<label values tuple>: value}
+    """
+
+    def __init__(self, name, description, type, labels, func):
+        self.name = name
+        self.description = description
+        self.type = type
+        self.labels = tuple(labels)
+        self.func = func
+
+    def collect(self):
+        return [[list(labels), value] for labels, value in self.func().items()]
+
+
+class Registry:
+    """Metrics of this process."""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def _add(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, description, labels=()):
+        return self._add(Counter(name, description, labels))
+
+    def histogram(self, name, description, labels, buckets):
+        return self._add(Histogram(name, description, labels, buckets))
+
+    def callback(self, name, description, type, labels, func):
+        return self._add(Callback(name, description, type, labels, func))
+
+    def snapshot(self):
+        """Get the current values of all metrics as a JSON-serializable dict.
+
+        Returns
+        -------
+        dict
+            {<name>: {"type": ..., "description": ..., "labels": [...], "buckets": [...] (histograms only),
+            "values": [[<label values>, <value>], ...]}, ...}
+        """
+        snapshot = {}
+        for name, metric in self.metrics.items():
+            snapshot[name] = {
+                "type": metric.type,
+                "description": metric.description,
+                "labels": list(metric.labels),
+                "values": metric.collect(),
+            }
+            if metric.type == "histogram":
+                snapshot[name]["buckets"] = metric.buckets
+
+        return snapshot
+
+
+def merge_snapshots(snapshots):
+    """Merge snapshots of metrics of several processes by adding their values.
+
+    Parameters
+    ----------
+    snapshots : list of dict
+        see Registry.snapshot()
+
+    Returns
+    -------
+    dict
+    """
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            if name not in merged:
+                merged[name] = {**metric, "values": {}}
+
+            values = merged[name]["values"]
+            for labels, value in metric["values"]:
+                labels = tuple(labels)
+                if labels not in values:
+                    values[labels] = value
+
+                elif isinstance(value, list):
+                    values[labels] = [a + b for a, b in zip(values[labels], value)]
+
+                else:
+                    values[labels] += value
+
+    for metric in merged.values():
+        metric["values"] = [[list(labels), value] for labels, value in metric["values"].items()]
+
+    return merged
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+
+    return str(value)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+def render_snapshot(snapshot):
+    """Render snapshot of metrics in the Prometheus text exposition format.
+
+    Parameters
+    ----------
+    snapshot : dict
+        see Registry.snapshot()
+
+    Returns
+    -------
+    str
+    """
+    lines = []
+    for name, metric in snapshot.items():
+        lines.append(f"# HELP {name} {metric['description']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+
+        labels = metric["labels"]
+        for label_values, value in sorted(metric["values"], key=lambda v: [str(x) for x in v[0]]):
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_format_labels(labels, label_values)} {_format_value(value)}")
+                continue
+
+            count = 0
+            for bound, bucket_count in zip(metric["buckets"] + [math.inf], value[:-1]):
+                count += bucket_count
+                bucket_labels = _format_labels(labels + ["le"], label_values + [_format_value(float(bound))])
+                lines.append(f"{name}_bucket{bucket_labels} {count}")
+
+            lines.append(f"{name}_sum{_format_labels(labels, label_values)} {_format_value(value[-1])}")
+            lines.append(f"{name}_count{_format_labels(labels, label_values)} {count}")
+
+    return "\n".join(lines) + "\n"
+
+
+def write_snapshot(snapshot, path):
+    """Write snapshot to path, replacing it atomically so that readers never
+    see a partially written file.
+
+    Parameters
+    ----------
+    snapshot : dict
+    path : Path
+    """
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text(json.dumps(snapshot))
+    os.replace(tmp_path, path)
+
+
+def read_snapshots(directory, exclude=None):
+    """Read snapshots written by other processes.
+
+    Parameters
+    ----------
+    directory : Path
+    exclude : Path, optional (default: None)
+        path of the snapshot of this process, which is not read
+
+    Returns
+    -------
+    list of dict
+    """
+    snapshots = []
+    for path in Path(directory).glob("*.json"):
+        if path == exclude:
+            continue
+
+        try:
+            snapshots.append(json.loads(path.read_text()))
+
+        except (OSError, ValueError):
+            # file was removed or is not a snapshot
+            continue
+
+    return snapshots
+
+
+### Stats of the current request or job
+
+_request_stats = ContextVar("request_stats", default=None)
+
+
+@contextmanager
+def collect_request_stats():
+    """Collect stats added using add_request_stat() and set_request_label()
+    while processing a request or job.
+
+    Stats are collected in a dict that is only used by this request, so they
+    can be added from threads that run work for the request (see
+    api.lib.executor.run_in_thread()) without locking.
+
+    Yields
+    ------
+    dict
+        {<name>: <value>, ...}
+    """
+    stats = {}
+    token = _request_stats.set(stats)
+    try:
+        yield stats
+
+    finally:
+        _request_stats.reset(token)
+
+
+def add_request_stat(name, amount):
+    """Add amount to stat of current request, if stats are collected.
+
+    Parameters
+    ----------
+    name : str
+        e.g., "rows_scanned", "rows_returned", "bytes_serialized", "cpu_seconds"
+    amount : int or float
+    """
+    stats = _request_stats.get()
+    if stats is not None:
+        stats[name] = stats.get(name, 0) + amount
+
+
+def set_request_label(name, value):
+    """Set label of current request, if stats are collected and the label is
+    not already set.
+
+    Parameters
+    ----------
+    name : str
+        e.g., "barrier_type"
+    value : object
+    """
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.setdefault(name, value)
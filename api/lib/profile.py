@@ -0,0 +1,331 @@
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, UTC
+import json
+import logging
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+import random
+import sys
+import threading
+from time import perf_counter, sleep
+import uuid
+
+from api.settings import (
+    PROFILE_DIR,
+    PROFILE_INTERVAL,
+    PROFILE_MAX_BYTES,
+    PROFILE_SAMPLE_RATE,
+    PROFILE_SLOW_SECONDS,
+    PROFILE_TOKEN,
+)
+
+log = logging.getLogger("api")
+
+# header used by admins to profile a request; value must match PROFILE_TOKEN
+PROFILE_HEADER = b"x-profile"
+
+# number of rotated files of traces to keep
+PROFILE_BACKUP_COUNT = 5
+
+
+class Profile:
+    """Stage timings and sampled stacks of a single request.
+
+    Stages are tracked separately for each thread that runs work for the
+    request, so that stages that run in executor threads are nested under
+    the stages that were active when they were started.
+
+    Parameters
+    ----------
+    method : str
+    path : str
+    query : str
+    """
+
+    def __init__(self, method, path, query):
+        self.id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.query = query
+        self.start = perf_counter()
+
+        # total time of each stage, by path of stages (separated by ";")
+        self.stages = Counter()
+
+        # stack of active stages by thread id
+        self.stage_stacks = {}
+
+        # ids of threads that are currently running work for this request
+        self.threads = set()
+
+        # number of samples of each folded stack
+        self.samples = Counter()
+
+
+_profile = ContextVar("profile", default=None)
+
+
+@contextmanager
+def stage(name):
+    """Record the time spent in a stage of processing the current request, if
+    it is profiled.  Otherwise this does nothing.
+
+    Can also be used as a decorator.
+
+    Parameters
+    ----------
+    name : str
+    """
+    profile = _profile.get()
+    if profile is None:
+        yield
+        return
+
+    stack = profile.stage_stacks.setdefault(threading.get_ident(), [])
+    stack.append(name)
+    start = perf_counter()
+    try:
+        yield
+
+    finally:
+        profile.stages[";".join(stack)] += perf_counter() - start
+        stack.pop()
+
+
+def get_stage_path():
+    """Get the stages that are active in the current thread, if the current
+    request is profiled.
+
+    Returns
+    -------
+    list of str
+    """
+    profile = _profile.get()
+    if profile is None:
+        return []
+
+    return list(profile.stage_stacks.get(threading.get_ident(), []))
+
+
+@contextmanager
+def sample_thread(parent_stages=()):
+    """Sample the stack of the current thread while it runs work for the
+    current request, if it is profiled.
+
+    This is used by executor threads (see api.lib.executor.run_in_thread()),
+    which only run work for one request at a time.
+
+    Parameters
+    ----------
+    parent_stages : list-like of str, optional (default: ())
+        stages that were active in the thread that submitted the work, which
+        are the parents of stages in this thread
+    """
+    profile = _profile.get()
+    if profile is None:
+        yield
+        return
+
+    thread_id = threading.get_ident()
+
+    # work may be run directly in the thread that submitted it
+    owns_stack = thread_id not in profile.stage_stacks
+    if owns_stack:
+        profile.stage_stacks[thread_id] = list(parent_stages)
+
+    profile.threads.add(thread_id)
+    try:
+        yield
+
+    finally:
+        profile.threads.discard(thread_id)
+        if owns_stack:
+            profile.stage_stacks.pop(thread_id, None)
+
+
+def _fold_stack(frame):
+    """Convert stack of frame to the names of its functions from outermost to
+    innermost."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_qualname} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+        frame = frame.f_back
+
+    return names[::-1]
+
+
+class _Sampler:
+    """Background thread that samples the stacks of threads that run work for
+    profiled requests every PROFILE_INTERVAL seconds.
+
+    The thread is only started once a request is profiled, and waits without
+    sampling while no requests are profiled.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.profiles = set()
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._thread = None
+
+    def add(self, profile):
+        with self._lock:
+            self.profiles.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+                self._thread.start()
+
+            self._active.set()
+
+    def remove(self, profile):
+        with self._lock:
+            self.profiles.discard(profile)
+            if not self.profiles:
+                self._active.clear()
+
+    def _run(self):
+        while True:
+            self._active.wait()
+
+            with self._lock:
+                profiles = list(self.profiles)
+
+            frames = sys._current_frames()
+            for profile in profiles:
+                for thread_id in list(profile.threads):
+                    frame = frames.get(thread_id)
+                    if frame is None:
+                        continue
+
+                    stages = profile.stage_stacks.get(thread_id, [])
+                    profile.samples[";".join([*stages, *_fold_stack(frame)])] += 1
+
+            del frames
+            sleep(self.interval)
+
+
+_sampler = _Sampler(PROFILE_INTERVAL)
+
+
+def _get_trace_logger(name, filename):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    if not logger.handlers:
+        PROFILE_DIR.mkdir(exist_ok=True, parents=True)
+        handler = RotatingFileHandler(
+            PROFILE_DIR / filename, maxBytes=PROFILE_MAX_BYTES, backupCount=PROFILE_BACKUP_COUNT
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+
+    return logger
+
+
+def write_trace(profile, route, status, duration):
+    """Write trace of a profiled request.
+
+    A summary with stage timings is written to slow_requests.jsonl, and the
+    sampled stacks are written to slow_requests.folded in the folded stack
+    format used by flamegraph.pl, speedscope, and similar tools.  The root of
+    each stack is the id of the trace, so that the flamegraph of one request
+    can be created using e.g.,
+    `grep '^<id> ' slow_requests.folded | flamegraph.pl > trace.svg`
+
+    Parameters
+    ----------
+    profile : Profile
+    route : str
+    status : int
+    duration : float
+    """
+    summary = {
+        "id": profile.id,
+        "time": datetime.now(UTC).isoformat(),
+        "method": profile.method,
+        "route": route,
+        "path": profile.path,
+        "query": profile.query,
+        "status": status,
+        "duration": round(duration, 6),
+        "stages": {name: round(value, 6) for name, value in profile.stages.items()},
+        "samples": sum(profile.samples.values()),
+        "sample_interval": PROFILE_INTERVAL,
+    }
+    _get_trace_logger("api.profile", "slow_requests.jsonl").info(json.dumps(summary))
+
+    if profile.samples:
+        root = f"{profile.id} {profile.method} {route}"
+        _get_trace_logger("api.profile.stacks", "slow_requests.folded").info(
+            "\n".join(f"{root};{stack} {count}" for stack, count in profile.samples.items())
+        )
+
+
+def _should_profile(scope):
+    if PROFILE_TOKEN:
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                return value.decode("latin-1") == PROFILE_TOKEN, True
+
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE, False
+
+
+class ProfileMiddleware:
+    """ASGI middleware that profiles requests that include the X-Profile
+    header with PROFILE_TOKEN as its value, and a random PROFILE_SAMPLE_RATE
+    fraction of other requests.
+
+    Traces of requests profiled by header are always written; traces of sampled
+    requests are only written if they took at least PROFILE_SLOW_SECONDS.
+    The id of the trace is returned in the X-Profile-Id header.
+
+    Parameters
+    ----------
+    app : ASGI app
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        enabled, requested = _should_profile(scope)
+        if not enabled:
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile(scope["method"], scope["path"], scope.get("query_string", b"").decode("latin-1"))
+        status = 500
+
+        async def send_with_profile_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-profile-id", profile.id.encode("latin-1"))]
+
+            await send(message)
+
+        token = _profile.set(profile)
+        _sampler.add(profile)
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+
+        finally:
+            _sampler.remove(profile)
+            _profile.reset(token)
+
+            duration = perf_counter() - profile.start
+            if requested or duration >= PROFILE_SLOW_SECONDS:
+                route = scope.get("route")
+                try:
+                    write_trace(profile, route.path if route is not None else "unmatched", status, duration)
+
+                except OSError as ex:
+                    log.error(f"could not write profile trace: {ex}")
@@ -1,5 +1,5 @@
+import asyncio
 import logging
-import time
 
 from redis.exceptions import TimeoutError
 
@@ -12,9 +12,26 @@ JOB_PREFIX = "arq:job-progress:"
 EXPIRATION = DOWNLOAD_JOB_TIMEOUT + 3600
 
 
+def get_progress_channel(job_id):
+    """Return the name of the Redis pub/sub channel for progress of job_id.
+
+    Parameters
+    ----------
+    job_id : str
+
+    Returns
+    -------
+    str
+    """
+    return f"{JOB_PREFIX}{job_id}"
+
+
 async def set_progress(redis, job_id, progress=0, message=""):
     """Store job progress to redis, and expire after EXPIRATION seconds.
 
+    Progress is also published to the progress channel for the job, so that
+    clients streaming job status are notified immediately.
+
     Parameters
     ----------
     redis: redis connection pool
@@ -27,7 +44,9 @@ async def set_progress(redis, job_id, progress=0, message=""):
     retry = 0
     while retry <= 5:
         try:
-            await redis.setex(f"{JOB_PREFIX}{job_id}", EXPIRATION, f"{progress}|{message}")
+            value = f"{progress}|{message}"
+            await redis.setex(f"{JOB_PREFIX}{job_id}", EXPIRATION, value)
+            await redis.publish(get_progress_channel(job_id), value)
             return
 
         except TimeoutError as ex:
@@ -36,7 +55,7 @@ async def set_progress(redis, job_id, progress=0, message=""):
                 raise ex
 
             log.error(f"Redis connection timeout in set_progress, retry {retry}")
-            time.sleep(2)
+            await asyncio.sleep(2)
 
 
 async def get_progress(redis, job_id):
@@ -72,4 +91,4 @@ async def get_progress(redis, job_id):
                 raise ex
 
             log.error(f"Redis connection timeout in get_progress, retry {retry}")
-            time.sleep(2)
+            await asyncio.sleep(2)
@@ -0,0 +1,55 @@
+import asyncio
+from dataclasses import replace
+
+import arq
+
+from api.settings import REDIS
+
+
+_pool = None
+_lock = asyncio.Lock()
+
+
+async def get_redis_pool(retry=False):
+    """Return the Redis / arq connection pool shared by all requests in this
+    process, creating it if it does not yet exist (e.g., if Redis was offline
+    at startup).
+
+    Parameters
+    ----------
+    retry : bool, optional (default: False)
+        if True, will retry connecting to Redis according to REDIS settings;
+        otherwise raises an error immediately if Redis is not available so that
+        requests are not blocked while Redis is offline
+
+    Returns
+    -------
+    ArqRedis
+    """
+    global _pool
+
+    if _pool is None:
+        async with _lock:
+            if _pool is None:
+                _pool = await arq.create_pool(REDIS if retry else replace(REDIS, conn_retries=0))
+
+    return _pool
+
+
+def set_redis_pool(pool):
+    """Set the shared connection pool, e.g., to use a fake Redis in tests.
+
+    Parameters
+    ----------
+    pool : ArqRedis or None
+    """
+    global _pool
+    _pool = pool
+
+
+async def close_redis_pool():
+    global _pool
+
+    if _pool is not None:
+        await _pool.aclose()
+        _pool = None
@@ -0,0 +1,225 @@
+from io import BytesIO
+import json
+import struct
+import zlib
+
+import numpy as np
+import pyarrow.compute as pc
+from pyarrow.csv import write_csv, WriteOptions
+
+from api.lib.domains import unpack_domains
+
+
+# reversed CRC-32 polynomial used by zlib
+CRC32_POLYNOMIAL = 0xEDB88320
+
+# gzip header: magic, deflate, no flags, no modification time, no extra flags, unix
+GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\x03"
+
+# final (empty) block of a raw deflate stream
+DEFLATE_END = b"\x03\x00"
+
+
+def _multiply_mod_crc(a, b):
+    """Multiply a and b modulo the CRC-32 polynomial (reflected)."""
+    m = 1 << 31
+    result = 0
+    while a:
+        if a & m:
+            result ^= b
+            a &= ~m
+
+        m >>= 1
+        b = (b >> 1) ^ CRC32_POLYNOMIAL if b & 1 else b >> 1
+
+    return result
+
+
+def crc32_shift(length):
+    """Calculate the factor used to combine the CRC-32 of a byte string with
+    the CRC-32 of a following byte string of length bytes (x^(8 * length)
+    modulo the CRC-32 polynomial).
+
+    Parameters
+    ----------
+    length : int
+
+    Returns
+    -------
+    int
+    """
+    power = 1 << 30  # x^1
+    factor = 1 << 31  # x^0
+    n = 8 * length
+    while n:
+        if n & 1:
+            factor = _multiply_mod_crc(power, factor)
+
+        power = _multiply_mod_crc(power, power)
+        n >>= 1
+
+    return factor
+
+
+def crc32_combine(crc1, crc2, shift):
+    """Calculate the CRC-32 of the concatenation of two byte strings from their
+    CRC-32 values, without reading their bytes.
+
+    This is the same as crc32_combine in zlib, except that the factor for the
+    length of the second byte string is precalculated using crc32_shift.
+
+    Parameters
+    ----------
+    crc1 : int
+    crc2 : int
+    shift : int
+        crc32_shift() of the length of the second byte string
+
+    Returns
+    -------
+    int
+    """
+    return _multiply_mod_crc(shift, crc1) ^ crc2
+
+
+def _to_csv(df, include_header):
+    """Write table to CSV bytes with lowercase column names, the same as
+    api.response.csv_response.
+    """
+    stream = BytesIO()
+    write_csv(
+        df.rename_columns([c.lower() for c in df.schema.names]).combine_chunks(),
+        stream,
+        write_options=WriteOptions(include_header=include_header),
+    )
+    return stream.getvalue()
+
+
+def _deflate(data):
+    """Compress data to a raw deflate stream that is not terminated, so that it
+    can be concatenated with other streams, which are then terminated by
+    DEFLATE_END.
+    """
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def _write_part(out_dir, name, data):
+    """Write data and its raw deflate stream, and return its manifest entry."""
+    compressed = _deflate(data)
+    (out_dir / f"{name}.csv").write_bytes(data)
+    (out_dir / f"{name}.deflate").write_bytes(compressed)
+
+    return {
+        "size": len(data),
+        "crc32": zlib.crc32(data),
+        "crc32_shift": crc32_shift(len(data)),
+        "deflate_size": len(compressed),
+    }
+
+
+def build_state_shards(df, out_dir):
+    """Write pre-rendered CSV of df for the public state query API as a header
+    and one shard for each combination of State and HasNetwork, along with a
+    raw deflate stream of each that can be concatenated into a gzip response.
+
+    Each shard contains the CSV rows of its records in order of df, with
+    domains unpacked.  Concatenating the header, the shards of a set of states
+    without networks, then the shards of those states with networks gives the
+    CSV of those states sorted by HasNetwork.
+
+    Parameters
+    ----------
+    df : pyarrow.Table
+        records with domains packed; must include State and HasNetwork
+    out_dir : Path
+        directory for shards, which is emptied first
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for path in out_dir.iterdir():
+        path.unlink()
+
+    df = df.combine_chunks()
+    states = df["State"].to_numpy(zero_copy_only=False)
+    has_network = df["HasNetwork"].to_numpy(zero_copy_only=False)
+    unpacked = unpack_domains(df)
+
+    manifest = {
+        "num_rows": len(df),
+        "header": _write_part(out_dir, "header", _to_csv(unpacked.slice(0, 0), include_header=True)),
+        "shards": {},
+    }
+
+    for state in pc.unique(df["State"]).to_pylist():
+        for network in (False, True):
+            rows = np.flatnonzero((states == state) & (has_network == network))
+            if len(rows) == 0:
+                continue
+
+            name = f"{state}_{int(network)}"
+            manifest["shards"][name] = {
+                "count": len(rows),
+                **_write_part(out_dir, name, _to_csv(unpacked.take(rows), include_header=False)),
+            }
+
+    (out_dir / "manifest.json").write_text(json.dumps(manifest))
+
+
+class StateShards:
+    """Pre-rendered CSV shards of a table for the public state query API.
+
+    Parameters
+    ----------
+    path : Path
+        directory created by build_state_shards
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        manifest = json.loads((path / "manifest.json").read_text())
+        self.num_rows = manifest["num_rows"]
+        self._header = manifest["header"]
+        self._shards = manifest["shards"]
+
+    def get_parts(self, states, gzip=False):
+        """Get the parts of the CSV of the records in states, in order.
+
+        Parameters
+        ----------
+        states : list-like of str
+        gzip : bool, optional (default: False)
+            if True, parts are for a gzip stream of the CSV
+
+        Returns
+        -------
+        (list of bytes or Path, int, int)
+            parts (bytes or Paths of files to read), total size of the parts,
+            and number of records
+        """
+        names = ["header"] + [
+            f"{state}_{network}"
+            for network in (0, 1)
+            for state in sorted(set(states))
+            if f"{state}_{network}" in self._shards
+        ]
+        entries = [self._header] + [self._shards[name] for name in names[1:]]
+        count = sum(entry["count"] for entry in entries[1:])
+
+        if not gzip:
+            return [self.path / f"{name}.csv" for name in names], sum(entry["size"] for entry in entries), count
+
+        crc = 0
+        size = 0
+        for entry in entries:
+            crc = crc32_combine(crc, entry["crc32"], entry["crc32_shift"])
+            size += entry["size"]
+
+        parts = (
+            [GZIP_HEADER]
+            + [self.path / f"{name}.deflate" for name in names]
+            + [DEFLATE_END + struct.pack("<II", crc, size & 0xFFFFFFFF)]
+        )
+        total_size = len(GZIP_HEADER) + sum(entry["deflate_size"] for entry in entries) + len(DEFLATE_END) + 8
+
+        return parts, total_size, count
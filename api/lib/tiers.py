@@ -34,8 +34,91 @@ METRICS = [
     "MainstemSizeClasses",
 ]
 
+# columns that hold the global dense rank of each metric, if available (these
+# are added by extract_records)
+METRIC_RANK_FIELDS = {field: f"_{field}_rank" for field in METRICS}
 
-def calculate_score(column, ascending=True):
+
+def _get_group_ranks(values, groups, num_groups):
+    """Calculate the position of each value within the sorted unique values of
+    its group for all groups at once.
+
+    Values are sorted once across all groups to assign each unique value a
+    code, which is then combined with the group of each value to rank values
+    within their groups.
+
+    Same as calculate_score for each group, -0.0 and 0.0 are counted as
+    different unique values but 0.0 is ranked at the same position as -0.0.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+    groups : numpy.ndarray
+        integer group code of each value
+    num_groups : int
+
+    Returns
+    -------
+    (numpy.ndarray, numpy.ndarray)
+        tuple of position of each value within the unique values of its group
+        and number of unique values in the group of each value
+    """
+    if len(values) == 0:
+        return np.empty(0, dtype="int64"), np.empty(0, dtype="int64")
+
+    is_negative_zero = (values == 0) & np.signbit(values)
+    has_negative_zero = is_negative_zero.any()
+
+    if has_negative_zero:
+        # sort -0.0 before 0.0 so that they are different unique values
+        order = np.lexsort((~np.signbit(values), values))
+    else:
+        order = np.argsort(values)
+
+    sorted_values = values[order]
+    is_unique_start = np.empty(len(values), dtype="bool")
+    is_unique_start[0] = True
+    is_unique_start[1:] = sorted_values[1:] != sorted_values[:-1]
+    if has_negative_zero:
+        sorted_signs = np.signbit(sorted_values)
+        is_unique_start[1:] |= sorted_signs[1:] != sorted_signs[:-1]
+
+    value_codes = np.empty(len(values), dtype="int64")
+    value_codes[order] = np.cumsum(is_unique_start) - 1
+
+    # find the rank of each combination of group and value within all unique
+    # combinations, sorted by group then value
+    num_values = int(value_codes[order[-1]]) + 1
+    keys = groups.astype("int64") * num_values + value_codes
+    num_keys = num_groups * num_values
+
+    if num_keys <= 4 * len(keys):
+        # mark combinations that are present; the rank of each is the number of
+        # combinations present before it
+        present = np.zeros(num_keys, dtype="bool")
+        present[keys] = True
+        key_ranks = (np.cumsum(present) - 1)[keys]
+        num_unique = present.reshape(num_groups, num_values).sum(axis=1)
+
+    else:
+        unique_keys, key_ranks = np.unique(keys, return_inverse=True)
+        num_unique = np.bincount(unique_keys // num_values, minlength=num_groups)
+
+    # rank within group is the rank of the combination minus the rank of the
+    # first combination in the group
+    group_start = np.cumsum(num_unique) - num_unique
+    ranks = key_ranks - group_start[groups]
+
+    if has_negative_zero:
+        # 0.0 sorts at the same position as -0.0 within groups that have both
+        group_has_negative_zero = np.zeros(num_groups, dtype="bool")
+        group_has_negative_zero[groups[is_negative_zero]] = True
+        ranks[(values == 0) & ~np.signbit(values) & group_has_negative_zero[groups]] -= 1
+
+    return ranks, num_unique[groups]
+
+
+def calculate_score(column, ascending=True, groups=None, num_groups=None):
     """Calculate score based on the rank of a row's value within the sorted array of unique values.
     By default, the smallest unique value receives the lowest score, and the largest unique value
     receives the highest score.
@@ -47,12 +130,27 @@ def calculate_score(column, ascending=True):
     ascending : boolean (default: True)
         If True, unique values are sorted in ascending order, meaning that the lowest score is the
         lowest unique value in the series, and the highest score is the length of the unique values.
+    groups : numpy.ndarray, optional (default: None)
+        If provided, integer group code of each entry in the array; unique values
+        and scores are determined within each group.
+    num_groups : int, optional (default: None)
+        Number of groups; required if groups are provided.
 
     Returns
     -------
     numpy.ndarray, dtype is float64
         score value for each entry in the array
     """
+    if groups is not None:
+        ranks, num_unique = _get_group_ranks(column.to_numpy(), groups, num_groups)
+        if not ascending:
+            ranks = num_unique - 1 - ranks
+
+        rank_size = num_unique - 1
+        rank_size[rank_size == 0] = 1  # to prevent divide by 0
+
+        return ranks / rank_size
+
     unique = column.unique()
     rank_size = len(unique) - 1 or 1  # to prevent divide by 0
 
@@ -65,6 +163,46 @@ def calculate_score(column, ascending=True):
     return score
 
 
+def calculate_score_from_ranks(ranks, positive_zero_rank=None):
+    """Calculate score based on the rank of a row's value within the sorted array
+    of unique values, using the dense rank of each value among all values of the
+    metric (in ascending order).
+
+    Equivalent to calculate_score, but the unique values are found by marking
+    which global ranks are present rather than by sorting the values.
+
+    Parameters
+    ----------
+    ranks : pyarrow ChunkedArray
+        0-based dense rank of each value within all values of the metric
+    positive_zero_rank : int, optional (default: None)
+        rank of 0.0 if both -0.0 and 0.0 were ranked separately; these are
+        different unique values but equal when sorted
+
+    Returns
+    -------
+    numpy.ndarray, dtype is float64
+        score value for each entry in the array
+    """
+    ranks = ranks.to_numpy()
+    if len(ranks) == 0:
+        return np.empty(0, dtype="float64")
+
+    present = np.zeros(int(ranks.max()) + 1, dtype="bool")
+    present[ranks] = True
+    local_ranks = np.cumsum(present) - 1
+
+    rank_size = int(local_ranks[-1]) or 1  # to prevent divide by 0
+
+    positions = local_ranks[ranks]
+    if positive_zero_rank is not None and positive_zero_rank < len(present) and present[positive_zero_rank - 1]:
+        # 0.0 sorts at the same position as -0.0
+        positions[ranks == positive_zero_rank] -= 1
+
+    # convert position of value within unique values to 0-1 scale
+    return positions / rank_size
+
+
 def calculate_composite_score(scores, columns, weights=None):
     """Calculate composite score calculated across columns.
 
@@ -97,7 +235,7 @@ def calculate_composite_score(scores, columns, weights=None):
     return score
 
 
-def calculate_tier(scores):
+def calculate_tier(scores, groups=None, num_groups=None):
     """Calculate tiers based on 5% increments of the composite score calculated
     across columns.
 
@@ -106,14 +244,32 @@ def calculate_tier(scores):
     Parameters
     ----------
     scores : numpy.ndarray
+    groups : numpy.ndarray, optional (default: None)
+        If provided, integer group code of each score; the score range is
+        determined within each group.
+    num_groups : int, optional (default: None)
+        Number of groups; required if groups are provided.
 
     Returns
     -------
     numpy.ndarray
     """
 
-    min_score, max_score = pc.min_max(scores).as_py().values()
-    score_range = (max_score - min_score) or 1  # avoid divide by 0
+    if groups is not None:
+        min_score = np.full(num_groups, np.inf)
+        np.minimum.at(min_score, groups, scores)
+        max_score = np.full(num_groups, -np.inf)
+        np.maximum.at(max_score, groups, scores)
+
+        score_range = max_score - min_score
+        score_range[score_range == 0] = 1  # avoid divide by 0
+
+        min_score = min_score[groups]
+        score_range = score_range[groups]
+
+    else:
+        min_score, max_score = pc.min_max(scores).as_py().values()
+        score_range = (max_score - min_score) or 1  # avoid divide by 0
 
     # calculate relative score
     relative_score = 100.0 * (scores - min_score) / score_range
@@ -124,7 +280,7 @@ def calculate_tier(scores):
     return tiers
 
 
-def calculate_tiers(df):
+def calculate_tiers(df, group_field=None):
     """Calculate tiers for each input scenario, which is based on combining scores for
     each scenario's inputs.
 
@@ -134,6 +290,12 @@ def calculate_tiers(df):
         Input data frame containing at least all input fields
     group_field: str, optional (default: None)
         Name of a column to use for grouping tier calculation (all scores will be based on values within each group).
+        Tiers for all groups are calculated together rather than for each group
+        separately; the results are the same as calculating tiers for each group.
+
+        If df includes the global dense ranks of the metrics (see
+        METRIC_RANK_FIELDS) and group_field is not set, scores are calculated
+        from those ranks instead of sorting the values of each metric.
 
     Returns
     -------
@@ -141,11 +303,30 @@ def calculate_tiers(df):
         Table is in same order as input
     """
 
-    scores = {field: calculate_score(df[field]) for field in METRICS}
+    groups = None
+    num_groups = None
+    if group_field is not None:
+        encoded = df[group_field].combine_chunks().dictionary_encode()
+        if encoded.null_count:
+            raise ValueError(f"{group_field} must not contain null values")
+
+        groups = encoded.indices.to_numpy()
+        num_groups = len(encoded.dictionary)
+
+    scores = {}
+    for field in METRICS:
+        rank_field = METRIC_RANK_FIELDS[field]
+        if group_field is None and rank_field in df.column_names:
+            positive_zero_rank = (df.schema.field(rank_field).metadata or {}).get(b"positive_zero_rank")
+            scores[field] = calculate_score_from_ranks(
+                df[rank_field], positive_zero_rank=int(positive_zero_rank) if positive_zero_rank is not None else None
+            )
+        else:
+            scores[field] = calculate_score(df[field], groups=groups, num_groups=num_groups)
 
     tiers = {}
     for scenario, inputs in SCENARIOS.items():
         scores[scenario] = calculate_composite_score(scores, columns=[field for field in inputs])
-        tiers[f"{scenario}_tier"] = calculate_tier(scores[scenario])
+        tiers[f"{scenario}_tier"] = calculate_tier(scores[scenario], groups=groups, num_groups=num_groups)
 
     return pa.Table.from_pydict(tiers)
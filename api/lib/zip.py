@@ -0,0 +1,126 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from zipfile import ZIP_DEFLATED
+import zlib
+
+from api.settings import ZIP_THREADS
+
+
+# number of bytes of uncompressed data deflated as an independent block
+ZIP_CHUNK_SIZE = 1024 * 1024
+
+# size of the deflate window; the end of each chunk is used as the dictionary
+# of the next chunk so that the compression ratio is nearly the same as
+# compressing all data at once
+DEFLATE_WINDOW = 32 * 1024
+
+# thread pools by number of threads, shared by all zip files being written
+_executors = {}
+_executors_lock = Lock()
+
+
+def _get_executor(threads):
+    # created on first use, so that threads are only started if needed
+    with _executors_lock:
+        if threads not in _executors:
+            _executors[threads] = ThreadPoolExecutor(threads, thread_name_prefix="zip")
+
+        return _executors[threads]
+
+
+def _deflate(data, zdict, compresslevel, final):
+    if zdict:
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    # a sync flush ends the output on a byte boundary without ending the
+    # deflate stream, so that the output of each chunk can be concatenated
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class ParallelDeflate:
+    """Raw deflate compressor that compresses chunks of ZIP_CHUNK_SIZE bytes in
+    a thread pool, with the same interface as the compressor returned by
+    zlib.compressobj().
+
+    Chunks are compressed independently (zlib releases the GIL while
+    compressing) and their output is returned in order, so that it forms a
+    single deflate stream.  At most 2 chunks per thread are compressed or
+    waiting at a time, so that memory use is bounded.
+
+    Parameters
+    ----------
+    compresslevel : int
+    threads : int, optional (default: ZIP_THREADS)
+    """
+
+    def __init__(self, compresslevel, threads=ZIP_THREADS):
+        self.compresslevel = compresslevel
+        self.max_pending = 2 * threads
+        self._executor = _get_executor(threads)
+        self._buffer = bytearray()
+        self._pending = deque()
+        self._zdict = b""
+
+    def _submit(self, data, final):
+        self._pending.append(self._executor.submit(_deflate, data, self._zdict, self.compresslevel, final))
+        self._zdict = data[-DEFLATE_WINDOW:]
+
+    def compress(self, data):
+        self._buffer += data
+        while len(self._buffer) >= ZIP_CHUNK_SIZE:
+            self._submit(bytes(self._buffer[:ZIP_CHUNK_SIZE]), final=False)
+            del self._buffer[:ZIP_CHUNK_SIZE]
+
+        out = []
+        while self._pending and (self._pending[0].done() or len(self._pending) > self.max_pending):
+            out.append(self._pending.popleft().result())
+
+        return b"".join(out)
+
+    def flush(self):
+        self._submit(bytes(self._buffer), final=True)
+        self._buffer.clear()
+
+        out = [future.result() for future in self._pending]
+        self._pending.clear()
+
+        return b"".join(out)
+
+
+def open_zip_entry(zf, name, threads=ZIP_THREADS):
+    """Open an entry for writing in a zip file that uses ZIP_DEFLATED, which is
+    compressed in parallel if threads is greater than 1.
+
+    NOTE: the parallel compressor replaces the compressor of the entry created
+    by zipfile, which calculates the CRC and sizes of the uncompressed data
+    written to the entry as usual.  The entry is always written using ZIP64,
+    because its size is not known in advance.  If the entry does not have a
+    compressor to replace, it is compressed serially by zipfile.
+
+    Parameters
+    ----------
+    zf : ZipFile
+        open for writing, using ZIP_DEFLATED compression
+    name : str
+        name of entry
+    threads : int, optional (default: ZIP_THREADS)
+
+    Returns
+    -------
+    writable file-like object
+    """
+    if zf.compression != ZIP_DEFLATED:
+        raise ValueError("zip file must use ZIP_DEFLATED compression")
+
+    entry = zf.open(name, "w", force_zip64=True)
+
+    # the private _compressor attribute of the entry is an implementation
+    # detail of zipfile in CPython, which may change in other versions
+    if threads > 1 and hasattr(entry, "_compressor"):
+        compresslevel = zlib.Z_DEFAULT_COMPRESSION if zf.compresslevel is None else zf.compresslevel
+        entry._compressor = ParallelDeflate(compresslevel, threads=threads)
+
+    return entry
@@ -0,0 +1,311 @@
+import asyncio
+import os
+from time import perf_counter
+
+from fastapi import APIRouter
+from fastapi.responses import Response
+
+from api.lib.cache import result_cache
+from api.lib.executor import admission
+from api.lib.metrics import (
+    Registry,
+    collect_request_stats,
+    merge_snapshots,
+    read_snapshots,
+    render_snapshot,
+    write_snapshot,
+)
+from api.lib.redis_pool import get_redis_pool
+from api.logger import log
+from api.settings import METRICS_DIR, METRICS_INTERVAL, REDIS_QUEUE
+
+
+router = APIRouter()
+
+REQUEST_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+JOB_BUCKETS = [1, 5, 10, 30, 60, 120, 300, 600]
+
+# metrics of this process; only updated from the event loop thread
+registry = Registry()
+
+request_duration = registry.histogram(
+    "api_request_duration_seconds",
+    "Time to process and send response to request",
+    ["route", "method", "status"],
+    REQUEST_BUCKETS,
+)
+rows_scanned = registry.counter(
+    "api_rows_scanned_total", "Rows of barrier tables read or evaluated to process requests", ["route", "barrier_type"]
+)
+rows_returned = registry.counter(
+    "api_rows_returned_total", "Rows serialized in responses to requests", ["route", "barrier_type"]
+)
+bytes_serialized = registry.counter(
+    "api_bytes_serialized_total", "Bytes of CSV, feather, or zip responses to requests", ["route", "barrier_type"]
+)
+cpu_seconds = registry.counter(
+    "api_cpu_seconds_total",
+    "CPU time of work run in executor threads to process requests",
+    ["route", "barrier_type"],
+)
+field_requests = registry.counter(
+    "api_query_field_requests_total",
+    "Requests that select barriers by summary unit layer or filter field",
+    ["barrier_type", "field"],
+)
+field_cpu_seconds = registry.counter(
+    "api_query_field_cpu_seconds_total",
+    "CPU time of requests that select barriers by summary unit layer or filter field",
+    ["barrier_type", "field"],
+)
+archive_requests = registry.counter(
+    "api_download_archive_requests_total",
+    "Requests for custom downloads that reused an existing archive (hit) or not (miss)",
+    ["barrier_type", "result"],
+)
+
+job_duration = registry.histogram(
+    "download_job_duration_seconds",
+    "Time to run custom download job in background worker",
+    ["barrier_type", "format", "status"],
+    JOB_BUCKETS,
+)
+job_queue_time = registry.histogram(
+    "download_job_queue_seconds",
+    "Time custom download job waited in queue before starting",
+    ["barrier_type"],
+    JOB_BUCKETS,
+)
+job_rows = registry.counter("download_job_rows_total", "Rows written by custom download jobs", ["barrier_type"])
+job_bytes = registry.counter(
+    "download_job_bytes_total", "Bytes of zip files written by custom download jobs", ["barrier_type"]
+)
+
+registry.callback(
+    "api_result_cache_requests_total",
+    "Lookups in result cache by result (hit, redis_hit, miss)",
+    "counter",
+    ["result"],
+    lambda: {(key,): value for key, value in result_cache.stats().items() if key in {"hits", "redis_hits", "misses"}},
+)
+registry.callback(
+    "api_result_cache_bytes",
+    "Size of responses in result cache",
+    "gauge",
+    [],
+    lambda: {(): result_cache.stats()["bytes"]},
+)
+registry.callback(
+    "api_admission_total",
+    "Requests admitted or rejected (503) by admission control",
+    "counter",
+    ["result"],
+    lambda: {(key,): value for key, value in admission.stats().items() if key in {"admitted", "rejected"}},
+)
+registry.callback(
+    "api_requests_in_progress",
+    "Requests currently admitted for processing",
+    "gauge",
+    [],
+    lambda: {(): admission.stats()["requests"]},
+)
+
+
+def _get_label(value):
+    # barrier types may be enums
+    return str(getattr(value, "value", value)) if value is not None else ""
+
+
+def record_request(route, method, status, duration, stats):
+    """Record metrics of a request.
+
+    Parameters
+    ----------
+    route : str
+        path template of route
+    method : str
+    status : int
+    duration : float
+        seconds
+    stats : dict
+        stats collected while processing request
+    """
+    request_duration.observe((route, method, str(status)), duration)
+
+    if not stats:
+        return
+
+    barrier_type = _get_label(stats.get("barrier_type"))
+    labels = (route, barrier_type)
+    for counter, name in [
+        (rows_scanned, "rows_scanned"),
+        (rows_returned, "rows_returned"),
+        (bytes_serialized, "bytes_serialized"),
+        (cpu_seconds, "cpu_seconds"),
+    ]:
+        if name in stats:
+            counter.inc(labels, stats[name])
+
+    for field in stats.get("fields", []):
+        field_requests.inc((barrier_type, field))
+        field_cpu_seconds.inc((barrier_type, field), stats.get("cpu_seconds", 0))
+
+
+def record_job(barrier_type, format, status, duration, queue_time, stats):
+    """Record metrics of a custom download job.
+
+    Parameters
+    ----------
+    barrier_type : str
+    format : str
+    status : {"success", "failed", "cancelled"}
+    duration : float
+        seconds
+    queue_time : float or None
+        seconds job waited in queue
+    stats : dict
+        stats collected while running job
+    """
+    barrier_type = _get_label(barrier_type)
+    job_duration.observe((barrier_type, _get_label(format), status), duration)
+
+    if queue_time is not None:
+        job_queue_time.observe((barrier_type,), queue_time)
+
+    job_rows.inc((barrier_type,), stats.get("rows_returned", 0))
+    job_bytes.inc((barrier_type,), stats.get("bytes_serialized", 0))
+
+
+class MetricsMiddleware:
+    """ASGI middleware that records the latency of each request by route, and
+    the stats collected while processing it.
+
+    Parameters
+    ----------
+    app : ASGI app
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+            await send(message)
+
+        with collect_request_stats() as stats:
+            try:
+                await self.app(scope, receive, send_with_status)
+
+            finally:
+                # use the path template instead of the path to limit the number of labels
+                route = scope.get("route")
+                record_request(
+                    route.path if route is not None else "unmatched",
+                    scope["method"],
+                    status,
+                    perf_counter() - start,
+                    stats,
+                )
+
+
+def get_snapshot_path(kind):
+    """Get path of snapshot of metrics of this process in METRICS_DIR.
+
+    Parameters
+    ----------
+    kind : {"api", "worker"}
+
+    Returns
+    -------
+    Path or None
+        None if METRICS_DIR is not set
+    """
+    if METRICS_DIR is None:
+        return None
+
+    return METRICS_DIR / f"{kind}-{os.getpid()}.json"
+
+
+def save_metrics(kind):
+    """Write snapshot of metrics of this process to METRICS_DIR, if set.
+
+    Parameters
+    ----------
+    kind : {"api", "worker"}
+    """
+    path = get_snapshot_path(kind)
+    if path is None:
+        return
+
+    try:
+        write_snapshot(registry.snapshot(), path)
+
+    except OSError as ex:
+        log.error(f"could not write metrics to {path}: {ex}")
+
+
+async def save_metrics_periodically(kind):
+    """Write snapshot of metrics of this process to METRICS_DIR every
+    METRICS_INTERVAL seconds, so that they are included by /metrics served by
+    any other process.
+
+    Parameters
+    ----------
+    kind : {"api", "worker"}
+    """
+    while True:
+        await asyncio.sleep(METRICS_INTERVAL)
+        save_metrics(kind)
+
+
+async def _get_queue_depth():
+    try:
+        redis = await get_redis_pool()
+        return await redis.zcard(REDIS_QUEUE)
+
+    except Exception as ex:
+        log.error(f"Could not read download queue depth from Redis: {ex}")
+        return None
+
+
+@router.get("/metrics")
+async def metrics():
+    """Return metrics in the Prometheus text exposition format.
+
+    If METRICS_DIR is set, these are the totals of all API and background
+    worker processes (as of their last snapshot); otherwise these are only the
+    metrics of the API worker that serves this request.
+    """
+    snapshots = [registry.snapshot()]
+    if METRICS_DIR is not None:
+        snapshots.extend(read_snapshots(METRICS_DIR, exclude=get_snapshot_path("api")))
+
+    # queue depth is only read by this process, so that it is not added up
+    # across processes
+    queue_depth = await _get_queue_depth()
+    if queue_depth is not None:
+        snapshots.append(
+            {
+                "download_queue_jobs": {
+                    "type": "gauge",
+                    "description": "Custom download jobs queued or in progress",
+                    "labels": [],
+                    "values": [[[], queue_depth]],
+                }
+            }
+        )
+
+    return Response(
+        content=render_snapshot(merge_snapshots(snapshots)), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
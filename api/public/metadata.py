@@ -1,3 +1,4 @@
+from functools import cache
 import json
 from pathlib import Path
 from datetime import date
@@ -13,6 +14,7 @@ from api.constants import (
     SB_PUBLIC_EXPORT_FIELDS,
 )
 from api.data import dams, small_barriers
+from api.lib.executor import run_in_thread
 from api.metadata import description, terms_of_use
 
 
@@ -36,9 +38,14 @@ def get_core_metadata(url):
     }
 
 
-# Get list of states that have dams or barriers
-dam_states = sorted(pc.unique(dams.scanner(columns=["State"]).to_table()["State"]).tolist())
-barrier_states = sorted(pc.unique(small_barriers.scanner(columns=["State"]).to_table()["State"]).tolist())
+@cache
+def get_states(barrier_type):
+    """Get list of states that have dams or barriers; this is calculated on
+    first use rather than on import, so that importing the API does not read
+    the datasets.
+    """
+    dataset = dams if barrier_type == "dams" else small_barriers
+    return sorted(pc.unique(dataset.scanner(columns=["State"]).to_table()["State"]).tolist())
 
 
 @router.get("/dams/metadata")
@@ -48,8 +55,8 @@ async def get_dams_metadata(
     """Return basic metadata describing the dams data."""
 
     metadata = {
-        "count": dams.count_rows(),
-        "available_states": dam_states,
+        "count": await run_in_thread(dams.count_rows),
+        "available_states": await run_in_thread(get_states, "dams"),
         "fields": {k: v for k, v in DAM_FIELD_DEFINITIONS.items() if k in DAM_PUBLIC_EXPORT_FIELDS},
     }
 
@@ -65,8 +72,8 @@ async def get_barriers_metadata(
     """Return basic metadata describing the small barriers data."""
 
     metadata = {
-        "count": small_barriers.count_rows(),
-        "available_states": barrier_states,
+        "count": await run_in_thread(small_barriers.count_rows),
+        "available_states": await run_in_thread(get_states, "small_barriers"),
         "fields": {k: v for k, v in SB_FIELD_DEFINITIONS.items() if k in SB_PUBLIC_EXPORT_FIELDS},
     }
 
@@ -10,14 +10,28 @@ from api.constants import (
     SB_PUBLIC_EXPORT_FIELDS,
 )
 from api.lib.domains import unpack_domains
-from api.data import dams, small_barriers, removed_dams
+from api.data import dams, small_barriers, removed_dams, state_shards
+from api.lib.executor import admit, load_in_thread, run_in_thread
+from api.lib.extract import estimate_record_count
+from api.lib.metrics import add_request_stat, set_request_label
 from api.logger import log, log_request
-from api.response import csv_response
+from api.response import csv_response, concat_response
 
 
 router = APIRouter()
 
 
+def _query_by_state(dataset, columns, ids):
+    df = dataset.scanner(columns=columns, filter=pc.is_in(pc.field("State"), ids)).to_table().sort_by("HasNetwork")
+    df = unpack_domains(df)
+
+    return df, csv_response(df)
+
+
+def _query_removed_dams():
+    return csv_response(unpack_domains(removed_dams.to_table()))
+
+
 @router.get("/{barrier_type}/state")
 async def query_by_state(request: Request, barrier_type: PublicAPIBarrierTypes, id: str):
     """Return subset of barrier_type based on state abbreviations.
@@ -48,14 +62,37 @@ async def query_by_state(request: Request, barrier_type: PublicAPIBarrierTypes,
     if invalid:
         raise HTTPException(400, detail=f"ids are not valid: {', '.join(invalid)}")
 
+    set_request_label("barrier_type", "dams" if barrier_type == "dams" else "small_barriers")
+    set_request_label("fields", ["State"])
+
+    # use pre-rendered CSV if available; these only depend on the data version
+    shards = await load_in_thread(state_shards.handles["dams" if barrier_type == "dams" else "small_barriers"])
+    if shards is not None:
+        gzip = "gzip" in request.headers.get("accept-encoding", "")
+        parts, size, count = shards.get_parts(ids, gzip=gzip)
+        add_request_stat("rows_returned", count)
+
+        log.info(f"public query selected {count:,} {barrier_type.replace('_', ' ')}")
+
+        return concat_response(
+            parts,
+            size,
+            media_type="text/csv",
+            headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"} if gzip else {"Vary": "Accept-Encoding"},
+        )
+
     ids = pa.array(ids)
 
-    df = dataset.scanner(columns=columns, filter=pc.is_in(pc.field("State"), ids)).to_table().sort_by("HasNetwork")
-    df = unpack_domains(df)
+    # the estimate reads the indexes, so it is calculated in the thread pool
+    cost = await run_in_thread(
+        estimate_record_count, "dams" if barrier_type == "dams" else "small_barriers", {"State": ids}, {}
+    )
+    async with admit(cost):
+        df, response = await run_in_thread(_query_by_state, dataset, columns, ids)
 
     log.info(f"public query selected {len(df):,} {barrier_type.replace('_', ' ')}")
 
-    return csv_response(df)
+    return response
 
 
 @router.get("/removed_dams")
@@ -65,6 +102,6 @@ async def query_removed_dams(
     """Return dams that were removed for conservation"""
 
     log_request(request)
-    df = unpack_domains(removed_dams.to_table())
 
-    return csv_response(df)
+    async with admit((await load_in_thread(removed_dams)).count_rows()):
+        return await run_in_thread(_query_removed_dams)
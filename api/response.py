@@ -1,11 +1,17 @@
 from io import BytesIO
+from pathlib import Path
 from zipfile import ZipFile, ZIP_DEFLATED
 
-from fastapi.responses import Response
+import anyio
+from fastapi.responses import Response, StreamingResponse
 from pyarrow.feather import write_feather
 from pyarrow.csv import write_csv
 
+from api.lib.metrics import add_request_stat
+from api.lib.profile import stage
 
+
+@stage("serialize")
 def csv_response(df, bounds=None):
     """Write data frame to CSV and return Response with proper headers
 
@@ -23,7 +29,11 @@ def csv_response(df, bounds=None):
     cols = [c.lower() for c in df.schema.names]
     write_csv(df.rename_columns(cols).combine_chunks(), csv_stream)
 
-    response = Response(content=csv_stream.getvalue(), media_type="text/csv")
+    content = csv_stream.getvalue()
+    add_request_stat("rows_returned", len(df))
+    add_request_stat("bytes_serialized", len(content))
+
+    response = Response(content=content, media_type="text/csv")
 
     if bounds is not None:
         response.headers["X-BOUNDS"] = ",".join(str(b) for b in bounds)
@@ -31,6 +41,7 @@ def csv_response(df, bounds=None):
     return response
 
 
+@stage("serialize")
 def feather_response(df, bounds=None):
     """Write data frame to feather (Arrow IPC) and return Response with proper headers
 
@@ -57,6 +68,51 @@ def feather_response(df, bounds=None):
         # Feather format in JS Arrow lib does not yet support compressed
         compression="uncompressed",
     )
-    response = Response(content=stream.getvalue(), media_type="application/octet-stream")
+    content = stream.getvalue()
+    add_request_stat("rows_returned", len(df))
+    add_request_stat("bytes_serialized", len(content))
+
+    response = Response(content=content, media_type="application/octet-stream")
 
     return response
+
+
+# size of chunks read from files streamed by concat_response
+FILE_CHUNK_SIZE = 64 * 1024
+
+
+async def _iter_parts(parts):
+    for part in parts:
+        if not isinstance(part, Path):
+            yield part
+            continue
+
+        async with await anyio.open_file(part, mode="rb") as infile:
+            while chunk := await infile.read(FILE_CHUNK_SIZE):
+                yield chunk
+
+
+def concat_response(parts, size, media_type, headers=None):
+    """Return Response that streams the concatenation of files and bytes,
+    without reading all files into memory.
+
+    Parameters
+    ----------
+    parts : list of bytes or Path
+    size : int
+        total size of parts in bytes
+    media_type : str
+    headers : dict, optional (default: None)
+        additional headers
+
+    Returns
+    -------
+    fastapi StreamingResponse
+    """
+    add_request_stat("bytes_serialized", size)
+
+    return StreamingResponse(
+        _iter_parts(parts),
+        media_type=media_type,
+        headers={"Content-Length": str(size), **(headers or {})},
+    )
@@ -1,3 +1,4 @@
+import asyncio
 from contextlib import asynccontextmanager
 import logging
 
@@ -9,8 +10,21 @@ from fastapi.responses import Response
 import sentry_sdk
 from sentry_sdk.integrations.asgi import SentryAsgiMiddleware
 
+from api.data import warmup
+from api.lib.executor import shutdown_executors
+from api.lib.profile import ProfileMiddleware
+from api.lib.redis_pool import get_redis_pool, close_redis_pool
 from api.logger import log
-from api.settings import ALLOWED_ORIGINS, SENTRY_DSN, API_ROOT_PATH, PROVIDE_DOWNLOAD_ENDPOINTS
+from api.settings import (
+    ALLOWED_ORIGINS,
+    SENTRY_DSN,
+    API_ROOT_PATH,
+    PROVIDE_DOWNLOAD_ENDPOINTS,
+    WARMUP,
+    METRICS_DIR,
+)
+from api.health import router as health_router
+from api.metrics import MetricsMiddleware, router as metrics_router, save_metrics, save_metrics_periodically
 from api.internal import router as internal_router
 from api.public import router as public_router
 from api.dev.downloads import router as dev_downloads_router
@@ -33,8 +47,31 @@ async def lifespan(app: FastAPI):
     handler.setFormatter(logging.Formatter("[%(asctime)s] %(levelname)s:\t%(message)s"))
     logger.addHandler(handler)
 
+    # create Redis / arq connection pool shared by all requests
+    try:
+        await get_redis_pool(retry=True)
+    except Exception as ex:
+        log.error(f"Could not connect to Redis, will retry on first use: {ex}")
+
+    # load data in the background, so that the API can respond to health checks
+    # in the meantime; readiness is reported by /readyz
+    warmup_task = asyncio.create_task(asyncio.to_thread(warmup)) if WARMUP else None
+
+    # share metrics with other processes, if METRICS_DIR is set
+    metrics_task = asyncio.create_task(save_metrics_periodically("api")) if METRICS_DIR is not None else None
+
     yield
 
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+
+    if metrics_task is not None:
+        metrics_task.cancel()
+        save_metrics("api")
+
+    await close_redis_pool()
+    shutdown_executors()
+
 
 app = FastAPI(version="1.0", root_path=API_ROOT_PATH, docs_url=False, redoc_url=False, lifespan=lifespan)
 path_prefix = "/api/v1" if API_ROOT_PATH is None else ""
@@ -63,6 +100,11 @@ async def catch_exceptions_middleware(request: Request, call_next):
         return Response("Internal server error", status_code=500)
 
 
+# profile requests on demand (see PROFILE_TOKEN, PROFILE_SAMPLE_RATE); this
+# does nothing for requests that are not profiled
+app.add_middleware(ProfileMiddleware)
+
+
 app.add_middleware(SentryAsgiMiddleware)
 
 ### Enable CORS
@@ -75,8 +117,13 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+# record latency of all requests, including those handled by middleware above
+app.add_middleware(MetricsMiddleware)
+
 
 ### Add the routes to the main app
+app.include_router(health_router, include_in_schema=False)
+app.include_router(metrics_router, include_in_schema=False)
 app.include_router(internal_router, prefix=f"{path_prefix}/internal", include_in_schema=False)
 app.include_router(public_router, prefix=f"{path_prefix}/public")
 
@@ -8,6 +8,17 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+def get_available_cpus():
+    """Get the number of CPUs available to this process, which may be less
+    than the number of CPUs of the machine; os.sched_getaffinity is not
+    available on all platforms (e.g., macOS and Windows).
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+
+    return os.cpu_count() or 1
+
+
 with open(Path(__file__).resolve().parent.parent / "ui/package.json") as infile:
     info = json.loads(infile.read())
     data_version = info["version"]
@@ -20,6 +31,72 @@ SENTRY_DSN = os.getenv("SENTRY_DSN", None)
 API_ROOT_PATH = os.getenv("API_ROOT_PATH", None)
 MAX_DOWNLOAD_JOBS = int(os.getenv("MAX_JOBS", 1))
 
+# if set, barrier tables are loaded once at startup from uncompressed Arrow IPC
+# files that are memory-mapped (shared across workers via OS page cache) instead
+# of being read and decompressed from the feather files on every request
+RESIDENT_TABLES = bool(os.getenv("RESIDENT_TABLES"))
+
+# if set (default), datasets and indexes are loaded and the columns used by
+# most requests are read in the background when the API starts; the API is
+# not ready (see /readyz) until this is complete.  Otherwise, these are loaded
+# on first use.
+WARMUP = bool(int(os.getenv("WARMUP", 1)))
+
+# bounds of the in-process cache of serialized responses for query, rank, and
+# unit endpoints (per worker); set RESULT_CACHE_MAX_BYTES to 0 to disable
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", 1024))
+
+# if set, cached responses are also shared across workers via Redis
+RESULT_CACHE_REDIS = bool(os.getenv("RESULT_CACHE_REDIS"))
+
+# expire shared cached responses after 1 day
+RESULT_CACHE_EXPIRATION = 86400
+
+# number of threads per API worker used to run CPU-bound work (Arrow scans,
+# ranking, CSV / feather writing) outside the event loop; set to 0 to run
+# this work directly on the event loop
+EXECUTOR_THREADS = int(os.getenv("EXECUTOR_THREADS", 4))
+
+# number of processes per API worker used for Python-heavy steps (calculating
+# tiers); if 0, these are run in the thread pool instead
+EXECUTOR_PROCESSES = int(os.getenv("EXECUTOR_PROCESSES", 0))
+
+# maximum number of requests and total estimated number of records that can
+# be processed at a time per API worker; requests beyond these limits are
+# rejected with a 503 response.  A single request is always admitted if no
+# other requests are being processed, regardless of its size.
+EXECUTOR_MAX_REQUESTS = int(os.getenv("EXECUTOR_MAX_REQUESTS", 16))
+EXECUTOR_MAX_RECORDS = int(os.getenv("EXECUTOR_MAX_RECORDS", 5_000_000))
+
+# seconds a client should wait before retrying a rejected request
+EXECUTOR_RETRY_AFTER = 5
+
+# if set, each API and background worker process writes a snapshot of its
+# metrics to this directory every METRICS_INTERVAL seconds, so that /metrics
+# reports the totals of all processes; otherwise /metrics only reports the
+# metrics of the API worker that serves the request
+METRICS_DIR = Path(os.getenv("METRICS_DIR")) if os.getenv("METRICS_DIR") else None
+if METRICS_DIR is not None:
+    METRICS_DIR.mkdir(exist_ok=True, parents=True)
+
+METRICS_INTERVAL = 10
+
+# requests are profiled (stage timings and sampled stacks) if they include an
+# X-Profile header with PROFILE_TOKEN as its value, or for a random
+# PROFILE_SAMPLE_RATE fraction (0-1) of requests.  Traces of sampled requests
+# are only written to PROFILE_DIR if they took at least PROFILE_SLOW_SECONDS.
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", None)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_SLOW_SECONDS = float(os.getenv("PROFILE_SLOW_SECONDS", 1))
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "/tmp/sarp/profiles"))
+
+# seconds between samples of the stacks of profiled requests
+PROFILE_INTERVAL = 0.005
+
+# traces are rotated when they exceed this many bytes (default: 10 MB)
+PROFILE_MAX_BYTES = 10 * 1024 * 1024
+
 # if in local development, API will provide download endpoints for national and
 # custom download; otherwise these are handled via Caddy
 PROVIDE_DOWNLOAD_ENDPOINTS = bool(os.getenv("PROVIDE_DOWNLOAD_ENDPOINTS"))
@@ -37,5 +114,31 @@ CUSTOM_DOWNLOAD_DIR.mkdir(exist_ok=True, parents=True)
 # time jobs out after 5 minutes
 DOWNLOAD_JOB_TIMEOUT = 300
 
-# retain custom files for 5 minutes
+# custom download jobs are cancelled if their status has not been requested by
+# any client for this many seconds (the UI requests it every second); set to 0
+# to disable
+DOWNLOAD_JOB_POLL_TIMEOUT = int(os.getenv("DOWNLOAD_JOB_POLL_TIMEOUT", 60))
+
+# number of processes used by the background worker to create custom downloads,
+# one job per process at a time; set to "auto" to use all available cores.  If
+# 0 (default), jobs are created in the worker process, MAX_JOBS at a time.
+DOWNLOAD_WORKER_PROCESSES = os.getenv("DOWNLOAD_WORKER_PROCESSES", "0")
+DOWNLOAD_WORKER_PROCESSES = (
+    get_available_cpus() if DOWNLOAD_WORKER_PROCESSES == "auto" else int(DOWNLOAD_WORKER_PROCESSES)
+)
+
+# downloads of at most this many records are small jobs, which are run before
+# larger jobs; if the worker runs more than one job at a time, one of these is
+# reserved for small jobs (see api.worker.DownloadWorker)
+DOWNLOAD_FAST_LANE_RECORDS = int(os.getenv("DOWNLOAD_FAST_LANE_RECORDS", 100_000))
+
+# number of threads used to compress each download zip file; if 1, zip files
+# are compressed in the thread that writes them
+ZIP_THREADS = int(os.getenv("ZIP_THREADS") or get_available_cpus())
+
+# retain custom download archives for at least 5 minutes after they were last used
 FILE_RETENTION_TIME = 300
+
+# least recently used custom download archives are deleted when their total
+# size exceeds this many bytes (default: 5 GB)
+CUSTOM_DOWNLOAD_MAX_BYTES = int(os.getenv("CUSTOM_DOWNLOAD_MAX_BYTES", 5 * 1024 * 1024 * 1024))
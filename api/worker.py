@@ -1,15 +1,21 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
 import logging
-import shutil
-from time import time
+import multiprocessing
 
 import arq
-from arq import cron
+from arq.constants import abort_jobs_ss, in_progress_key_prefix
+from arq.worker import get_kwargs
 import sentry_sdk
 
 from api.internal.barriers.download import custom_download_task
+from api.lib.download import evict_archives
+from api.lib.jobs import get_job_defs, is_small_job
 from api.settings import (
     CUSTOM_DOWNLOAD_DIR,
+    CUSTOM_DOWNLOAD_MAX_BYTES,
     DOWNLOAD_JOB_TIMEOUT,
+    DOWNLOAD_WORKER_PROCESSES,
     FILE_RETENTION_TIME,
     SENTRY_DSN,
     LOGGING_LEVEL,
@@ -22,6 +28,9 @@ from api.settings import (
 log = logging.getLogger(__name__)
 log.setLevel(LOGGING_LEVEL)
 
+# seconds between cleanups of custom download archives
+CLEANUP_INTERVAL = 300
+
 
 class ArqLogFilter(logging.Filter):
     def __init__(self, name: str = "ArqLogFilter") -> None:
@@ -41,6 +50,10 @@ if SENTRY_DSN:
 
 """Cleanup custom zip files in a background task.
 
+Archives are retained (and reused for identical requests) until their total
+size exceeds CUSTOM_DOWNLOAD_MAX_BYTES, then the least recently used ones are
+deleted.
+
 Parameters
 ----------
 ctx : arq ctx (unused)
@@ -49,14 +62,42 @@ ctx : arq ctx (unused)
 
 async def cleanup_files(ctx):
     # delete directories and their contents
-    for path in CUSTOM_DOWNLOAD_DIR.rglob("*"):
-        if path.stat().st_mtime < time() - FILE_RETENTION_TIME:
-            if path.is_dir():
-                shutil.rmtree(path)
+    for path in await asyncio.to_thread(
+        evict_archives, CUSTOM_DOWNLOAD_DIR, CUSTOM_DOWNLOAD_MAX_BYTES, FILE_RETENTION_TIME
+    ):
+        log.debug(f"deleted custom download {path.name}")
+
+
+async def run_cleanup(ctx):
+    """Cleanup custom zip files every CLEANUP_INTERVAL seconds, starting when
+    the worker starts.
+
+    This runs alongside the jobs of the worker rather than as a cron job in the
+    queue, because download jobs are scored up to an hour before they are
+    enqueued (see api.lib.jobs.get_job_score()), so a cron job would be
+    postponed behind all download jobs enqueued since then.
+    """
+    while True:
+        try:
+            await cleanup_files(ctx)
+
+        except Exception as ex:
+            log.error(f"Error cleaning up custom downloads: {ex}")
+
+        await asyncio.sleep(CLEANUP_INTERVAL)
 
 
 async def startup(ctx):
     ctx["redis"] = await arq.create_pool(REDIS)
+    ctx["cleanup"] = asyncio.create_task(run_cleanup(ctx))
+
+    if DOWNLOAD_WORKER_PROCESSES > 0:
+        # use spawn instead of fork, because the worker has other threads
+        mp_context = multiprocessing.get_context("spawn")
+        ctx["executor"] = ProcessPoolExecutor(DOWNLOAD_WORKER_PROCESSES, mp_context=mp_context)
+
+        # used to create events to cancel downloads in the process pool
+        ctx["manager"] = mp_context.Manager()
 
     logging.config.dictConfig(
         {
@@ -93,20 +134,113 @@ async def startup(ctx):
 
 
 async def shutdown(ctx):
+    ctx["cleanup"].cancel()
     await ctx["redis"].close()
 
+    if "executor" in ctx:
+        ctx["executor"].shutdown(wait=False, cancel_futures=True)
+        ctx["manager"].shutdown()
+
+
+class DownloadWorker(arq.Worker):
+    """arq worker that reserves one of its job slots for small jobs (see
+    api.lib.jobs.is_small_job()) and limits each client with queued or running
+    jobs to an equal share of the job slots while jobs of other clients are
+    waiting.
+
+    Jobs are otherwise started in order of their score in the queue (see
+    api.lib.jobs.get_job_score()); jobs that are held back remain at the same
+    position in the queue.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # (client, is small job) of each running job, by job id
+        self.running = {}
+
+    async def start_jobs(self, job_ids):
+        self.running = {
+            job_id: job
+            for job_id, job in self.running.items()
+            if job_id in self.tasks and not self.tasks[job_id].done()
+        }
+
+        # jobs remain in the queue while they are in progress in this or other workers
+        job_ids = [job_id.decode() for job_id in job_ids]
+        async with self.pool.pipeline(transaction=False) as pipe:
+            for job_id in job_ids:
+                pipe.exists(f"{in_progress_key_prefix}{job_id}")
+                pipe.zscore(abort_jobs_ss, job_id)
+
+            values = await pipe.execute()
+
+        in_progress = values[::2]
+        cancelled = {job_id for job_id, score in zip(job_ids, values[1::2]) if score is not None}
+        job_ids = [job_id for job_id, value in zip(job_ids, in_progress) if not value]
+
+        jobs = []
+        for job_id, job_def in zip(job_ids, await get_job_defs(self.pool, job_ids)):
+            # jobs that no longer exist or were cancelled before they started
+            # are left to arq, which finishes them immediately
+            if job_def is None or job_id in cancelled:
+                jobs.append(None)
+            else:
+                jobs.append((job_def.kwargs.get("client"), is_small_job(job_def.kwargs.get("record_count"))))
+
+        running = list(self.running.values())
+        clients = {job[0] for job in running + jobs if job is not None}
+        share = max(self.max_jobs // max(len(clients), 1), 1)
+        max_large_jobs = max(self.max_jobs - 1, 1)
+
+        # jobs are first selected up to the share of each client, then any
+        # remaining slots are filled in order so that they are not left idle
+        selected = []
+        for limit_share in (True, False):
+            for job_id, job in zip(job_ids, jobs):
+                if len(running) >= self.max_jobs:
+                    break
+
+                if job_id in selected:
+                    continue
+
+                if job is not None:
+                    client, small = job
+                    if not small and sum(1 for _, s in running if not s) >= max_large_jobs:
+                        continue
+
+                    if limit_share and sum(1 for c, _ in running if c == client) >= share:
+                        continue
+
+                    running.append(job)
+
+                selected.append(job_id)
+
+        await super().start_jobs([job_id.encode() for job_id in selected])
+
+        for job_id, job in zip(job_ids, jobs):
+            if job is not None and job_id in self.tasks:
+                self.running[job_id] = job
+
 
 class WorkerSettings:
     redis_settings = REDIS
     job_timeout = DOWNLOAD_JOB_TIMEOUT
-    max_jobs = MAX_DOWNLOAD_JOBS
+    # each job runs in its own process, if the worker has a process pool
+    max_jobs = DOWNLOAD_WORKER_PROCESSES if DOWNLOAD_WORKER_PROCESSES > 0 else MAX_DOWNLOAD_JOBS
     queue_name = REDIS_QUEUE
-    # run cleanup every 5 minutes
-    cron_jobs = [
-        cron(cleanup_files, run_at_startup=True, minute={0, 5, 10, 15, 20, 25, 30, 35, 40, 45, 50, 55}, second=0)
-    ]
+    # allow jobs to be cancelled (see api.lib.jobs.cancel_job())
+    allow_abort_jobs = True
+    # NOTE: cleanup runs every CLEANUP_INTERVAL seconds outside the queue (see run_cleanup())
 
     functions = [custom_download_task]
 
     on_startup = startup
     on_shutdown = shutdown
+
+
+if __name__ == "__main__":
+    # run using DownloadWorker to reserve capacity for small jobs and limit each
+    # client to its share; `arq api.worker.WorkerSettings` runs jobs in the
+    # order they are scored without these limits
+    DownloadWorker(**get_kwargs(WorkerSettings)).run()
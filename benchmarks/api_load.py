@@ -0,0 +1,219 @@
+"""Measure throughput and latency of the main API routes (query, rank,
+download, search, and details) at several scales of synthetic data.
+
+For each scale, a synthetic dataset is created using generate_data.py (unless
+it already exists in the output directory).  Each scale then runs in a
+separate process that imports the API from the directory of the dataset and
+runs each scenario in turn for a fixed duration: several concurrent clients
+issue requests through the ASGI app for randomly selected summary units,
+search terms, or barriers.  The result cache is disabled so that every
+request is processed.
+
+Downloads are limited to summary units with few enough records to be created
+immediately; larger downloads are created by the background worker and
+require Redis, so they are not included.
+
+Requests rejected by admission control (503) are counted separately and
+excluded from the latencies; any other errors stop the benchmark.
+
+Run from the root of the repository:
+python benchmarks/api_load.py --scales 0.01 0.1 --duration 10 --clients 4 --out /tmp/sarp-synthetic
+"""
+
+import argparse
+import asyncio
+import multiprocessing as mp
+import os
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+
+from generate_data import NATIONAL_COUNTS, generate
+
+
+PREFIX = "/api/v1/internal"
+
+# (name, method, path, unit layer, count field of unit used to select units)
+UNIT_SCENARIOS = [
+    ("dams query (State)", "get", "/dams/query", "State", "dams"),
+    ("combined_barriers query (HUC8)", "get", "/combined_barriers/query", "HUC8", "small_barriers"),
+    ("road_crossings query (State)", "get", "/road_crossings/query", "State", "total_road_crossings"),
+    ("dams rank (State)", "get", "/dams/rank", "State", "ranked_dams"),
+    ("combined_barriers rank (HUC6)", "get", "/combined_barriers/rank", "HUC6", "ranked_small_barriers"),
+    ("dams download (HUC8)", "post", "/dams/csv", "HUC8", "ranked_dams"),
+    ("road_crossings download (County)", "post", "/road_crossings/csv", "County", "total_road_crossings"),
+]
+
+SEARCH_WORDS = ["mill", "big", "cedar", "spring", "bear", "rock", "lake", "pine", "dal", "ash", "ros", "zan"]
+
+
+def get_data_dir(out_dir, scale):
+    return Path(out_dir) / str(scale)
+
+
+def get_scenarios(rng):
+    """Create functions that return the method, path, and params of a random
+    request for each scenario.
+
+    Returns
+    -------
+    dict
+        {<name>: <function>, ...}
+    """
+    from api.data import dams, road_crossings, units
+    from api.settings import MAX_IMMEDIATE_DOWNLOAD_RECORDS
+
+    unit_table = units.to_table()
+
+    scenarios = {}
+    for name, method, path, layer, count_field in UNIT_SCENARIOS:
+        counts = unit_table[count_field].to_numpy()
+        mask = (unit_table["layer"].to_numpy(zero_copy_only=False) == layer) & (counts > 0)
+        if method == "post":
+            # only downloads that are created immediately
+            mask &= counts <= MAX_IMMEDIATE_DOWNLOAD_RECORDS
+
+        ids = unit_table["id"].to_numpy(zero_copy_only=False)[mask]
+        if not len(ids):
+            print(f"WARNING: no {layer} units with {count_field}; skipping {name}")
+            continue
+
+        params = {"stream": True} if method == "post" else {}
+
+        def make_request(ids=ids, method=method, path=path, layer=layer, params=params):
+            return method, f"{PREFIX}{path}", {layer: rng.choice(ids), **params}
+
+        scenarios[name] = make_request
+
+    scenarios["barrier search"] = lambda: ("get", f"{PREFIX}/barriers/search", {"query": rng.choice(SEARCH_WORDS)})
+    scenarios["unit search"] = lambda: (
+        "get",
+        f"{PREFIX}/units/search",
+        {"layer": "State,County,HUC8,HUC10,HUC12", "query": rng.choice(SEARCH_WORDS)},
+    )
+
+    for name, network_type, dataset in [
+        ("dams details", "dams", dams),
+        ("road_crossings details", "combined_barriers", road_crossings),
+    ]:
+        sarp_ids = dataset.to_table(columns=["SARPID"])["SARPID"].to_numpy(zero_copy_only=False)
+
+        def make_request(sarp_ids=sarp_ids, network_type=network_type):
+            return "get", f"{PREFIX}/{network_type}/details/{rng.choice(sarp_ids)}", {}
+
+        scenarios[name] = make_request
+
+    return scenarios
+
+
+def run_scale(scale, args, results):
+    # must be set before importing the API
+    os.environ["RESULT_CACHE_MAX_BYTES"] = "0"
+    os.environ["RESIDENT_TABLES"] = "1" if args.resident else ""
+    os.environ["LOGGING_LEVEL"] = "WARNING"
+
+    # the API reads data relative to the working directory
+    os.chdir(get_data_dir(args.out, scale))
+
+    from httpx import ASGITransport, AsyncClient
+
+    from api.data import barrier_datasets, warmup
+    from api.server import app
+
+    start = perf_counter()
+    warmup()
+    warmup_time = perf_counter() - start
+
+    rng = np.random.default_rng(args.seed)
+    scenarios = get_scenarios(rng)
+
+    async def run_client(client, make_request, end, latencies, rejected):
+        while perf_counter() < end:
+            method, path, params = make_request()
+
+            start = perf_counter()
+            response = await getattr(client, method)(path, params=params)
+            elapsed = perf_counter() - start
+
+            if response.status_code == 503:
+                rejected.append(elapsed)
+                await asyncio.sleep(0.1)
+                continue
+
+            assert response.status_code == 200, f"{method.upper()} {path} {params} failed: {response.status_code}"
+            latencies.append(elapsed * 1000)
+
+    async def run():
+        out = {}
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://localhost", timeout=None) as client:
+            for name, make_request in scenarios.items():
+                # warmup
+                method, path, params = make_request()
+                await getattr(client, method)(path, params=params)
+
+                latencies = []
+                rejected = []
+                start = perf_counter()
+                end = start + args.duration
+                await asyncio.gather(
+                    *[run_client(client, make_request, end, latencies, rejected) for _ in range(args.clients)]
+                )
+                out[name] = {"latencies": latencies, "rejected": len(rejected), "elapsed": perf_counter() - start}
+
+        return out
+
+    results.put(
+        {
+            "scale": scale,
+            "warmup": warmup_time,
+            "rows": {t: barrier_datasets[t].count_rows() for t in ["dams", "small_barriers", "road_crossings"]},
+            "scenarios": asyncio.run(run()),
+        }
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure API throughput and latency at several scales of data")
+    parser.add_argument(
+        "--scales", type=float, nargs="+", default=[0.01, 0.1], help="fractions of national number of barriers"
+    )
+    parser.add_argument("--duration", type=int, default=10, help="number of seconds to run each scenario")
+    parser.add_argument("--clients", type=int, default=4, help="number of concurrent clients")
+    parser.add_argument("--seed", type=int, default=0, help="seed of synthetic data and random requests")
+    parser.add_argument("--resident", action="store_true", help="use memory-mapped resident tables")
+    parser.add_argument(
+        "--out", type=Path, default=Path("/tmp/sarp-synthetic"), help="directory of synthetic datasets by scale"
+    )
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+
+    for scale in args.scales:
+        data_dir = get_data_dir(args.out, scale)
+        if not (data_dir / "data/api/map_units.feather").exists():
+            print(f"Creating synthetic dataset at scale {scale} in {data_dir}")
+            generate(data_dir, scale=scale, seed=args.seed)
+
+        results = ctx.Queue()
+        process = ctx.Process(target=run_scale, args=(scale, args, results))
+        process.start()
+        result = results.get()
+        process.join()
+
+        rows = ", ".join(f"{t}: {count:,}" for t, count in result["rows"].items())
+        print(
+            f"\n### scale {scale} ({rows}; national: {NATIONAL_COUNTS['dams']:,} dams); warmup {result['warmup']:.1f}s"
+        )
+        print(
+            f"{'scenario':<36} {'requests':>8} {'req/s':>8} {'rejected':>8} "
+            f"{'p50 (ms)':>10} {'p95 (ms)':>10} {'p99 (ms)':>10}"
+        )
+        for name, values in result["scenarios"].items():
+            latencies = values["latencies"]
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies else (np.nan,) * 3
+            throughput = len(latencies) / values["elapsed"]
+            print(
+                f"{name:<36} {len(latencies):>8} {throughput:>8.1f} {values['rejected']:>8} "
+                f"{p50:>10.1f} {p95:>10.1f} {p99:>10.1f}"
+            )
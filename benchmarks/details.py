@@ -0,0 +1,110 @@
+"""Compare latency of barrier details requests when records are read from the
+DuckDB database (default) versus the SARPID index of resident tables
+(RESIDENT_TABLES=1), under many concurrent requests.
+
+Each mode runs in a separate process that imports the API and runs concurrent
+clients through the ASGI app for a fixed duration; each client requests the
+details of randomly selected dams, road crossings, and waterfalls.  The time
+to get each record (excluding the HTTP layer) is also measured directly.
+
+Requests rejected by admission control (503) are counted separately and
+excluded from the latencies.
+
+Run from the root of the repository:
+python benchmarks/details.py --duration 10 --clients 200
+"""
+
+import argparse
+import asyncio
+import multiprocessing as mp
+import os
+from time import perf_counter
+
+import numpy as np
+
+
+MODES = {"duckdb": "", "index": "1"}
+
+
+def run_mode(mode, args, results):
+    # must be set before importing the API
+    os.environ["RESIDENT_TABLES"] = MODES[mode]
+
+    from httpx import ASGITransport, AsyncClient
+    import pyarrow.compute as pc
+
+    from api.data import dams, road_crossings, waterfalls
+    from api.internal.barriers.details import get_record
+    from api.server import app
+
+    rng = np.random.default_rng(0)
+    sarp_ids = []
+    for dataset, filter in [
+        (dams, None),
+        (road_crossings, None),
+        (waterfalls, pc.field("network_type") == "dams"),
+    ]:
+        values = dataset.to_table(columns=["SARPID"], filter=filter)["SARPID"].to_numpy(zero_copy_only=False)
+        sarp_ids.extend(rng.choice(values, size=min(len(values), 1000), replace=False).tolist())
+    rng.shuffle(sarp_ids)
+
+    lookups = []
+    for sarp_id in sarp_ids:
+        start = perf_counter()
+        get_record("dams", sarp_id)
+        lookups.append((perf_counter() - start) * 1000)
+
+    async def run_client(client, offset, end, latencies, rejected):
+        i = offset
+        while perf_counter() < end:
+            sarp_id = sarp_ids[i % len(sarp_ids)]
+            i += 1
+
+            start = perf_counter()
+            response = await client.get(f"/api/v1/internal/dams/details/{sarp_id}")
+            elapsed = perf_counter() - start
+
+            if response.status_code == 503:
+                rejected.append(sarp_id)
+                await asyncio.sleep(0.1)
+                continue
+
+            assert response.status_code == 200, f"{sarp_id} failed: {response.status_code}"
+            latencies.append(elapsed * 1000)
+
+    async def run():
+        latencies = []
+        rejected = []
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://localhost", timeout=None) as client:
+            end = perf_counter() + args.duration
+            await asyncio.gather(*[run_client(client, i, end, latencies, rejected) for i in range(args.clients)])
+
+        return latencies, rejected
+
+    latencies, rejected = asyncio.run(run())
+    results.put({"mode": mode, "lookups": lookups, "latencies": latencies, "rejected": len(rejected)})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare latency of barrier details with DuckDB and SARPID index")
+    parser.add_argument("--duration", type=int, default=10, help="number of seconds to run each mode")
+    parser.add_argument("--clients", type=int, default=200, help="number of concurrent clients")
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+
+    print(
+        f"{'mode':<10} {'lookup p50 (ms)':>16} {'lookup p99 (ms)':>16} {'requests':>10} {'rejected':>10} {'p50 (ms)':>10} {'p99 (ms)':>10}"
+    )
+    for mode in MODES:
+        results = ctx.Queue()
+        process = ctx.Process(target=run_mode, args=(mode, args, results))
+        process.start()
+        result = results.get()
+        process.join()
+
+        lookup_p50, lookup_p99 = np.percentile(result["lookups"], [50, 99])
+        p50, p99 = np.percentile(result["latencies"], [50, 99])
+        print(
+            f"{mode:<10} {lookup_p50:>16.3f} {lookup_p99:>16.3f} {len(result['latencies']):>10} {result['rejected']:>10} {p50:>10.1f} {p99:>10.1f}"
+        )
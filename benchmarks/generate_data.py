@@ -0,0 +1,1047 @@
+"""Generate a deterministic synthetic dataset for the API, at a fraction of
+national scale, so that the API can be tested and benchmarked without the
+real data.
+
+The barrier tables follow the schema of those created in
+analysis/post/aggregate_networks.py: fields of api/constants.py, their data
+types, values of coded domains, fill values of barriers without networks,
+one record per network type for waterfalls, and sort order.  Map units follow
+the schema of data/api/map_units.feather created in create_summary_tiles.py,
+with counts of the generated barriers in each unit.  The derived files used
+by the API (api.db, memory-mapped tables, indexes, and public CSV shards) are
+created from these using the same functions as aggregate_networks.py.
+
+Summary units are cells of simplified national grids: each state is a cell of
+a grid over the continental US that is split into counties and congressional
+districts, and each HUC2 is a cell of a separate grid that is split into
+nested HUC6, HUC8, HUC10, and HUC12 cells.  Barriers are clustered around
+random locations, so that the number of barriers varies widely between units.
+
+Values of each field are drawn from a random generator seeded by the seed and
+the names of the table and field, so the output is identical for the same
+scale and seed.
+
+The number of barriers at scale 1 approximates the national inventory (see
+NATIONAL_COUNTS); the full national scale requires several GB of memory.
+
+Files are written to <out>/data/api; run the API from <out> to use them.  The
+ui directory of the repository is linked into <out>, because the API also
+reads files from it relative to the working directory (e.g., the logo added to
+downloads).
+
+Run from the root of the repository:
+python benchmarks/generate_data.py --scale 0.1 --out /tmp/sarp-synthetic/0.1
+"""
+
+import argparse
+from pathlib import Path
+import sys
+from time import perf_counter
+import zlib
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow.feather import write_feather
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# allow running as a script from the root of the repository
+sys.path.insert(0, str(REPO_DIR))
+
+from analysis.constants import SEVERITY_TO_PASSABILITY
+from analysis.post.lib.api_data import create_api_db, create_resident_tables, create_indexes, create_public_shards
+from api.constants import (
+    BARRIER_SEARCH_RESULT_FIELDS,
+    COMBINED_API_FIELDS,
+    DAM_API_FIELDS,
+    DOMAINS,
+    FISH_HABITAT_PARTNERSHIPS,
+    GENERAL_API_FIELDS1,
+    METRIC_FIELDS,
+    ROAD_CROSSING_API_FIELDS,
+    SB_API_FIELDS,
+    SPECIES_HABITAT_FIELDS,
+    STATES,
+    SUMMARY_UNIT_FIELDS,
+    UNIT_FIELDS,
+    WF_API_FIELDS,
+)
+
+
+# approximate number of records in the national inventory at scale 1
+NATIONAL_COUNTS = {
+    "dams": 620_000,
+    "small_barriers": 85_000,
+    "road_crossings": 1_900_000,
+    "waterfalls": 14_000,
+}
+
+NETWORK_TYPES = ["dams", "combined_barriers", "largefish_barriers", "smallfish_barriers"]
+
+# bounds of grids of summary units (xmin, ymin, xmax, ymax)
+BOUNDS = (-124.0, 25.0, -67.0, 49.0)
+
+# (columns, rows) of grid of states, and of cells within each state
+STATE_GRID = (8, 7)
+COUNTY_GRID = (8, 8)
+DISTRICT_GRID = (3, 3)
+
+# (columns, rows) of grid of HUC2s, and of cells within each cell of the
+# previous HUC level
+HUC_GRIDS = {"HUC2": (7, 3), "HUC6": (4, 4), "HUC8": (3, 3), "HUC10": (2, 3), "HUC12": (2, 3)}
+
+# number of characters added to the id of the parent unit at each HUC level
+HUC_ID_DIGITS = {"HUC2": 2, "HUC6": 4, "HUC8": 2, "HUC10": 2, "HUC12": 2}
+
+NUM_CLUSTERS = 3000
+CLUSTER_SIZE = 0.3  # degrees
+
+BOOL_FIELDS = {
+    "HasNetwork",
+    "Ranked",
+    "Removed",
+    "Excluded",
+    "Invasive",
+    "OnLoop",
+    "Snapped",
+    "Estimated",
+    "ProtectedLand",
+    "EJTract",
+    "EJTribal",
+    "Unranked",
+    "OnNetwork",
+    "in_network_type",
+    "duplicate",
+}
+
+# bool fields that are stored as uint8 because they are used for filtering
+UINT8_BOOL_FIELDS = {"CoastalHUC8", "Wilderness"}
+
+# probability that bool fields are True
+BOOL_PROBABILITY = {
+    "Snapped": 0.85,
+    "Removed": 0.03,
+    "Excluded": 0.02,
+    "OnLoop": 0.02,
+    "Invasive": 0.01,
+    "Unranked": 0.02,
+    "Estimated": 0.3,
+    "ProtectedLand": 0.15,
+    "EJTract": 0.2,
+    "EJTribal": 0.05,
+    "OnNetwork": 0.9,
+    "CoastalHUC8": 0.1,
+    "Wilderness": 0.03,
+}
+
+SMALL_INT_FIELDS = {
+    # field: (dtype, min, max)
+    "StreamOrder": ("int8", 1, 9),
+    "Landcover": ("int8", 0, 100),
+    "SizeClasses": ("int8", 0, 7),
+    "PerennialSizeClasses": ("int8", 0, 7),
+    "MainstemSizeClasses": ("int8", 0, 7),
+    "SalmonidESUCount": ("uint8", 0, 3),
+    "Fatality": ("uint8", 0, 2),
+    "TESpp": ("uint8", 0, 10),
+    "StateSGCNSpp": ("uint8", 0, 30),
+    "RegionalSGCNSpp": ("uint8", 0, 10),
+}
+
+ID64_FIELDS = {"NHDPlusID", "upNetID", "downNetID"}
+
+# fields that only have values for barriers with networks, in addition to
+# METRIC_FIELDS and SPECIES_HABITAT_FIELDS
+NETWORK_FIELDS = {
+    "upNetID",
+    "downNetID",
+    "in_network_type",
+    "InvasiveNetwork",
+    "MilesToOutlet",
+    "GainMilesClass",
+    "MainstemGainMilesClass",
+    "PercentAlteredClass",
+    "PercentResilientClass",
+    "PercentColdClass",
+}
+
+STRING_VALUES = {
+    "Source": ["National Inventory of Dams", "State inventory", "USFS", "SARP field survey", "Partner inventory"],
+    "FedRegulatoryAgency": ["", "", "", "FERC", "USACE", "NRCS", "BOR"],
+    "PotentialProject": ["", "", "Severe Barrier", "Moderate Barrier", "Minor Barrier", "No Barrier", "Unknown"],
+    "ProtocolUsed": ["", "", "SARP", "NAACC", "USFS"],
+    "FallType": ["", "Cascade", "Falls", "Rapids", "Dam"],
+    "NativeTerritories": ["", "", "", "Cherokee", "Muscogee (Creek)", "Lakota, Dakota", "Ute"],
+}
+
+# words used to create names of barriers, streams, and summary units
+SYLLABLES = ["ash", "bur", "car", "dal", "el", "fal", "gar", "hol", "ing", "jen", "kal", "lin", "mor", "nor"]
+SYLLABLES += ["ost", "pel", "quin", "ros", "sal", "tam", "ur", "val", "wes", "yor", "zan", "ber", "ton", "ville"]
+COMMON_WORDS = ["Mill", "Big", "Little", "Upper", "Lower", "North", "South", "East", "West", "Bear", "Beaver"]
+COMMON_WORDS += ["Cedar", "Pine", "Rock", "Spring", "Sandy", "Clear", "Muddy", "Turkey", "Deer", "Lake", "Old"]
+STREAM_SUFFIXES = ["Creek", "Creek", "Creek", "River", "Run", "Branch", "Fork", "Brook", "Bayou"]
+DAM_SUFFIXES = ["Dam", "Dam", "Lake Dam", "Pond Dam", "Reservoir Dam", "Mill Dam"]
+ROAD_SUFFIXES = ["Road", "Rd", "Highway", "Lane", "Drive", "Forest Road"]
+
+
+def _get_rng(seed, *names):
+    """Get random generator for seed and names of table and field, so that the
+    values of each field do not depend on the order fields are created."""
+    return np.random.default_rng([seed, zlib.crc32("/".join(names).encode("utf-8"))])
+
+
+def _choice(rng, values, n, weights=None):
+    """Randomly select n values, using zipf-like weights if weights is None
+    (first value is most common)."""
+    if weights is None:
+        weights = 1 / np.arange(1, len(values) + 1)
+
+    weights = np.asarray(weights, dtype="float64")
+    return pa.array(values).take(pa.array(rng.choice(len(values), size=n, p=weights / weights.sum())))
+
+
+def _join_words(*columns, separator=" "):
+    return pc.utf8_trim_whitespace(pc.binary_join_element_wise(*columns, separator))
+
+
+class Vocabulary:
+    """Words used to create names; rarer words are made of random syllables."""
+
+    def __init__(self, seed, size=20_000):
+        rng = _get_rng(seed, "vocabulary")
+        words = [
+            "".join(rng.choice(SYLLABLES, size=rng.integers(1, 4))).capitalize()
+            for _ in range(size - len(COMMON_WORDS))
+        ]
+        self.words = COMMON_WORDS + words
+
+    def words_array(self, rng, n):
+        return _choice(rng, self.words, n, weights=1 / np.arange(1, len(self.words) + 1) ** 0.9)
+
+    def names(self, rng, n, suffixes=(), blank=0):
+        """Create names of one or two words and an optional suffix; a fraction
+        (blank) of the names are empty strings."""
+        first = self.words_array(rng, n)
+        second = pc.if_else(pa.array(rng.random(n) < 0.4), self.words_array(rng, n), "")
+        parts = [first, second]
+        if suffixes:
+            parts.append(_choice(rng, list(suffixes), n, weights=np.ones(len(suffixes))))
+
+        names = _join_words(*parts)
+        # joining empty parts leaves double spaces
+        names = pc.replace_substring(names, "  ", " ")
+        if blank:
+            names = pc.if_else(pa.array(rng.random(n) < blank), "", names)
+
+        return names
+
+
+class Grid:
+    """Grid of units nested within the cells of a parent grid.
+
+    Parameters
+    ----------
+    columns : int
+        total number of columns within bounds
+    rows : int
+        total number of rows within bounds
+    """
+
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = rows
+        xmin, ymin, xmax, ymax = BOUNDS
+        self.width = (xmax - xmin) / columns
+        self.height = (ymax - ymin) / rows
+
+    def __len__(self):
+        return self.columns * self.rows
+
+    def cells(self, lon, lat):
+        """Get index of cell that contains each point.
+
+        Returns
+        -------
+        ndarray of int
+        """
+        xmin, ymin, _, _ = BOUNDS
+        col = np.clip(((lon - xmin) / self.width).astype("int64"), 0, self.columns - 1)
+        row = np.clip(((lat - ymin) / self.height).astype("int64"), 0, self.rows - 1)
+        return row * self.columns + col
+
+    def bounds(self):
+        """Get bounds of each cell.
+
+        Returns
+        -------
+        (xmin, ymin, xmax, ymax) tuple of ndarrays
+        """
+        xmin, ymin, _, _ = BOUNDS
+        cells = np.arange(len(self))
+        left = xmin + (cells % self.columns) * self.width
+        bottom = ymin + (cells // self.columns) * self.height
+        return left, bottom, left + self.width, bottom + self.height
+
+    def parents(self, parent):
+        """Get index of cell in parent grid that contains each cell, and the
+        position of each cell within its parent.
+
+        Returns
+        -------
+        (ndarray of int, ndarray of int)
+        """
+        per_column = self.columns // parent.columns
+        per_row = self.rows // parent.rows
+        cells = np.arange(len(self))
+        col = cells % self.columns
+        row = cells // self.columns
+        parent_cells = (row // per_row) * parent.columns + col // per_column
+        positions = (row % per_row) * per_column + col % per_column
+        return parent_cells, positions
+
+
+class Geography:
+    """Summary units of a simplified national grid.
+
+    Parameters
+    ----------
+    seed : int
+    vocabulary : Vocabulary
+    """
+
+    def __init__(self, seed, vocabulary):
+        self.states = np.array(sorted(STATES.keys()))
+        if len(self.states) > STATE_GRID[0] * STATE_GRID[1]:
+            raise ValueError("STATE_GRID is too small for the number of states")
+
+        self.grids = {"State": Grid(*STATE_GRID)}
+        self.grids["County"] = Grid(STATE_GRID[0] * COUNTY_GRID[0], STATE_GRID[1] * COUNTY_GRID[1])
+        self.grids["CongressionalDistrict"] = Grid(STATE_GRID[0] * DISTRICT_GRID[0], STATE_GRID[1] * DISTRICT_GRID[1])
+
+        columns, rows = 1, 1
+        for layer, (c, r) in HUC_GRIDS.items():
+            columns *= c
+            rows *= r
+            self.grids[layer] = Grid(columns, rows)
+
+        # unit ids, names, and states by layer, indexed by cell of grid
+        self.ids = {}
+        self.names = {}
+        self.unit_states = {}
+
+        state_cells = np.arange(len(self.grids["State"]))
+        # cells outside the states are assigned to the last state
+        state_ids = self.states[np.minimum(state_cells, len(self.states) - 1)]
+        self.ids["State"] = pa.array(state_ids)
+        self.names["State"] = pa.array([STATES[s] for s in state_ids])
+        self.unit_states["State"] = pa.array(np.repeat("", len(state_ids)))
+
+        for layer, suffix in [("County", " County"), ("CongressionalDistrict", None)]:
+            grid = self.grids[layer]
+            parents, positions = grid.parents(self.grids["State"])
+            states = state_ids[parents]
+            if layer == "County":
+                # FIPS codes are 2 digit state code and 3 digit (odd) county code
+                ids = [
+                    f"{p + 1:02d}{2 * i + 1:03d}" for p, i in zip(np.minimum(parents, len(self.states) - 1), positions)
+                ]
+                names = pc.binary_join_element_wise(
+                    vocabulary.names(_get_rng(seed, "units", layer), len(grid)), suffix, ""
+                )
+            else:
+                ids = [f"{s}{i + 1:02d}" for s, i in zip(states, positions)]
+                names = pa.array([f"{STATES[s]} Congressional District {i + 1}" for s, i in zip(states, positions)])
+
+            self.ids[layer] = pa.array(ids)
+            self.names[layer] = names
+            self.unit_states[layer] = pa.array(states)
+
+        parent = None
+        for layer in HUC_GRIDS:
+            grid = self.grids[layer]
+            digits = HUC_ID_DIGITS[layer]
+            if parent is None:
+                ids = [f"{i + 1:0{digits}d}" for i in range(len(grid))]
+            else:
+                parents, positions = grid.parents(self.grids[parent])
+                parent_ids = self.ids[parent].to_pylist()
+                ids = [f"{parent_ids[p]}{i + 1:0{digits}d}" for p, i in zip(parents, positions)]
+
+            self.ids[layer] = pa.array(ids)
+            self.names[layer] = vocabulary.names(_get_rng(seed, "units", layer), len(grid), suffixes=STREAM_SUFFIXES)
+            self.unit_states[layer] = pa.array(self._get_overlapping_states(grid))
+            parent = layer
+
+    def _get_overlapping_states(self, grid):
+        """Get comma-delimited ids of states that overlap each cell of grid."""
+        state_grid = self.grids["State"]
+        xmin, ymin, xmax, ymax = grid.bounds()
+        eps = 1e-9
+        col0 = ((xmin - BOUNDS[0]) / state_grid.width + eps).astype("int64")
+        col1 = ((xmax - BOUNDS[0]) / state_grid.width - eps).astype("int64")
+        row0 = ((ymin - BOUNDS[1]) / state_grid.height + eps).astype("int64")
+        row1 = ((ymax - BOUNDS[1]) / state_grid.height - eps).astype("int64")
+
+        out = []
+        for c0, c1, r0, r1 in zip(col0, col1, row0, row1):
+            cells = [r * state_grid.columns + c for r in range(r0, r1 + 1) for c in range(c0, c1 + 1)]
+            out.append(",".join(sorted({self.states[min(cell, len(self.states) - 1)] for cell in cells})))
+
+        return out
+
+    def locate(self, lon, lat):
+        """Get the summary units of each point.
+
+        Returns
+        -------
+        dict
+            {<field>: pyarrow.Array, ...} for UNIT_FIELDS, COUNTYFIPS, and
+            Basin, Subbasin, and Subwatershed (names of HUC6, HUC8, HUC12)
+        """
+        cells = {layer: pa.array(grid.cells(lon, lat)) for layer, grid in self.grids.items()}
+        out = {layer: self.ids[layer].take(cells[layer]) for layer in self.grids}
+        out["COUNTYFIPS"] = out["County"]
+        out["County"] = self.names["County"].take(cells["County"])
+        for field, layer in [("Basin", "HUC6"), ("Subbasin", "HUC8"), ("Subwatershed", "HUC12")]:
+            out[field] = self.names[layer].take(cells[layer])
+
+        return out
+
+    def units(self):
+        """Get a table of all summary units, in the format of map_units.
+
+        Returns
+        -------
+        pyarrow.Table
+            contains layer, priority, id, state, name, key, bbox
+        """
+        priorities = {"State": 1, "County": 2, "CongressionalDistrict": 5}
+        priorities.update({layer: i + 2 for i, layer in enumerate(HUC_GRIDS)})
+
+        tables = []
+        for layer, grid in self.grids.items():
+            n = len(grid)
+            names = self.names[layer]
+            if layer == "State":
+                keys = names
+            elif layer == "County":
+                keys = _join_words(names, pa.array([STATES[s] for s in self.unit_states[layer].to_pylist()]))
+            else:
+                keys = _join_words(names, self.ids[layer])
+
+            xmin, ymin, xmax, ymax = (np.round(values, 3) for values in grid.bounds())
+            tables.append(
+                pa.table(
+                    {
+                        "layer": pa.array(np.repeat(layer, n)),
+                        "priority": pa.array(np.repeat(priorities[layer], n).astype("uint8")),
+                        "id": self.ids[layer],
+                        "state": self.unit_states[layer],
+                        "name": names,
+                        "key": keys,
+                        "bbox": pa.array([f"{a},{b},{c},{d}" for a, b, c, d in zip(xmin, ymin, xmax, ymax)]),
+                    }
+                )
+            )
+
+        units = pa.concat_tables(tables)
+
+        # states are only present once, even if there are extra cells
+        mask = np.ones(len(units), dtype="bool")
+        mask[len(self.states) : len(self.grids["State"])] = False
+        return units.filter(pa.array(mask))
+
+
+def get_locations(seed, n, name):
+    """Create locations of n barriers clustered around random points.
+
+    Returns
+    -------
+    (lon, lat) tuple of float32 ndarrays
+    """
+    xmin, ymin, xmax, ymax = BOUNDS
+
+    # clusters are shared by all barrier types
+    rng = _get_rng(seed, "clusters")
+    centers_x = rng.uniform(xmin, xmax, NUM_CLUSTERS)
+    centers_y = rng.uniform(ymin, ymax, NUM_CLUSTERS)
+    weights = rng.lognormal(0, 1.5, NUM_CLUSTERS)
+
+    rng = _get_rng(seed, name, "location")
+    clusters = rng.choice(NUM_CLUSTERS, size=n, p=weights / weights.sum())
+    lon = np.clip(centers_x[clusters] + rng.normal(0, CLUSTER_SIZE, n), xmin, xmax - 1e-4)
+    lat = np.clip(centers_y[clusters] + rng.normal(0, CLUSTER_SIZE, n), ymin, ymax - 1e-4)
+    return lon.astype("float32"), lat.astype("float32")
+
+
+def is_network_field(field):
+    return (
+        field in METRIC_FIELDS
+        or field in SPECIES_HABITAT_FIELDS
+        or field in NETWORK_FIELDS
+        or field.endswith("_tier")
+        or field.startswith("Free")
+        or "Upstream" in field
+        or "Downstream" in field
+    )
+
+
+def _get_domain_dtype(field):
+    return "int8" if min(DOMAINS[field]) < 0 else "uint8"
+
+
+def make_field(field, n, rng, columns, vocabulary):
+    """Create values of a field of barriers that is not a summary unit or
+    network field.
+
+    Parameters
+    ----------
+    field : str
+    n : int
+    rng : numpy.random.Generator
+    columns : dict
+        fields created so far
+    vocabulary : Vocabulary
+
+    Returns
+    -------
+    pyarrow.Array
+    """
+    if field in BOOL_FIELDS or field in UINT8_BOOL_FIELDS:
+        values = rng.random(n) < BOOL_PROBABILITY.get(field, 0.5)
+        return pa.array(values.astype("uint8") if field in UINT8_BOOL_FIELDS else values)
+
+    if field == "Trout":
+        # string coded domain; most barriers are not in trout streams
+        keys = sorted(DOMAINS[field].keys())
+        return _choice(rng, keys, n, weights=[20 if k == "" else 1 for k in keys])
+
+    if field in DOMAINS:
+        keys = sorted(DOMAINS[field].keys())
+        # -1 is only used for barrier types where the field is not applicable,
+        # except for fields where it means off-network or unknown
+        if min(keys) < 0 and field not in {"FlowsToOcean", "FlowsToGreatLakes", "DiadromousHabitat"}:
+            keys = [k for k in keys if k >= 0]
+
+        return _choice(rng, np.array(keys, dtype=_get_domain_dtype(field)), n)
+
+    if field == "FishHabitatPartnership":
+        return _multiple_values(rng, list(FISH_HABITAT_PARTNERSHIPS.keys()), n, empty=0.4)
+
+    if field == "SalmonidESU":
+        return _multiple_values(rng, [str(i) for i in range(1, 13)], n, empty=0.9)
+
+    if field == "DisadvantagedCommunity":
+        tract = pc.if_else(columns["EJTract"], "tract", "")
+        tribal = pc.if_else(columns["EJTribal"], "tribal", "")
+        return pc.utf8_trim(pc.binary_join_element_wise(tract, tribal, ","), ",")
+
+    if field == "YearCompleted":
+        years = rng.integers(1850, 2021, n)
+        return pa.array(np.where(rng.random(n) < 0.4, 0, years).astype("uint16"))
+
+    if field == "YearRemoved":
+        years = rng.integers(1990, 2025, n)
+        return pa.array(np.where(columns["Removed"].to_numpy(zero_copy_only=False), years, 0).astype("uint16"))
+
+    if field in SMALL_INT_FIELDS:
+        dtype, low, high = SMALL_INT_FIELDS[field]
+        return pa.array(rng.integers(low, high + 1, n).astype(dtype))
+
+    if field in ID64_FIELDS:
+        return pa.array(rng.integers(1, 2**50, n).astype("int64"))
+
+    if field.endswith("Class") or field.endswith("Classes"):
+        return _choice(rng, np.arange(0, 6, dtype="uint8"), n)
+
+    if field == "Name":
+        return vocabulary.names(rng, n, suffixes=DAM_SUFFIXES, blank=0.3)
+
+    if field == "River":
+        return vocabulary.names(rng, n, suffixes=STREAM_SUFFIXES, blank=0.2)
+
+    if field == "Road":
+        return vocabulary.names(rng, n, suffixes=ROAD_SUFFIXES, blank=0.3)
+
+    if field in STRING_VALUES:
+        return _choice(rng, STRING_VALUES[field], n)
+
+    if field in {"SourceID", "CrossingCode", "USGSCrossingID", "NIDID", "NIDFederalID", "PartnerID"}:
+        ids = pc.cast(pa.array(rng.integers(10_000, 10_000_000, n)), pa.string())
+        blank = {"SourceID": 0.1, "CrossingCode": 0.5, "USGSCrossingID": 0.3, "PartnerID": 0.8}.get(field, 0.4)
+        return pc.if_else(pa.array(rng.random(n) < blank), "", ids)
+
+    if field in {"NearestCrossingID", "NearestUSGSCrossingID"}:
+        ids = pc.binary_join_element_wise("cr", pc.cast(pa.array(rng.integers(1, 2_000_000, n)), pa.string()), "")
+        return pc.if_else(pa.array(rng.random(n) < 0.5), "", ids)
+
+    if field in {"SourceLink", "attachments"}:
+        return pa.array(np.repeat("", n))
+
+    if field == "SARP_Score":
+        return pa.array(np.where(rng.random(n) < 0.5, -1, rng.random(n).round(2)).astype("float32"))
+
+    if field.startswith("Percent"):
+        return pa.array(rng.uniform(0, 100, n).round(1).astype("float32"))
+
+    # other numeric values are skewed, with 0 where data are not available
+    values = rng.lognormal(1, 1.5, n).round(2)
+    return pa.array(np.where(rng.random(n) < 0.2, 0, values).astype("float32"))
+
+
+def _multiple_values(rng, keys, n, empty):
+    """Create comma-delimited values of one or two keys, or empty strings."""
+    first = _choice(rng, keys, n)
+    second = _choice(rng, keys, n)
+    both = pc.if_else(
+        pc.less(first, second),
+        pc.binary_join_element_wise(first, second, ","),
+        pc.binary_join_element_wise(second, first, ","),
+    )
+    values = pc.if_else(pc.or_(pa.array(rng.random(n) < 0.7), pc.equal(first, second)), first, both)
+    return pc.if_else(pa.array(rng.random(n) < empty), "", values)
+
+
+def make_network_fields(fields, n, rng_factory, columns, has_network, ranked):
+    """Create values of network fields of barriers.
+
+    Parameters
+    ----------
+    fields : list-like of str
+    n : int
+    rng_factory : callable
+        function that takes the name of a field and returns a random generator
+    columns : dict
+        fields created so far
+    has_network : ndarray of bool
+    ranked : ndarray of bool
+
+    Returns
+    -------
+    dict
+        {<field>: pyarrow.Array, ...}
+    """
+    out = {}
+    for field in fields:
+        rng = rng_factory(field)
+
+        if field == "HasNetwork":
+            out[field] = pa.array(has_network)
+            continue
+
+        if field == "Ranked":
+            out[field] = pa.array(ranked)
+            continue
+
+        if field == "in_network_type":
+            out[field] = pa.array(has_network | (rng.random(n) < 0.5))
+            continue
+
+        if field.endswith("_tier"):
+            out[field] = pa.array(np.where(ranked, rng.integers(1, 21, n), -1).astype("int8"))
+            continue
+
+        if field in DOMAINS:
+            # -1 where barrier does not have a network
+            keys = np.array([k for k in sorted(DOMAINS[field].keys()) if k >= 0])
+            values = keys[rng.choice(len(keys), size=n)]
+            out[field] = pa.array(np.where(has_network, values, -1).astype("int8"))
+            continue
+
+        if field.endswith("Class"):
+            values = rng.integers(1, 7, n)
+            out[field] = pa.array(np.where(has_network, values, 0).astype("uint8"))
+            continue
+
+        if field in SMALL_INT_FIELDS:
+            dtype, low, high = SMALL_INT_FIELDS[field]
+            # unsigned types are converted to signed to allow -1 as fill value
+            dtype = dtype.replace("uint8", "int16")
+            out[field] = pa.array(np.where(has_network, rng.integers(low, high + 1, n), -1).astype(dtype))
+            continue
+
+        if field in ID64_FIELDS:
+            out[field] = pa.array(np.where(has_network, rng.integers(1, 2**50, n), -1).astype("int64"))
+            continue
+
+        if field.startswith("Upstream") and not field.endswith(("Miles", "Acres")) or field.startswith("Total"):
+            if not field.endswith("Miles"):
+                # counts of barriers
+                out[field] = pa.array(np.where(has_network, rng.poisson(2, n), -1).astype("int32"))
+                continue
+
+        if field.startswith("Percent"):
+            values = rng.uniform(0, 100, n).round(1)
+
+        elif field in SPECIES_HABITAT_FIELDS:
+            # most networks do not have habitat of each species
+            values = np.where(rng.random(n) < 0.1, rng.lognormal(1, 1.5, n).round(3), 0)
+
+        else:
+            values = rng.lognormal(1.5, 1.5, n).round(3)
+
+        out[field] = pa.array(np.where(has_network, values, -1).astype("float32"))
+
+    return out
+
+
+class BarrierGenerator:
+    """Create synthetic barrier tables.
+
+    Parameters
+    ----------
+    seed : int
+    scale : float
+        fraction of national number of barriers
+    """
+
+    def __init__(self, seed, scale):
+        self.seed = seed
+        self.scale = scale
+        self.vocabulary = Vocabulary(seed)
+        self.geography = Geography(seed, self.vocabulary)
+        self.counts = {kind: max(int(round(count * scale)), 10) for kind, count in NATIONAL_COUNTS.items()}
+
+    def make_base(self, kind, fields, prefix, id_offset=0):
+        """Create the fields of barriers of kind that do not depend on the
+        network type.
+
+        Returns
+        -------
+        dict
+            {<field>: pyarrow.Array, ...}
+        """
+        n = self.counts[kind]
+        lon, lat = get_locations(self.seed, n, kind)
+
+        columns = {
+            "id": pa.array(np.arange(id_offset + 1, id_offset + n + 1, dtype="uint32")),
+            "lat": pa.array(lat),
+            "lon": pa.array(lon),
+            "SARPID": pc.binary_join_element_wise(prefix, pc.cast(pa.array(np.arange(1, n + 1)), pa.string()), ""),
+        }
+        columns.update(self.geography.locate(lon, lat))
+
+        # bool fields are created first so that other fields can depend on them
+        fields = [f for f in fields if f not in columns and not is_network_field(f) and f not in {"URL"}]
+        for field in sorted(fields, key=lambda f: f not in BOOL_FIELDS):
+            columns[field] = make_field(field, n, _get_rng(self.seed, kind, field), columns, self.vocabulary)
+
+        return columns
+
+    def make_networks(self, kind, network_type, columns, fields):
+        """Create network fields of barriers of kind for network_type.
+
+        Returns
+        -------
+        dict
+            {<field>: pyarrow.Array, ...}
+        """
+        n = len(columns["id"])
+        rng = _get_rng(self.seed, kind, network_type, "network")
+
+        def get_bool(field, default=False):
+            return columns[field].to_numpy(zero_copy_only=False) if field in columns else np.repeat(default, n)
+
+        has_network = get_bool("Snapped", True) & ~get_bool("OnLoop") & ~get_bool("Excluded")
+        has_network &= rng.random(n) < 0.97
+
+        # only barriers that break the network of the network type have networks
+        if network_type in ("largefish_barriers", "smallfish_barriers") and "BarrierType" in columns:
+            has_network &= rng.random(n) < (0.8 if network_type == "largefish_barriers" else 0.95)
+
+        ranked = has_network & ~get_bool("Removed") & ~get_bool("Unranked") & ~get_bool("Invasive")
+
+        return make_network_fields(
+            [f for f in fields if is_network_field(f)],
+            n,
+            lambda field: _get_rng(self.seed, kind, network_type, field),
+            columns,
+            has_network,
+            ranked,
+        )
+
+
+def _to_table(columns, fields):
+    return pa.table({field: columns[field] for field in fields})
+
+
+def _sort(table, keys):
+    return table.take(pc.sort_indices(table, sort_keys=[(key, "ascending") for key in keys]))
+
+
+def _fill_missing(field, arrays):
+    """Concatenate arrays (list of (array or None, length)) of a field of dams
+    and small barriers, filling values
+    of the barrier type where the field is not present in the same way as
+    aggregate_networks.py: empty strings, False, 0 for classes, and -1 for
+    other fields (which requires unsigned types to be converted to signed).
+    """
+    dtype = next(a.type for a, _ in arrays if a is not None)
+
+    if pa.types.is_unsigned_integer(dtype) and any(a is None for a, _ in arrays) and not field.endswith("Class"):
+        dtype = {pa.uint8(): pa.int16(), pa.uint16(): pa.int32(), pa.uint32(): pa.int64()}.get(dtype, pa.int64())
+
+    out = []
+    for array, n in arrays:
+        if array is not None:
+            out.append(array.cast(dtype))
+            continue
+
+        if pa.types.is_string(dtype):
+            fill = ""
+        elif pa.types.is_boolean(dtype):
+            fill = False
+        elif field.endswith("Class"):
+            fill = 0
+        else:
+            fill = -1
+
+        out.append(pa.array(np.repeat(fill, n)).cast(dtype))
+
+    return pa.chunked_array(out).combine_chunks()
+
+
+def write_table(table, path):
+    write_feather(table, path)
+    print(f"Wrote {len(table):,} records to {path}")
+
+
+def count_by_unit(units, tables):
+    """Count barriers in each summary unit, in the format of map_units.
+
+    Parameters
+    ----------
+    units : pyarrow.Table
+        summary units from Geography.units()
+    tables : dict
+        {<barrier type>: pyarrow.Table}
+
+    Returns
+    -------
+    pyarrow.Table
+    """
+    layer_fields = {layer: layer for layer in UNIT_FIELDS}
+    layer_fields["County"] = "COUNTYFIPS"
+
+    dams = tables["dams"]
+    small_barriers = tables["small_barriers"]
+    crossings = tables["road_crossings"]
+
+    def is_true(table, field):
+        return table[field].to_numpy()
+
+    stats = {
+        "dams": (dams, ~is_true(dams, "Removed"), None),
+        "ranked_dams": (dams, is_true(dams, "Ranked"), None),
+        "recon_dams": (dams, ~is_true(dams, "Removed") & (dams["Recon"].to_numpy() > 0), None),
+        "removed_dams": (dams, is_true(dams, "Removed"), None),
+        "removed_dams_gain_miles": (dams, is_true(dams, "Removed"), "GainMiles"),
+        "small_barriers": (small_barriers, ~is_true(small_barriers, "Removed"), None),
+        "ranked_small_barriers": (small_barriers, is_true(small_barriers, "Ranked"), None),
+        "total_small_barriers": (small_barriers, None, None),
+        "removed_small_barriers": (small_barriers, is_true(small_barriers, "Removed"), None),
+        "removed_small_barriers_gain_miles": (small_barriers, is_true(small_barriers, "Removed"), "GainMiles"),
+        "total_road_crossings": (crossings, None, None),
+        "unsurveyed_road_crossings": (crossings, crossings["Surveyed"].to_numpy() == 0, None),
+    }
+    for network_type in ("largefish_barriers", "smallfish_barriers"):
+        table = tables[network_type]
+        for barrier_type in ("dams", "small_barriers"):
+            mask = is_true(table, "Ranked") & (table["BarrierType"].to_numpy(zero_copy_only=False) == barrier_type)
+            stats[f"ranked_{network_type}_{barrier_type}"] = (table, mask, None)
+
+    out = {}
+    layers = units["layer"].to_numpy(zero_copy_only=False)
+    ids = units["id"]
+    for layer, field in layer_fields.items():
+        in_layer = np.flatnonzero(layers == layer)
+        layer_ids = ids.take(pa.array(in_layer))
+
+        for name, (table, mask, value_field) in stats.items():
+            positions = pc.index_in(table[field], value_set=layer_ids).to_numpy(zero_copy_only=False)
+            weights = table[value_field].to_numpy().clip(0) if value_field else np.ones(len(table))
+            if mask is not None:
+                weights = np.where(mask, weights, 0)
+
+            counts = np.bincount(positions.astype("int64"), weights=weights, minlength=len(in_layer))
+            out.setdefault(name, np.zeros(len(units), dtype="float64"))[in_layer] = counts
+
+    columns = {}
+    for name in SUMMARY_UNIT_FIELDS:
+        if name in units.column_names:
+            continue
+
+        if name.endswith("_by_year"):
+            columns[name] = pa.array(np.repeat("", len(units)))
+        elif name.endswith("_gain_miles"):
+            columns[name] = pa.array(out[name].round(3))
+        else:
+            columns[name] = pa.array(out[name].astype("uint32"))
+
+    return pa.table({**{c: units[c] for c in units.column_names}, **columns})
+
+
+def generate(out_dir, scale=0.01, seed=0, derived=True):
+    """Generate synthetic barrier tables, map units, and api.db, and optionally
+    the other derived files used by the API, in <out_dir>/data/api.
+
+    Parameters
+    ----------
+    out_dir : Path
+    scale : float, optional (default: 0.01)
+        fraction of national number of barriers
+    seed : int, optional (default: 0)
+    derived : bool, optional (default: True)
+        if True, create the memory-mapped tables, indexes, and public CSV
+        shards used by the API
+    """
+    start = perf_counter()
+    api_dir = Path(out_dir) / "data/api"
+    api_dir.mkdir(exist_ok=True, parents=True)
+
+    ui_dir = Path(out_dir) / "ui"
+    if not ui_dir.exists():
+        ui_dir.symlink_to(REPO_DIR / "ui", target_is_directory=True)
+
+    generator = BarrierGenerator(seed, scale)
+    tables = {}
+
+    ### Dams and small barriers
+    dams = generator.make_base("dams", DAM_API_FIELDS, "d")
+    small_barriers = generator.make_base(
+        "small_barriers", SB_API_FIELDS, "sb", id_offset=NATIONAL_COUNTS["dams"] + generator.counts["dams"]
+    )
+
+    for kind, columns, fields, network_type in [
+        ("dams", dams, DAM_API_FIELDS, "dams"),
+        ("small_barriers", small_barriers, SB_API_FIELDS, "combined_barriers"),
+    ]:
+        networks = generator.make_networks(kind, network_type, columns, fields)
+        url = pc.binary_join_element_wise(f"https://aquaticbarriers.org/report/{network_type}/", columns["SARPID"], "")
+        table = _sort(_to_table({**columns, **networks, "URL": url}, ["id"] + fields + ["URL"]), ["SARPID"])
+        write_table(table, api_dir / f"{kind}.feather")
+        tables[kind] = table
+
+    ### Combined barriers
+    dams["BarrierType"] = pa.array(np.repeat("dams", len(dams["id"])))
+    small_barriers["BarrierType"] = pa.array(np.repeat("small_barriers", len(small_barriers["id"])))
+
+    # small barriers use passability derived from severity
+    severity = small_barriers["BarrierSeverity"].to_numpy()
+    passability = np.zeros(max(SEVERITY_TO_PASSABILITY) + 1, dtype="uint8")
+    for key, value in SEVERITY_TO_PASSABILITY.items():
+        passability[key] = value
+    small_barriers["Passability"] = pa.array(passability[severity])
+
+    num_dams = len(dams["id"])
+    num_small_barriers = len(small_barriers["id"])
+    combined = {}
+    for field in ["id"] + COMBINED_API_FIELDS:
+        if is_network_field(field):
+            continue
+
+        combined[field] = _fill_missing(
+            field, [(dams.get(field), num_dams), (small_barriers.get(field), num_small_barriers)]
+        )
+
+    for network_type in NETWORK_TYPES[1:]:
+        networks = generator.make_networks("combined_barriers", network_type, combined, COMBINED_API_FIELDS)
+        url = pc.binary_join_element_wise(f"https://aquaticbarriers.org/report/{network_type}/", combined["SARPID"], "")
+        table = _sort(
+            _to_table({**combined, **networks, "URL": url}, ["id"] + COMBINED_API_FIELDS + ["URL"]), ["SARPID"]
+        )
+        write_table(table, api_dir / f"{network_type}.feather")
+        tables[network_type] = table
+
+    ### Waterfalls (one record per network type)
+    waterfalls = generator.make_base("waterfalls", WF_API_FIELDS, "f")
+    num_waterfalls = len(waterfalls["id"])
+    parts = []
+    for network_type in NETWORK_TYPES:
+        networks = generator.make_networks("waterfalls", network_type, waterfalls, WF_API_FIELDS)
+        network_types = pa.array(np.repeat(network_type, num_waterfalls))
+        parts.append(_to_table({**waterfalls, **networks, "network_type": network_types}, ["id"] + WF_API_FIELDS))
+
+    table = _sort(pa.concat_tables(parts), ["SARPID", "network_type"])
+    write_table(table, api_dir / "waterfalls.feather")
+
+    ### Road crossings (no networks)
+    crossings = generator.make_base("road_crossings", ROAD_CROSSING_API_FIELDS, "cr")
+    n = len(crossings["id"])
+    crossings.update(
+        make_network_fields(
+            [f for f in ROAD_CROSSING_API_FIELDS if is_network_field(f)],
+            n,
+            lambda field: _get_rng(seed, "road_crossings", field),
+            crossings,
+            np.ones(n, dtype="bool"),
+            np.zeros(n, dtype="bool"),
+        )
+    )
+    # most crossings have not been surveyed
+    crossings["Surveyed"] = _choice(
+        _get_rng(seed, "road_crossings", "Surveyed"), np.array([0, 1, 2], "uint8"), n, [90, 5, 5]
+    )
+    table = _sort(_to_table(crossings, ["id"] + ROAD_CROSSING_API_FIELDS), ["SARPID"])
+    write_table(table, api_dir / "road_crossings.feather")
+    tables["road_crossings"] = table
+
+    ### Search barriers
+    unsurveyed = crossings["Surveyed"].to_numpy() == 0
+    crossings["BarrierType"] = pa.array(np.repeat("road_crossings", n))
+    waterfalls["BarrierType"] = pa.array(np.repeat("waterfalls", num_waterfalls))
+    search = pa.concat_tables(
+        [
+            _to_table(combined, BARRIER_SEARCH_RESULT_FIELDS),
+            _to_table(waterfalls, BARRIER_SEARCH_RESULT_FIELDS),
+            _to_table(crossings, BARRIER_SEARCH_RESULT_FIELDS).filter(pa.array(unsurveyed)),
+        ]
+    )
+    search_key = pc.replace_substring(_join_words(search["Name"], search["River"]), "  ", " ")
+    priority = pc.index_in(
+        search["BarrierType"], value_set=pa.array(["dams", "waterfalls", "small_barriers", "road_crossings"])
+    )
+    search = search.append_column("search_key", search_key).append_column("priority", priority.cast(pa.uint8()))
+    write_table(_sort(search, ["priority", "SARPID"]), api_dir / "search_barriers.feather")
+
+    ### Removed dams for public API
+    removed_fields = (
+        GENERAL_API_FIELDS1
+        + ["NIDID", "YearCompleted", "YearRemoved", "Height", "Construction", "Purpose"]
+        + UNIT_FIELDS
+    )
+    removed = _to_table(dams, ["id"] + removed_fields).filter(dams["Removed"])
+    removed = removed.append_column("duplicate", pa.array(np.zeros(len(removed), dtype="bool")))
+    write_table(removed, api_dir / "removed_dams.feather")
+
+    ### Summary units
+    units = count_by_unit(generator.geography.units(), tables)
+    write_table(units, api_dir / "map_units.feather")
+
+    print("Creating DuckDB database")
+    create_api_db(api_dir, NETWORK_TYPES)
+
+    if derived:
+        print("Creating uncompressed barrier tables, indexes, and public CSV shards")
+        create_resident_tables(api_dir)
+        create_indexes(api_dir)
+        create_public_shards(api_dir)
+
+    print(f"Generated dataset at scale {scale} in {perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic dataset for the API")
+    parser.add_argument("--scale", type=float, default=0.01, help="fraction of national number of barriers")
+    parser.add_argument("--seed", type=int, default=0, help="seed of random generator")
+    parser.add_argument("--out", type=Path, required=True, help="directory where data/api is created")
+    parser.add_argument(
+        "--no-derived",
+        action="store_true",
+        help="only create barrier tables, map units, and api.db, not memory-mapped tables, indexes, or shards",
+    )
+    args = parser.parse_args()
+
+    generate(args.out, scale=args.scale, seed=args.seed, derived=not args.no_derived)
@@ -0,0 +1,79 @@
+"""Compare calculating custom tiers for subsets of barriers from the metric
+values (sorting unique values of each metric for each request) versus from
+the global dense ranks of each metric created in aggregate_networks.py.
+
+This uses a synthetic table with metric values of similar cardinality to the
+barrier tables; it does not require data/api.
+
+Run from the root of the repository:
+python benchmarks/metric_ranks.py --iterations 5
+"""
+
+import argparse
+from time import perf_counter
+
+import numpy as np
+import pyarrow as pa
+
+from api.lib.indexes import build_metric_ranks
+from api.lib.tiers import calculate_tiers, METRICS, METRIC_RANK_FIELDS
+
+
+SUBSET_SIZES = [10_000, 100_000, 1_000_000]
+
+
+def create_table(size, seed=0):
+    rng = np.random.default_rng(seed)
+    data = {}
+    for field in METRICS:
+        if field.endswith("SizeClasses") or field == "Landcover":
+            data[field] = rng.integers(0, 8, size=size).astype("int8")
+        elif field.startswith("Percent"):
+            data[field] = rng.integers(0, 101, size=size).astype("int8")
+        else:
+            # miles rounded to 0.001, heavily skewed toward small values
+            data[field] = np.round(rng.lognormal(0, 2, size=size), 3).astype("float32")
+
+    return pa.Table.from_pydict(data)
+
+
+def time_call(func, iterations):
+    func()
+    times = []
+    for _ in range(iterations):
+        start = perf_counter()
+        func()
+        times.append(perf_counter() - start)
+
+    return np.median(times) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare custom tiers from metric values and global ranks")
+    parser.add_argument("--iterations", type=int, default=5, help="number of times to run each calculation")
+    args = parser.parse_args()
+
+    total = 2 * max(SUBSET_SIZES)
+    df = create_table(total)
+
+    start = perf_counter()
+    ranks = build_metric_ranks(df, METRICS)
+    print(f"built global ranks for {total:,} rows in {perf_counter() - start:.2f}s")
+
+    ranked = df
+    for field in ranks.schema:
+        ranked = ranked.append_column(field.with_name(METRIC_RANK_FIELDS[field.name]), ranks[field.name])
+
+    rng = np.random.default_rng(1)
+
+    print(f"\n{'subset size':>12} {'values (ms)':>12} {'ranks (ms)':>12} {'speedup':>8}")
+    for size in SUBSET_SIZES:
+        rows = np.sort(rng.choice(total, size=size, replace=False))
+        with_ranks = ranked.take(rows)
+        values_only = with_ranks.select(METRICS)
+
+        assert calculate_tiers(values_only).equals(calculate_tiers(with_ranks))
+
+        values_time = time_call(lambda: calculate_tiers(values_only), args.iterations)
+        ranks_time = time_call(lambda: calculate_tiers(with_ranks), args.iterations)
+        print(f"{size:>12,} {values_time:>12.1f} {ranks_time:>12.1f} {values_time / ranks_time:>7.1f}x")
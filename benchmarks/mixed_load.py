@@ -0,0 +1,122 @@
+"""Compare per-route request latency of the API under a mixed load of light
+and heavy requests when CPU-bound work runs directly on the event loop
+(EXECUTOR_THREADS=0) versus in the executor thread pool (default).
+
+Each mode runs in a separate process that imports the API and runs several
+concurrent clients through the ASGI app for a fixed duration: most clients
+issue light requests (details, search, query), while a few issue heavy
+requests (rank, CSV downloads) for a larger selection of records.  The result
+cache is disabled so that every request is processed.
+
+Requests rejected by admission control (503) are counted separately and
+excluded from the latencies.
+
+Run from the root of the repository:
+python benchmarks/mixed_load.py --duration 20 --light-clients 8 --heavy-clients 2 --state GA --heavy-state TX
+"""
+
+import argparse
+import asyncio
+import multiprocessing as mp
+import os
+from time import perf_counter
+
+import numpy as np
+
+
+MODES = {"event loop": "0", "executor": "4"}
+
+
+def get_routes(state, heavy_state):
+    prefix = "/api/v1/internal"
+    light = [
+        ("dams details", "get", f"{prefix}/dams/details/{{sarp_id}}", {}),
+        ("barrier search", "get", f"{prefix}/barriers/search", {"query": "mill"}),
+        ("dams query", "get", f"{prefix}/dams/query", {"State": state}),
+        ("small_barriers query", "get", f"{prefix}/small_barriers/query", {"State": state}),
+    ]
+    heavy = [
+        ("combined_barriers rank", "get", f"{prefix}/combined_barriers/rank", {"State": heavy_state}),
+        ("dams download", "post", f"{prefix}/dams/csv", {"State": heavy_state, "stream": True}),
+        ("public dams state", "get", "/api/v1/public/dams/state", {"id": heavy_state}),
+    ]
+    return light, heavy
+
+
+def run_mode(mode, args, results):
+    # must be set before importing the API
+    os.environ["EXECUTOR_THREADS"] = MODES[mode]
+    os.environ["RESULT_CACHE_MAX_BYTES"] = "0"
+
+    from httpx import ASGITransport, AsyncClient
+    import pyarrow.compute as pc
+
+    from api.data import dams
+    from api.server import app
+
+    # use an arbitrary dam within the state for details
+    sarp_id = dams.to_table(columns=["SARPID"], filter=pc.field("State") == args.state)["SARPID"][0].as_py()
+
+    light, heavy = get_routes(args.state, args.heavy_state)
+
+    async def run_client(client, routes, offset, end, latencies, rejected):
+        i = offset
+        while perf_counter() < end:
+            name, method, path, params = routes[i % len(routes)]
+            i += 1
+
+            start = perf_counter()
+            response = await getattr(client, method)(path.format(sarp_id=sarp_id), params=params)
+            elapsed = perf_counter() - start
+
+            if response.status_code == 503:
+                rejected[name] = rejected.get(name, 0) + 1
+                await asyncio.sleep(0.1)
+                continue
+
+            assert response.status_code == 200, f"{name} failed: {response.status_code}"
+            latencies.setdefault(name, []).append(elapsed * 1000)
+
+    async def run():
+        latencies = {}
+        rejected = {}
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://localhost", timeout=None) as client:
+            # warmup
+            for name, method, path, params in light + heavy:
+                await getattr(client, method)(path.format(sarp_id=sarp_id), params=params)
+
+            end = perf_counter() + args.duration
+            await asyncio.gather(
+                *[run_client(client, light, i, end, latencies, rejected) for i in range(args.light_clients)],
+                *[run_client(client, heavy, i, end, latencies, rejected) for i in range(args.heavy_clients)],
+            )
+
+        return latencies, rejected
+
+    latencies, rejected = asyncio.run(run())
+    results.put({"mode": mode, "latencies": latencies, "rejected": rejected})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare API latency under mixed load with and without executor")
+    parser.add_argument("--duration", type=int, default=20, help="number of seconds to run each mode")
+    parser.add_argument("--light-clients", type=int, default=8, help="number of clients issuing light requests")
+    parser.add_argument("--heavy-clients", type=int, default=2, help="number of clients issuing heavy requests")
+    parser.add_argument("--state", default="GA", help="state used to select records for light requests")
+    parser.add_argument("--heavy-state", default="TX", help="state used to select records for heavy requests")
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+
+    for mode in MODES:
+        results = ctx.Queue()
+        process = ctx.Process(target=run_mode, args=(mode, args, results))
+        process.start()
+        result = results.get()
+        process.join()
+
+        print(f"\n### {mode} (EXECUTOR_THREADS={MODES[mode]})")
+        print(f"{'request':<28} {'count':>8} {'rejected':>8} {'p50 (ms)':>10} {'p99 (ms)':>10}")
+        for name, values in result["latencies"].items():
+            p50, p99 = np.percentile(values, [50, 99])
+            print(f"{name:<28} {len(values):>8} {result['rejected'].get(name, 0):>8} {p50:>10.1f} {p99:>10.1f}")
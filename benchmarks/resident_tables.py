@@ -0,0 +1,136 @@
+"""Compare per-worker memory use and request latency of the API when barrier
+tables are read from the compressed feather files (default) versus when they
+are memory-mapped resident tables (RESIDENT_TABLES=1).
+
+Each mode runs in a set of separate worker processes that import the API and
+issue the same mix of requests through the ASGI app, similar to gunicorn
+workers.  Memory is read from /proc (Linux only) while all workers of a mode
+are alive; PSS (proportional set size) divides shared pages between the
+processes that map them, so it reflects sharing of the OS page cache.
+
+This requires the uncompressed tables in data/api/mmap created by
+analysis/post/aggregate_networks.py.
+
+Run from the root of the repository:
+python benchmarks/resident_tables.py --workers 2 --iterations 20 --state GA
+"""
+
+import argparse
+import asyncio
+import multiprocessing as mp
+import os
+from time import perf_counter
+
+import numpy as np
+
+
+MODES = {"dataset": "", "resident": "1"}
+
+
+def get_routes(state):
+    prefix = "/api/v1/internal"
+    return [
+        ("dams query", "get", f"{prefix}/dams/query", {"State": state}),
+        ("dams rank", "get", f"{prefix}/dams/rank", {"State": state}),
+        ("combined_barriers query", "get", f"{prefix}/combined_barriers/query", {"State": state}),
+        ("combined_barriers rank", "get", f"{prefix}/combined_barriers/rank", {"State": state}),
+        ("road_crossings query", "get", f"{prefix}/road_crossings/query", {"State": state}),
+        ("dams details", "get", f"{prefix}/dams/details/{{sarp_id}}", {}),
+    ]
+
+
+def read_memory():
+    """Read memory usage of the current process from /proc.
+
+    Returns
+    -------
+    dict
+        {"rss": <MB>, "pss": <MB>, "pss_anon": <MB>, "pss_file": <MB>}
+    """
+    keys = {"Rss": "rss", "Pss": "pss", "Pss_Anon": "pss_anon", "Pss_File": "pss_file"}
+    out = {}
+    with open("/proc/self/smaps_rollup") as infile:
+        for line in infile:
+            key, _, value = line.partition(":")
+            if key in keys:
+                # values are in kB
+                out[keys[key]] = int(value.split()[0]) / 1024
+
+    return out
+
+
+def run_worker(mode, state, iterations, barrier, results):
+    # must be set before importing the API
+    os.environ["RESIDENT_TABLES"] = MODES[mode]
+
+    from httpx import ASGITransport, AsyncClient
+    import pyarrow.compute as pc
+
+    from api.data import dams
+    from api.server import app
+
+    # use an arbitrary dam within the state for details
+    sarp_id = dams.to_table(columns=["SARPID"], filter=pc.field("State") == state)["SARPID"][0].as_py()
+
+    async def run():
+        latencies = {}
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://localhost") as client:
+            for i in range(iterations + 1):
+                for name, method, path, params in get_routes(state):
+                    start = perf_counter()
+                    response = await getattr(client, method)(path.format(sarp_id=sarp_id), params=params)
+                    elapsed = perf_counter() - start
+                    assert response.status_code == 200, f"{name} failed: {response.status_code}"
+
+                    # first iteration is used for warmup
+                    if i > 0:
+                        latencies.setdefault(name, []).append(elapsed * 1000)
+
+        return latencies
+
+    latencies = asyncio.run(run())
+
+    # wait until all workers of this mode are done so that shared pages are
+    # attributed across all of them
+    barrier.wait()
+    results.put({"mode": mode, "pid": os.getpid(), "memory": read_memory(), "latencies": latencies})
+    barrier.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare dataset and resident table modes of the API")
+    parser.add_argument("--workers", type=int, default=2, help="number of worker processes per mode")
+    parser.add_argument("--iterations", type=int, default=20, help="number of times to run each request")
+    parser.add_argument("--state", default="GA", help="state used to select records for each request")
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+
+    for mode in MODES:
+        barrier = ctx.Barrier(args.workers)
+        results = ctx.Queue()
+        workers = [
+            ctx.Process(target=run_worker, args=(mode, args.state, args.iterations, barrier, results))
+            for _ in range(args.workers)
+        ]
+        for worker in workers:
+            worker.start()
+
+        worker_results = [results.get() for _ in workers]
+
+        for worker in workers:
+            worker.join()
+
+        print(f"\n### {mode} mode ({args.workers} workers)")
+        print(f"{'worker':>10} {'RSS (MB)':>10} {'PSS (MB)':>10} {'PSS anon':>10} {'PSS file':>10}")
+        for result in worker_results:
+            mem = result["memory"]
+            print(
+                f"{result['pid']:>10} {mem['rss']:>10.1f} {mem['pss']:>10.1f} {mem['pss_anon']:>10.1f} {mem['pss_file']:>10.1f}"
+            )
+
+        print(f"\n{'request':<28} {'p50 (ms)':>10} {'p95 (ms)':>10} {'p99 (ms)':>10}")
+        for name in worker_results[0]["latencies"]:
+            values = np.concatenate([result["latencies"][name] for result in worker_results])
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            print(f"{name:<28} {p50:>10.1f} {p95:>10.1f} {p99:>10.1f}")
@@ -0,0 +1,119 @@
+"""Measure API worker startup time with a cold and a warm OS page cache, with
+and without warmup (WARMUP=1 / WARMUP=0).
+
+Each run is a separate process that imports the API, starts it (lifespan),
+waits until /readyz reports that it is ready, then issues a few typical
+requests through the ASGI app.  Without warmup, data are loaded by these
+first requests instead.
+
+For a cold page cache, the OS is advised to drop the cached pages of all
+files in data/api before each run (posix_fadvise; does not require root, but
+pages that are mapped by other processes are not dropped).
+
+Run from the root of the repository:
+python benchmarks/startup.py --state GA --resident
+"""
+
+import argparse
+import asyncio
+import multiprocessing as mp
+import os
+from pathlib import Path
+from time import perf_counter
+
+
+MODES = [("cold", "1"), ("warm", "1"), ("cold", "0"), ("warm", "0")]
+
+
+def drop_page_cache(path):
+    """Advise the OS to drop cached pages of all files under path."""
+    for filename in Path(path).rglob("*"):
+        if not filename.is_file():
+            continue
+
+        fd = os.open(filename, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def get_routes(state):
+    prefix = "/api/v1/internal"
+    return [
+        ("dams query", "get", f"{prefix}/dams/query", {"State": state}),
+        ("dams rank", "get", f"{prefix}/dams/rank", {"State": state}),
+        ("dams details", "get", f"{prefix}/dams/details/{{sarp_id}}", {}),
+        ("barrier search", "get", f"{prefix}/barriers/search", {"query": "mill"}),
+        ("unit search", "get", f"{prefix}/units/search", {"layer": "HUC8,State", "query": "river"}),
+    ]
+
+
+def run_mode(warmup, args, results):
+    start = perf_counter()
+
+    # must be set before importing the API
+    os.environ["WARMUP"] = warmup
+    os.environ["RESIDENT_TABLES"] = "1" if args.resident else ""
+    os.environ["RESULT_CACHE_MAX_BYTES"] = "0"
+
+    from httpx import ASGITransport, AsyncClient
+
+    from api.server import app
+
+    timings = {"import": perf_counter() - start}
+
+    async def run():
+        async with app.router.lifespan_context(app):
+            async with AsyncClient(transport=ASGITransport(app=app), base_url="http://localhost") as client:
+                while (await client.get("/readyz")).status_code != 200:
+                    await asyncio.sleep(0.01)
+
+                timings["ready"] = perf_counter() - start
+
+                # the SARPID is read from the dataset after startup is measured
+                sarp_id = None
+                for name, method, path, params in get_routes(args.state):
+                    if "{sarp_id}" in path:
+                        if sarp_id is None:
+                            from api.data import dams
+
+                            sarp_id = dams.to_table(columns=["SARPID"])["SARPID"][0].as_py()
+
+                        path = path.format(sarp_id=sarp_id)
+
+                    request_start = perf_counter()
+                    response = await getattr(client, method)(path, params=params)
+                    assert response.status_code == 200, f"{name} failed: {response.status_code}"
+                    timings[name] = perf_counter() - request_start
+
+    asyncio.run(run())
+    timings["total"] = perf_counter() - start
+    results.put(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure API startup time with cold and warm page cache")
+    parser.add_argument("--state", default="GA", help="state used to select records for requests")
+    parser.add_argument("--resident", action="store_true", help="use resident tables (RESIDENT_TABLES=1)")
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+
+    rows = []
+    for cache, warmup in MODES:
+        if cache == "cold":
+            drop_page_cache("data/api")
+
+        results = ctx.Queue()
+        process = ctx.Process(target=run_mode, args=(warmup, args, results))
+        process.start()
+        timings = results.get()
+        process.join()
+        rows.append((f"{cache} cache, WARMUP={warmup}", timings))
+
+    names = list(rows[0][1].keys())
+    print(f"\n{'mode':<24} " + " ".join(f"{name:>15}" for name in names))
+    for label, timings in rows:
+        print(f"{label:<24} " + " ".join(f"{timings[name] * 1000:>12.1f} ms" for name in names))
@@ -0,0 +1,101 @@
+"""Compare latency of searching summary units by name with the in-memory unit
+search index versus scanning map_units.feather (previous implementation),
+and verify that both return the same units in the same order.
+
+Every HUC12, county, and congressional district name is used as a query,
+along with its first few characters (as typed by a user into the search box),
+against the layers searched together with that layer in the UI.
+
+Run from the root of the repository:
+python benchmarks/unit_search.py --prefix-length 3
+"""
+
+import argparse
+from time import perf_counter
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from api.constants import SUMMARY_UNIT_FIELDS
+from api.data import units, unit_search_index
+
+
+LAYERS = {
+    "HUC12": ["HUC2", "HUC6", "HUC8", "HUC10", "HUC12"],
+    "County": ["State", "County", "CongressionalDistrict"],
+    "CongressionalDistrict": ["State", "County", "CongressionalDistrict"],
+}
+
+
+def scan_units(layers, query):
+    matches = units.to_table(
+        filter=pc.field("layer").isin(layers) & pc.match_substring(pc.field("key"), query.lower(), ignore_case=True)
+    )
+
+    total_count = len(matches)
+
+    matches = (
+        pa.Table.from_pydict(
+            {
+                **{col: matches[col] for col in matches.column_names},
+                "name_ipos": pc.find_substring(matches["key"], query, ignore_case=True),
+                "name_len": pc.utf8_length(matches["name"]),
+            }
+        )
+        .sort_by(
+            [
+                ["priority", "ascending"],
+                ["name_ipos", "ascending"],
+                ["name_len", "ascending"],
+                ["state", "ascending"],
+            ]
+        )
+        .select(SUMMARY_UNIT_FIELDS)[:10]
+    )
+
+    return matches, total_count
+
+
+def search_units(layers, query):
+    rows, total_count = unit_search_index.search(layers, query, limit=10)
+    return unit_search_index.table.select(SUMMARY_UNIT_FIELDS).take(rows), total_count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare unit search index and scan of map_units")
+    parser.add_argument(
+        "--prefix-length", type=int, default=3, help="number of characters of each name for prefix query"
+    )
+    parser.add_argument("--limit", type=int, default=None, help="maximum number of names per layer")
+    args = parser.parse_args()
+
+    table = units.to_table(columns=["layer", "name"])
+
+    for layer, layers in LAYERS.items():
+        names = pc.unique(table.filter(pc.field("layer") == layer)["name"]).to_pylist()[: args.limit]
+        names = [name.replace(",", "") for name in names if name]
+
+        for label, queries in [
+            ("full name", names),
+            (f"first {args.prefix_length} chars", sorted({name[: args.prefix_length].strip() for name in names})),
+        ]:
+            latencies = {"scan": [], "index": []}
+            mismatches = 0
+            for query in queries:
+                start = perf_counter()
+                expected = scan_units(layers, query)
+                latencies["scan"].append((perf_counter() - start) * 1000)
+
+                start = perf_counter()
+                result = search_units(layers, query)
+                latencies["index"].append((perf_counter() - start) * 1000)
+
+                if result[1] != expected[1] or not result[0].equals(expected[0]):
+                    mismatches += 1
+
+            print(f"\n### {layer} names, {label} ({len(queries)} queries, {mismatches} mismatches)")
+            print(f"{'method':<10} {'p50 (ms)':>10} {'p95 (ms)':>10} {'p99 (ms)':>10} {'max (ms)':>10}")
+            for method, values in latencies.items():
+                p50, p95, p99 = np.percentile(values, [50, 95, 99])
+                print(f"{method:<10} {p50:>10.2f} {p95:>10.2f} {p99:>10.2f} {max(values):>10.2f}")
@@ -0,0 +1,121 @@
+"""Compare wall time and size of the national road_crossings download zip file
+written using the current single-threaded deflate writers, the parallel
+deflate writer in api.lib.zip at several numbers of threads, and zstd
+compressed CSV (csv.zst format).
+
+The records are read and unpacked the same way as for the national download
+created by analysis/post/aggregate_networks.py, before timing starts.  Each
+writer renders the CSV file while compressing it, so the time to only render
+the CSV file (without compression) is included for reference.
+
+Use --data-dir to run this on a synthetic dataset created using
+generate_data.py, e.g., at --scale 1 for a national-sized dataset.
+
+Run from the root of the repository:
+python benchmarks/zip_writer.py --threads 1 2 4 8 --repeat 3
+"""
+
+import argparse
+from io import BytesIO
+import os
+from pathlib import Path
+import tempfile
+from time import localtime, perf_counter
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED
+
+import pyarrow as pa
+from pyarrow.csv import write_csv
+from pyarrow.dataset import dataset
+
+from api.constants import CUSTOM_TIER_FIELDS, ROAD_CROSSING_EXPORT_FIELDS
+from api.lib.domains import unpack_domains
+from api.lib.zip import open_zip_entry
+from api.settings import get_available_cpus
+
+
+FILENAME = "aquatic_barrier_ranks.csv"
+
+
+def read_table(data_dir):
+    columns = ["id"] + [c for c in ROAD_CROSSING_EXPORT_FIELDS if c not in CUSTOM_TIER_FIELDS]
+    table = dataset(data_dir / "road_crossings.feather", format="feather").to_table(columns=columns).combine_chunks()
+    return unpack_domains(table.drop(["id"]))
+
+
+def write_csv_only(path, table):
+    # only counts the bytes written
+    write_csv(table, pa.MockOutputStream())
+
+
+def write_current(path, table, compresslevel):
+    if compresslevel == 9:
+        # current national writer: render CSV to memory, then deflate at once
+        with ZipFile(path, "w", compression=ZIP_DEFLATED, compresslevel=9) as zf:
+            csv_stream = BytesIO()
+            write_csv(table, csv_stream)
+            zf.writestr(FILENAME, csv_stream.getvalue())
+
+    else:
+        # current custom download writer: deflate while rendering CSV
+        with ZipFile(path, "w", compression=ZIP_DEFLATED, compresslevel=compresslevel) as zf:
+            with zf.open(FILENAME, "w", force_zip64=True) as entry:
+                write_csv(table, entry)
+
+
+def write_parallel(path, table, compresslevel, threads):
+    with ZipFile(path, "w", compression=ZIP_DEFLATED, compresslevel=compresslevel) as zf:
+        with open_zip_entry(zf, FILENAME, threads=threads) as entry:
+            write_csv(table, entry)
+
+
+def write_zstd(path, table):
+    # same as the csv.zst format of custom downloads
+    with ZipFile(path, "w", compression=ZIP_DEFLATED) as zf:
+        info = ZipInfo(f"{FILENAME}.zst", date_time=localtime()[:6])
+        info.compress_type = ZIP_STORED
+        with pa.CompressedOutputStream(zf.open(info, "w", force_zip64=True), "zstd") as entry:
+            write_csv(table, entry)
+
+
+def run(name, func, repeat):
+    fd, path = tempfile.mkstemp(suffix=".zip")
+    os.close(fd)
+    try:
+        elapsed = []
+        for _ in range(repeat):
+            start = perf_counter()
+            func(path)
+            elapsed.append(perf_counter() - start)
+
+        size = os.path.getsize(path)
+
+    finally:
+        os.remove(path)
+
+    print(f"{name:<32} {min(elapsed):>10.2f} {size / 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare download zip writers")
+    parser.add_argument("--data-dir", default="data/api", help="directory containing road_crossings.feather")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4], help="numbers of threads")
+    parser.add_argument("--levels", type=int, nargs="+", default=[5, 9], help="deflate compression levels")
+    parser.add_argument("--repeat", type=int, default=3, help="number of times to write each zip file")
+    args = parser.parse_args()
+
+    table = read_table(Path(args.data_dir))
+    print(f"road_crossings: {len(table):,} records, {get_available_cpus()} available cores")
+
+    print(f"\n{'writer':<32} {'time (s)':>10} {'size (MB)':>10}")
+    run("csv only (no zip)", lambda path: write_csv_only(path, table), args.repeat)
+
+    for level in args.levels:
+        run(f"current (level {level})", lambda path: write_current(path, table, level), args.repeat)
+        for threads in args.threads:
+            run(
+                f"parallel (level {level}, {threads} threads)",
+                lambda path: write_parallel(path, table, level, threads),
+                args.repeat,
+            )
+
+    run("csv.zst", lambda path: write_zstd(path, table), args.repeat)
@@ -0,0 +1,78 @@
+import pyarrow as pa
+import pytest
+
+from api.lib.cache import ResultCache, get_cache_key, result_cache
+
+
+def test_cache_key():
+    key = get_cache_key(
+        "query",
+        barrier_type="dams",
+        unit_ids={"State": pa.array(["GA", "AL"])},
+        filters={"GainMilesClass": ("in_array", [1, 2])},
+    )
+
+    # order of ids and filter values does not change the key
+    assert key == get_cache_key(
+        "query",
+        barrier_type="dams",
+        unit_ids={"State": pa.array(["AL", "GA"])},
+        filters={"GainMilesClass": ("in_array", [2, 1])},
+    )
+
+    assert key != get_cache_key("rank", barrier_type="dams", unit_ids={"State": pa.array(["GA", "AL"])}, filters={})
+    assert key != get_cache_key("query", barrier_type="dams", unit_ids={"State": pa.array(["GA"])}, filters={})
+
+
+@pytest.mark.anyio
+async def test_cache_limits():
+    cache = ResultCache(max_bytes=25, max_entries=2)
+
+    await cache.set("a", "text/plain", b"0" * 10)
+    await cache.set("b", "text/plain", b"0" * 10)
+    assert await cache.get("a") == ("text/plain", b"0" * 10)
+
+    # b is least recently used and is evicted due to entry limit
+    await cache.set("c", "text/plain", b"0" * 5)
+    assert await cache.get("b") is None
+    assert await cache.get("c") is not None
+
+    # a is evicted due to byte limit
+    await cache.set("d", "text/plain", b"0" * 10)
+    assert await cache.get("a") is None
+
+    # too big to cache
+    await cache.set("e", "text/plain", b"0" * 30)
+    assert await cache.get("e") is None
+
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["bytes"] == 15
+    assert stats["hits"] == 2
+    assert stats["misses"] == 3
+    assert stats["evictions"] == 2
+
+
+@pytest.mark.anyio
+async def test_query_etag(client):
+    result_cache.clear()
+
+    path = "/api/v1/internal/dams/query"
+    params = {"State": "GA"}
+
+    response = await client.get(path, params=params)
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+
+    cached = await client.get(path, params=params)
+    assert cached.status_code == 200
+    assert cached.headers["etag"] == etag
+    assert cached.content == response.content
+
+    not_modified = await client.get(path, params=params, headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+
+    other = await client.get(path, params={"State": "AL"}, headers={"If-None-Match": etag})
+    assert other.status_code == 200
+    assert other.headers["etag"] != etag
@@ -0,0 +1,34 @@
+import pyarrow as pa
+
+from api.constants import DOMAINS, MULTI_VALUE_DOMAINS
+from api.lib.domains import unpack_domains
+
+
+def test_unpack_domains():
+    df = pa.Table.from_pydict(
+        {
+            "SARPID": pa.array(["d1", "d2", "d3", "d4"]),
+            "Hazard": pa.chunked_array([pa.array([-1, 1], type="int8"), pa.array([99, None], type="int8")]),
+            "HasNetwork": pa.array([True, False, True, None]),
+            "State": pa.array(["GA", "AL", "XX", "GA"]),
+            "FishHabitatPartnership": pa.array(["", "SARP", "SARP,EBTJV", None]),
+        }
+    )
+
+    unpacked = unpack_domains(df)
+
+    assert unpacked.column_names == df.column_names
+    assert unpacked["SARPID"].equals(df["SARPID"])
+
+    for field in ["Hazard", "HasNetwork", "State"]:
+        assert pa.types.is_dictionary(unpacked.schema.field(field).type)
+        expected = [DOMAINS[field].get(value, "") for value in df[field].to_pylist()]
+        assert unpacked[field].cast("string").to_pylist() == expected
+
+    lookup = MULTI_VALUE_DOMAINS["FishHabitatPartnership"]
+    assert unpacked["FishHabitatPartnership"].cast("string").to_pylist() == [
+        "",
+        lookup["SARP"],
+        f"{lookup['SARP']}, {lookup['EBTJV']}",
+        "",
+    ]
@@ -1,13 +1,21 @@
 from io import BytesIO
 from pathlib import Path
+import os
+import subprocess
+import sys
 import time
 from zipfile import ZipFile
 
 import numpy as np
+import pyarrow as pa
 from pyarrow.csv import read_csv
+from pyarrow.feather import write_feather
+import pyarrow.parquet as pq
 import pytest
 
-from api.constants import STATES
+from api.constants import DOMAINS, STATES
+from api.lib.domains import unpack_domains
+from api.lib.download import DOWNLOAD_BATCH_SIZE, evict_archives, write_download_zip
 from api.settings import CUSTOM_DOWNLOAD_DIR
 
 
@@ -154,3 +162,175 @@ async def test_large_download(client, barrier_type, state):
 
         for p in TMP_DIR.glob("*.zip"):
             p.unlink()
+
+
+@pytest.mark.anyio
+async def test_streamed_download(client):
+    response = await client.post("/api/v1/internal/dams/csv", params={"State": "VI", "stream": True})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/zip"
+
+    zip_filename = TMP_DIR / "dams-streamed.zip"
+    try:
+        with open(zip_filename, "wb") as out:
+            _ = out.write(response.read())
+
+        verify_zip_contents("dams", zip_filename)
+
+        df = extract_csv("dams", zip_filename)
+        assert np.array_equal(df.State.unique(), [STATES["VI"]])
+
+    finally:
+        zip_filename.unlink(missing_ok=True)
+
+
+# run in a separate process so that peak memory only reflects writing the zip file
+STREAM_SCRIPT = """
+from itertools import chain
+import resource
+import sys
+
+import pyarrow.dataset as ds
+
+from api.lib.domains import unpack_domains
+from api.lib.download import write_download_zip, DOWNLOAD_BATCH_SIZE
+
+dataset = ds.dataset(sys.argv[1], format="feather")
+batches = (unpack_domains(batch) for batch in dataset.to_batches(batch_size=DOWNLOAD_BATCH_SIZE))
+first = next(batches)
+
+start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+write_download_zip(sys.argv[2], "dams.csv", first.schema, chain([first], batches), "", "")
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start)
+"""
+
+# maximum increase in peak memory while writing the zip file, in KB; the CSV
+# for this table is over 400 MB
+MAX_STREAM_RSS_INCREASE = 100 * 1024
+
+
+def test_streamed_zip_memory(tmp_path):
+    size = 2_000_000
+    rng = np.random.default_rng(0)
+    data = {
+        "SARPID": pa.array([f"d{i}" for i in range(size)]),
+        "Name": pa.array(rng.choice(["", "Mill Dam", "Upper Lake Dam", "Smith Creek Dam"], size=size)),
+        "State": pa.array(rng.choice(list(STATES.keys()), size=size)),
+    }
+    for field in ["Hazard", "Construction", "Purpose", "Condition", "PassageFacility", "Feasibility"]:
+        data[field] = pa.array(rng.choice(list(DOMAINS[field].keys()), size=size).astype("int8"))
+
+    for i in range(10):
+        data[f"Metric{i}"] = pa.array(rng.random(size=size).astype("float32"))
+
+    dataset_filename = tmp_path / "dams.feather"
+    write_feather(pa.Table.from_pydict(data), dataset_filename, chunksize=DOWNLOAD_BATCH_SIZE)
+    del data
+
+    zip_filename = tmp_path / "dams.zip"
+    result = subprocess.run(
+        [sys.executable, "-c", STREAM_SCRIPT, str(dataset_filename), str(zip_filename)],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+
+    with ZipFile(zip_filename) as zf:
+        assert zf.getinfo("dams.csv").file_size > 400_000_000
+
+    assert int(result.stdout.strip().splitlines()[-1]) < MAX_STREAM_RSS_INCREASE
+
+
+@pytest.mark.anyio
+async def test_download_reuse(client):
+    params = {"State": "VI", "include_unranked": True}
+    try:
+        response = await client.post("/api/v1/internal/dams/csv", params=params)
+        assert response.status_code == 200
+        path = response.json()["path"]
+
+        zip_filename = CUSTOM_DOWNLOAD_DIR / "/".join(path.split("/")[-2:])
+        mtime = zip_filename.stat().st_mtime_ns
+
+        # identical request reuses the same archive
+        response = await client.post("/api/v1/internal/dams/csv", params=params)
+        assert response.json()["path"] == path
+        assert zip_filename.stat().st_mtime_ns >= mtime
+
+        response = await client.post("/api/v1/internal/dams/csv", params={"State": "VI"})
+        assert response.json()["path"] != path
+
+    finally:
+        for p in CUSTOM_DOWNLOAD_DIR.glob("*/*.zip"):
+            p.unlink()
+
+
+def test_evict_archives(tmp_path):
+    now = time.time()
+    for i, (size, age) in enumerate([(100, 3600), (100, 1800), (100, 600), (100, 0)]):
+        path = tmp_path / f"archive{i}"
+        path.mkdir()
+        filename = path / "dams.zip"
+        filename.write_bytes(b"0" * size)
+        os.utime(filename, (now - age, now - age))
+        os.utime(path, (now - age, now - age))
+
+    # least recently used archives are deleted first
+    assert evict_archives(tmp_path, max_bytes=250, retention_time=300) == [tmp_path / "archive0", tmp_path / "archive1"]
+
+    # recently used archives are retained even if over budget
+    assert evict_archives(tmp_path, max_bytes=0, retention_time=300) == [tmp_path / "archive2"]
+    assert [p.name for p in tmp_path.iterdir()] == ["archive3"]
+
+
+@pytest.mark.parametrize("format", ["parquet", "arrows"])
+def test_columnar_download(tmp_path, format):
+    # multi-value domains have different dictionaries in each batch
+    batches = [
+        unpack_domains(
+            pa.table(
+                {
+                    "SARPID": pa.array(["d2", "d1", "d3"]),
+                    "HUC12": pa.array(["030000000002", "030000000001", "030000000001"]),
+                    "Hazard": pa.array([1, 2, 0], type="int8"),
+                    "FishHabitatPartnership": pa.array(["ACFHP", "", "ACFHP,DARE"]),
+                }
+            )
+        ),
+        unpack_domains(
+            pa.table(
+                {
+                    "SARPID": pa.array(["d4"]),
+                    "HUC12": pa.array(["030000000003"]),
+                    "Hazard": pa.array([3], type="int8"),
+                    "FishHabitatPartnership": pa.array(["CFPF"]),
+                }
+            )
+        ),
+    ]
+
+    zip_filename = tmp_path / "dams.zip"
+    write_download_zip(zip_filename, f"dams.{format}", batches[0].schema, iter(batches), "", "", format)
+
+    with ZipFile(zip_filename) as zf:
+        assert {"README.txt", "TERMS_OF_USE.txt", "SARP_logo.png", f"dams.{format}"} == set(zf.namelist())
+        buffer = pa.BufferReader(zf.read(f"dams.{format}"))
+
+    if format == "parquet":
+        parquet_file = pq.ParquetFile(buffer)
+        # one row group per batch, in the same order as the batches
+        assert parquet_file.metadata.num_row_groups == 2
+        df = parquet_file.read()
+
+    else:
+        df = pa.ipc.open_stream(buffer).read_all()
+
+    assert df["SARPID"].to_pylist() == ["d2", "d1", "d3", "d4"]
+
+    assert pa.types.is_dictionary(df.schema.field("FishHabitatPartnership").type)
+    assert set(df["FishHabitatPartnership"].to_pylist()) == {
+        "Atlantic Coastal Fish Habitat Partnership",
+        "",
+        "Atlantic Coastal Fish Habitat Partnership, Driftless Area Restoration Effort",
+        "California Fish Passage Forum",
+    }
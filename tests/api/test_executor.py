@@ -0,0 +1,106 @@
+import asyncio
+from contextlib import AsyncExitStack
+import threading
+
+import pytest
+
+from api.internal.barriers.download import _release_after
+from api.lib.executor import AdmissionControl, admission, admit, load_in_thread
+from api.lib.lazy import LazyValue
+
+
+def test_admission_control():
+    control = AdmissionControl(max_requests=2, max_cost=100)
+
+    # a single request is always admitted, even if larger than max cost
+    assert control.try_acquire(1000)
+    assert not control.try_acquire(1)
+    control.release(1000)
+
+    assert control.try_acquire(60)
+    assert not control.try_acquire(50)
+    assert control.try_acquire(40)
+
+    # at max number of requests
+    assert not control.try_acquire(0)
+
+    control.release(60)
+    control.release(40)
+
+    stats = control.stats()
+    assert stats["requests"] == 0
+    assert stats["cost"] == 0
+    assert stats["admitted"] == 3
+    assert stats["rejected"] == 3
+
+
+@pytest.mark.anyio
+async def test_busy_response(client):
+    # simulate a request in progress that uses all of the budget
+    assert admission.try_acquire(admission.max_cost)
+
+    try:
+        response = await client.get("/api/v1/internal/dams/rank", params={"State": "GA"})
+        assert response.status_code == 503
+        assert int(response.headers["retry-after"]) > 0
+
+    finally:
+        admission.release(admission.max_cost)
+
+    response = await client.get("/api/v1/internal/dams/rank", params={"State": "GA"})
+    assert response.status_code == 200
+
+
+@pytest.mark.anyio
+async def test_streamed_body_admission():
+    requests = admission.stats()["requests"]
+
+    # streamed body is admitted until it is complete
+    stack = AsyncExitStack()
+    await stack.enter_async_context(admit(10))
+    body = _release_after(iter([b"a", b"b"]), stack)
+    assert await anext(body) == b"a"
+    assert admission.stats()["requests"] == requests + 1
+    assert [chunk async for chunk in body] == [b"b"]
+    assert admission.stats()["requests"] == requests
+
+    # closing again (by the background task) has no effect
+    await stack.aclose()
+    assert admission.stats()["requests"] == requests
+
+    # or until it is aborted
+    stack = AsyncExitStack()
+    await stack.enter_async_context(admit(10))
+    body = _release_after(iter([b"a", b"b"]), stack)
+    assert await anext(body) == b"a"
+    await body.aclose()
+    assert admission.stats()["requests"] == requests
+
+
+@pytest.mark.anyio
+async def test_load_in_thread():
+    started = threading.Event()
+    done = threading.Event()
+
+    def loader():
+        started.set()
+        done.wait(5)
+        return 1
+
+    # simulate warmup loading the value in another thread
+    handle = LazyValue("test", loader)
+    thread = threading.Thread(target=handle.load)
+    thread.start()
+    started.wait(5)
+
+    # event loop is not blocked while waiting for the value
+    task = asyncio.create_task(load_in_thread(handle))
+    await asyncio.sleep(0.05)
+    assert not task.done()
+
+    done.set()
+    assert await task == 1
+    thread.join()
+
+    assert handle.loaded
+    assert await load_in_thread(handle) == 1
@@ -0,0 +1,254 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from api.lib.indexes import (
+    build_unit_index,
+    build_filter_index,
+    build_query_cube,
+    build_search_index,
+    build_spatial_index,
+    UnitIndex,
+    FilterIndex,
+    QueryCube,
+    SearchIndex,
+    UnitSearchIndex,
+    SARPIDIndex,
+    SpatialIndex,
+    hash_strings,
+    hash_string,
+    INDEXED_UNIT_FIELDS,
+)
+from api.lib.extract import _construct_filter_expr
+from api.lib.geometry import parse_wkb_polygon, select_points
+
+
+def create_table(size=1000):
+    rng = np.random.default_rng(0)
+    data = {field: pa.array(rng.choice([f"{field}{i}" for i in range(10)], size=size)) for field in INDEXED_UNIT_FIELDS}
+    data["Ranked"] = pa.array(rng.random(size) > 0.5)
+    # sparse and dense values
+    data["GainMilesClass"] = pa.array(rng.choice([1, 2, 3, 4], size=size, p=[0.01, 0.29, 0.3, 0.4]))
+    # multi-value field
+    data["Trout"] = pa.array(rng.choice(["0", "1", "2", "1,2"], size=size))
+    data["lon"] = pa.array(rng.uniform(-100, -80, size=size))
+    data["lat"] = pa.array(rng.uniform(25, 40, size=size))
+    return pa.Table.from_pydict(data)
+
+
+def test_unit_index():
+    df = create_table()
+    index = UnitIndex(build_unit_index(df))
+    assert index.num_rows == len(df)
+
+    for unit_ids in [
+        {"State": ["State1"]},
+        {"State": ["State1", "State2", "State1"]},
+        {"HUC8": ["HUC81", "HUC82"], "COUNTYFIPS": ["COUNTYFIPS3"]},
+        {"HUC12": ["missing"]},
+    ]:
+        for ranked_only in [False, True]:
+            ix = np.zeros(len(df), dtype="bool")
+            for layer, ids in unit_ids.items():
+                ix = ix | pc.is_in(df[layer], pa.array(ids)).to_numpy(zero_copy_only=False)
+
+            if ranked_only:
+                ix = ix & df["Ranked"].to_numpy()
+
+            expected = np.flatnonzero(ix)
+
+            assert np.array_equal(index.get_rows(unit_ids, ranked_only=ranked_only), expected)
+            assert index.count(unit_ids, ranked_only=ranked_only) == len(expected)
+
+
+def test_filter_index():
+    df = create_table()
+    index = FilterIndex(build_filter_index(df, ["GainMilesClass", "Trout"]))
+    assert index.num_rows == len(df)
+
+    for filters in [
+        {"GainMilesClass": ("in_array", [1])},
+        {"GainMilesClass": ("in_array", [1, 3])},
+        {"Trout": ("in_string", ["1"])},
+        {"GainMilesClass": ("in_array", [2, 4]), "Trout": ("in_string", ["2"])},
+    ]:
+        for ranked_only in [False, True]:
+            assert index.can_filter(filters, ranked_only=ranked_only)
+
+            expr = _construct_filter_expr({}, filters, ranked_only=ranked_only)
+            expected = df.append_column("_row", pa.array(np.arange(len(df)))).filter(expr)["_row"].to_numpy()
+
+            assert np.array_equal(index.get_rows(filters, ranked_only=ranked_only), expected)
+            assert index.count(filters, ranked_only=ranked_only) == len(expected)
+
+            # limit to a subset of rows
+            rows = np.arange(0, len(df), 3, dtype="uint32")
+            assert np.array_equal(
+                index.get_rows(filters, ranked_only=ranked_only, rows=rows), np.intersect1d(rows, expected)
+            )
+
+
+def test_query_cube():
+    df = create_table()
+    fields = ["GainMilesClass", "Trout"]
+    cube = QueryCube(build_query_cube(df, fields, ranked_only=True))
+    assert cube.num_rows == len(df)
+
+    for unit_ids, filters in [
+        ({"State": pa.array(["State1", "State2"])}, {}),
+        ({"HUC8": pa.array(["HUC81"]), "COUNTYFIPS": pa.array(["COUNTYFIPS3"])}, {"Trout": ("in_string", ["1"])}),
+        ({}, {"GainMilesClass": ("in_array", [2, 4])}),
+        ({"HUC12": pa.array(["missing"])}, {}),
+    ]:
+        assert cube.can_query(unit_ids, filters, fields, ranked_only=True)
+        assert not cube.can_query(unit_ids, filters, fields, ranked_only=False)
+
+        counts, bounds, num_records = cube.query(_construct_filter_expr(unit_ids, filters), fields)
+
+        records = df.append_column("_row", pa.array(np.arange(len(df)))).filter(
+            _construct_filter_expr(unit_ids, filters, ranked_only=True)
+        )
+        expected = records.group_by(fields).aggregate([("_row", "count"), ("_row", "min")]).sort_by("_row_min")
+
+        assert num_records == len(records)
+        assert counts.select(fields).equals(expected.select(fields))
+        assert counts["_count"].to_pylist() == expected["_row_count"].to_pylist()
+        assert bounds == [
+            pc.min(records["lon"]).as_py(),
+            pc.min(records["lat"]).as_py(),
+            pc.max(records["lon"]).as_py(),
+            pc.max(records["lat"]).as_py(),
+        ]
+
+
+def test_search_index():
+    rng = np.random.default_rng(0)
+    words = np.array(["Mill", "Creek", "Big", "Little", "Millstone", "Lake", "O'Neil", "Río", "Dam,", "#2"])
+    keys = [" ".join(rng.choice(words, size=rng.integers(0, 5))) for _ in range(5000)]
+    keys[:3] = [None, "", "Mill\tCreek"]
+    df = pa.Table.from_pydict({"search_key": pa.array(keys)})
+
+    index = SearchIndex(build_search_index(df))
+    assert index.num_rows == len(df)
+
+    for prefix, substrings, filter in [
+        ("mill", [], r"(^|\s)mill"),
+        ("mi", ["creek"], r"(^|\s)mi(((\s)+(\s|\S|\d)*)|(\s))+creek"),
+        ("big", ["ill", "2"], r"(^|\s)big(((\s)+(\s|\S|\d)*)|(\s))+ill(((\s)+(\s|\S|\d)*)|(\s))+\#2"),
+        ("río", [], r"(^|\s)río"),
+        ("", ["lake"], r"(^|\s)(((\s)+(\s|\S|\d)*)|(\s))+lake"),
+        ("missing", [], r"(^|\s)missing"),
+    ]:
+        batches = list(index.iter_rows(prefix, substrings, batch_size=100))
+        rows = np.concatenate(batches) if batches else np.empty(0, dtype="uint32")
+        assert np.array_equal(rows, np.unique(rows))
+
+        expected = np.flatnonzero(
+            pc.match_substring_regex(df["search_key"], filter, ignore_case=True).fill_null(False).to_numpy()
+        )
+
+        # rows must include all that match the query
+        assert np.isin(expected, rows).all()
+
+        if not substrings:
+            assert np.array_equal(rows, expected)
+
+
+def test_unit_search_index():
+    rng = np.random.default_rng(0)
+    words = np.array(["Mill", "Creek", "Big", "Little", "Lake", "O'Neil", "Río", "Saint", "Ñame", "2"])
+    names = [" ".join(rng.choice(words, size=rng.integers(1, 4))) for _ in range(2000)]
+    df = pa.Table.from_pydict(
+        {
+            "layer": rng.choice(["State", "County", "HUC12"], size=len(names)),
+            "name": names,
+            "key": [name.replace("'", "") for name in names],
+            "priority": rng.integers(0, 3, size=len(names)).astype("uint8"),
+            "state": rng.choice(["GA", "AL", "TX"], size=len(names)),
+        }
+    )
+
+    index = UnitSearchIndex(df)
+
+    for layers, query in [
+        (["County"], "mill"),
+        (["County", "State"], "E"),
+        (["HUC12"], "little lake"),
+        (["HUC12", "County"], "RÍO"),
+        (["State"], "ñ"),
+        (["State"], "oneil"),
+        (["County"], ""),
+        (["HUC12"], "missing"),
+        (["HUC8"], "mill"),
+    ]:
+        rows, count = index.search(layers, query, limit=10)
+
+        is_match = pc.and_(
+            pc.is_in(df["layer"], pa.array(layers)), pc.match_substring(df["key"], query, ignore_case=True)
+        )
+        expected = (
+            df.append_column("_row", pa.array(np.arange(len(df))))
+            .append_column("name_ipos", pc.find_substring(df["key"], query, ignore_case=True))
+            .append_column("name_len", pc.utf8_length(df["name"]))
+            .filter(is_match)
+            .sort_by(
+                [
+                    ("priority", "ascending"),
+                    ("name_ipos", "ascending"),
+                    ("name_len", "ascending"),
+                    ("state", "ascending"),
+                ]
+            )
+        )
+
+        assert count == len(expected)
+        assert rows.tolist() == expected["_row"].to_pylist()[:10]
+
+
+def test_sarpid_index():
+    sarpids = pa.chunked_array([["d1", "d2", "f3", None], ["f3", "Río", "", "d10"]])
+    index = SARPIDIndex(sarpids)
+
+    assert index.num_rows == len(sarpids)
+    assert hash_strings(sarpids).tolist() == [hash_string(value or "") for value in sarpids.to_pylist()]
+
+    assert index.get_rows("d1").tolist() == [0]
+    assert index.get_rows("d10").tolist() == [7]
+    assert index.get_rows("f3").tolist() == [2, 4]
+    assert index.get_rows("Río").tolist() == [5]
+    assert index.get_rows("").tolist() == [6]
+    assert index.get_rows("d").tolist() == []
+
+
+def test_spatial_index():
+    df = create_table(size=5000)
+    index = SpatialIndex(build_spatial_index(df, node_size=4))
+    assert index.num_rows == len(df)
+
+    x = df["lon"].to_numpy().astype("float32")
+    y = df["lat"].to_numpy().astype("float32")
+
+    bbox = (-95, 30, -90, 35)
+    expected = np.flatnonzero(select_points(x, y, "in_bbox", bbox))
+    assert len(expected) > 0
+    assert np.array_equal(index.get_rows("in_bbox", bbox), expected)
+
+    # little-endian WKB polygon with a hole
+    wkb = "01030000000200000004000000"
+    for x_, y_ in [(-100, 25), (-80, 30), (-90, 40), (-100, 25)]:
+        wkb += np.array([x_, y_], dtype="<f8").tobytes().hex()
+    wkb += "05000000"
+    for x_, y_ in [(-92, 30), (-88, 30), (-88, 33), (-92, 33), (-92, 30)]:
+        wkb += np.array([x_, y_], dtype="<f8").tobytes().hex()
+
+    rings = parse_wkb_polygon(wkb)
+    assert len(rings) == 2
+    expected = np.flatnonzero(select_points(x, y, "in_polygon", rings))
+    assert np.array_equal(index.get_rows("in_polygon", rings), expected)
+
+    # points in the hole are excluded
+    in_hole = select_points(x, y, "in_bbox", (-91.9, 30.1, -88.1, 32.9))
+    assert in_hole.any()
+    assert not np.isin(np.flatnonzero(in_hole), expected).any()
+
+    assert len(index.get_rows("in_bbox", (0, 0, 1, 1))) == 0
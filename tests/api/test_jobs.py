@@ -0,0 +1,168 @@
+import asyncio
+import threading
+
+from arq.constants import in_progress_key_prefix
+from arq.worker import func
+import pyarrow as pa
+import pytest
+
+from api.constants import FullySupportedBarrierTypes, Formats, Scenarios
+from api.internal.barriers.download import custom_download_task, get_download_progress
+from api.lib.download import DownloadCancelled, extract_download_batches, extract_for_download
+from api.lib.jobs import POLL_PREFIX, JOB_DELAY, enqueue_download_job, get_job_score, get_queue_position, set_job_polled
+from api.settings import DOWNLOAD_FAST_LANE_RECORDS, REDIS_QUEUE
+from api.worker import DownloadWorker
+
+
+LARGE = DOWNLOAD_FAST_LANE_RECORDS + 1
+
+
+def test_get_job_score():
+    now = 1_700_000_000_000
+
+    # small jobs are ordered before large jobs enqueued earlier
+    assert get_job_score(now, 10, 0) < get_job_score(now - 1000, LARGE, 0)
+
+    # jobs of clients that already have jobs are ordered after those of other clients
+    assert get_job_score(now, 10, 1) > get_job_score(now + 1000, 10, 0)
+    assert get_job_score(now, 10, 1) - get_job_score(now, 10, 0) == JOB_DELAY
+
+    # jobs are never deferred
+    assert get_job_score(now, LARGE, 1000) <= now
+
+
+@pytest.mark.anyio
+async def test_queue_position(redis):
+    await enqueue_download_job(redis, "large", LARGE, "a")
+    await enqueue_download_job(redis, "second", 10, "a")
+    await enqueue_download_job(redis, "small", 10, "b")
+
+    assert [id.decode() for id in await redis.zrange(REDIS_QUEUE, 0, -1)] == ["small", "large", "second"]
+    assert await get_queue_position(redis, "small") == 0
+    assert await get_queue_position(redis, "second") == 2
+
+    # jobs in progress are not counted
+    await redis.set(f"{in_progress_key_prefix}small", b"1")
+    assert await get_queue_position(redis, "second") == 1
+
+
+@pytest.mark.anyio
+async def test_download_worker(redis):
+    async def custom_download_task(ctx, **kwargs):
+        await asyncio.sleep(10)
+
+    for i in range(3):
+        await enqueue_download_job(redis, f"large-{i}", LARGE, "a")
+
+    worker = DownloadWorker(
+        functions=[func(custom_download_task, name="custom_download_task")],
+        redis_pool=redis,
+        queue_name=REDIS_QUEUE,
+        max_jobs=4,
+    )
+
+    try:
+        await worker.start_jobs(await redis.zrange(REDIS_QUEUE, 0, -1))
+
+        # one slot is reserved for small jobs
+        assert set(worker.tasks) == {"large-0", "large-1", "large-2"}
+
+        # enqueue in order without scoring, so that jobs of client a are first
+        for job_id, client in [("small-a-0", "a"), ("small-a-1", "a"), ("small-b", "b")]:
+            await redis.enqueue_job(
+                "custom_download_task", record_count=10, client=client, _job_id=job_id, _queue_name=REDIS_QUEUE
+            )
+
+        await worker.start_jobs(await redis.zrange(REDIS_QUEUE, 0, -1))
+
+        # client b gets the remaining slot, because client a has more than its share
+        assert set(worker.tasks) == {"large-0", "large-1", "large-2", "small-b"}
+
+    finally:
+        for task in worker.tasks.values():
+            task.cancel()
+
+        await asyncio.gather(*worker.tasks.values(), return_exceptions=True)
+
+
+@pytest.mark.anyio
+async def test_cancel_job(client, redis):
+    await enqueue_download_job(redis, "first", 10, "a")
+    await enqueue_download_job(redis, "second", 10, "b")
+
+    # the job is shared with another client that is still waiting for it
+    await set_job_polled(redis, "first", "other")
+    response = await client.post("/api/v1/internal/downloads/cancel/first")
+    assert response.json() == {"status": "detached"}
+    assert await get_queue_position(redis, "second") == 1
+
+    await redis.delete(f"{POLL_PREFIX}first")
+    response = await client.post("/api/v1/internal/downloads/cancel/first")
+    assert response.json() == {"status": "cancelling"}
+
+    # cancelled jobs are not counted in the queue position
+    assert await get_queue_position(redis, "second") == 0
+
+    response = await client.post("/api/v1/internal/downloads/cancel/unknown-job")
+    assert response.status_code == 404
+
+
+def test_cancel_extract():
+    cancel = threading.Event()
+    cancel.set()
+
+    with pytest.raises(DownloadCancelled):
+        extract_for_download(
+            "dams",
+            unit_ids={"State": pa.array(["GA"])},
+            filters={},
+            columns=["id", "SARPID"],
+            ranked_only=False,
+            custom_rank=False,
+            sort="NCWC",
+            cancel=cancel,
+        )
+
+
+def test_extract_progress():
+    rows_written = []
+    _, batches = extract_download_batches(
+        "dams",
+        unit_ids={"State": pa.array(["GA"])},
+        filters={},
+        columns=["id", "SARPID"],
+        ranked_only=False,
+        custom_rank=False,
+        sort="NCWC",
+        batch_size=100,
+        progress=rows_written.append,
+    )
+
+    # progress is reported after each batch is consumed
+    total = 0
+    for batch in batches:
+        assert (rows_written[-1] if rows_written else 0) == total
+        total += len(batch)
+
+    assert rows_written[-1] == total
+    assert rows_written == sorted(rows_written)
+
+    assert get_download_progress(total // 2, total) == str(100 * (total // 2) // total)
+    assert get_download_progress(total, total) == "99"
+    assert get_download_progress(total, None) == "50"
+
+
+@pytest.mark.anyio
+async def test_cancel_abandoned_job(redis):
+    # status of job was never requested
+    with pytest.raises(DownloadCancelled):
+        await custom_download_task(
+            {"redis": redis, "job_id": "abandoned"},
+            FullySupportedBarrierTypes.dams,
+            {"State": pa.array(["XX"])},
+            {},
+            Formats.csv,
+            False,
+            True,
+            Scenarios.NCWC,
+        )
@@ -0,0 +1,69 @@
+import pytest
+
+from api.lib.metrics import (
+    Registry,
+    add_request_stat,
+    collect_request_stats,
+    merge_snapshots,
+    render_snapshot,
+    set_request_label,
+)
+
+
+def test_render_histogram():
+    registry = Registry()
+    histogram = registry.histogram("duration_seconds", "Duration", ["route"], [0.1, 1])
+    histogram.observe(("/a",), 0.05)
+    histogram.observe(("/a",), 0.5)
+    histogram.observe(("/a",), 5)
+
+    text = render_snapshot(registry.snapshot())
+    assert "# TYPE duration_seconds histogram" in text
+    assert 'duration_seconds_bucket{route="/a",le="0.1"} 1' in text
+    assert 'duration_seconds_bucket{route="/a",le="1"} 2' in text
+    assert 'duration_seconds_bucket{route="/a",le="+Inf"} 3' in text
+    assert 'duration_seconds_sum{route="/a"} 5.55' in text
+    assert 'duration_seconds_count{route="/a"} 3' in text
+
+
+def test_merge_snapshots():
+    snapshots = []
+    for amount in (1, 2):
+        registry = Registry()
+        registry.counter("rows_total", "Rows", ["barrier_type"]).inc(("dams",), amount)
+        registry.histogram("duration_seconds", "Duration", [], [1]).observe((), amount)
+        snapshots.append(registry.snapshot())
+
+    merged = merge_snapshots(snapshots)
+    assert merged["rows_total"]["values"] == [[["dams"], 3]]
+    assert merged["duration_seconds"]["values"] == [[[], [1, 1, 3]]]
+
+
+def test_request_stats():
+    # no-op outside of a request
+    add_request_stat("rows_scanned", 10)
+
+    with collect_request_stats() as stats:
+        add_request_stat("rows_scanned", 10)
+        add_request_stat("rows_scanned", 5)
+        set_request_label("barrier_type", "dams")
+        set_request_label("barrier_type", "small_barriers")
+
+    assert stats == {"rows_scanned": 15, "barrier_type": "dams"}
+
+
+@pytest.mark.anyio
+async def test_metrics_endpoint(client):
+    response = await client.get("/api/v1/internal/dams/query", params={"State": "GA"})
+    assert response.status_code == 200
+
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert (
+        'api_request_duration_seconds_count{route="/api/v1/internal/{barrier_type}/query",method="GET",status="200"}'
+        in response.text
+    )
+    assert (
+        'api_bytes_serialized_total{route="/api/v1/internal/{barrier_type}/query",barrier_type="dams"}' in response.text
+    )
+    assert 'api_query_field_requests_total{barrier_type="dams",field="State"}' in response.text
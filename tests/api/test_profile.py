@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+import api.lib.profile
+from api.lib.profile import Profile, _profile, stage
+
+
+def test_stage():
+    # does nothing if request is not profiled
+    with stage("scan"):
+        pass
+
+    profile = Profile("GET", "/", "")
+    token = _profile.set(profile)
+    try:
+        with stage("scan"):
+            with stage("filter"):
+                pass
+
+    finally:
+        _profile.reset(token)
+
+    assert set(profile.stages.keys()) == {"scan", "scan;filter"}
+
+
+@pytest.mark.anyio
+async def test_profile_header(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(api.lib.profile, "PROFILE_TOKEN", "secret")
+    monkeypatch.setattr(api.lib.profile, "PROFILE_DIR", tmp_path)
+
+    # traces are only written by the logger created for the first profiled
+    # request of the process
+    for name in ["api.profile", "api.profile.stacks"]:
+        monkeypatch.setattr(api.lib.profile.logging.getLogger(name), "handlers", [])
+
+    response = await client.get("/api/v1/internal/dams/rank", params={"State": "GA"}, headers={"X-Profile": "wrong"})
+    assert response.status_code == 200
+    assert "x-profile-id" not in response.headers
+
+    # use a different request than above, which would be served from the result cache
+    response = await client.get(
+        "/api/v1/internal/dams/rank", params={"State": "GA,AL"}, headers={"X-Profile": "secret"}
+    )
+    assert response.status_code == 200
+
+    traces = [json.loads(line) for line in (tmp_path / "slow_requests.jsonl").read_text().splitlines()]
+    assert len(traces) == 1
+    assert traces[0]["id"] == response.headers["x-profile-id"]
+    assert traces[0]["route"] == "/api/v1/internal/{barrier_type}/rank"
+    assert "scan" in traces[0]["stages"]
@@ -0,0 +1,70 @@
+import asyncio
+import json
+from time import time
+
+from arq.constants import in_progress_key_prefix, job_key_prefix, result_key_prefix
+from arq.jobs import serialize_result
+import pytest
+
+from api.lib.progress import get_progress, set_progress
+from api.settings import REDIS_QUEUE
+
+
+JOB_ID = "test-job"
+
+
+async def run_job(redis):
+    """Simulate the worker running the job and publishing progress"""
+    await asyncio.sleep(0.1)
+    await redis.set(f"{in_progress_key_prefix}{JOB_ID}", b"1")
+    await set_progress(redis, JOB_ID, 50, "Creating zip file")
+
+    await asyncio.sleep(0.1)
+    now = int(time() * 1000)
+    result = serialize_result(
+        "custom_download_task", (), {}, 1, now, True, f"{JOB_ID}/dams.zip", now, now, JOB_ID, REDIS_QUEUE, JOB_ID
+    )
+    await redis.set(f"{result_key_prefix}{JOB_ID}", result)
+    await redis.delete(f"{job_key_prefix}{JOB_ID}", f"{in_progress_key_prefix}{JOB_ID}")
+    await redis.zrem(REDIS_QUEUE, JOB_ID)
+    await set_progress(redis, JOB_ID, 100, "All done")
+
+
+@pytest.mark.anyio
+async def test_progress(redis):
+    pubsub = redis.pubsub()
+    await pubsub.subscribe(f"arq:job-progress:{JOB_ID}")
+
+    await set_progress(redis, JOB_ID, 50, "Creating zip file")
+    assert await get_progress(redis, JOB_ID) == (50, "Creating zip file")
+
+    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1)
+    while message is None:
+        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1)
+
+    assert message["data"] == b"50|Creating zip file"
+
+    await pubsub.aclose()
+
+
+@pytest.mark.anyio
+async def test_stream_job_status(client, redis):
+    await redis.enqueue_job("custom_download_task", _job_id=JOB_ID, _queue_name=REDIS_QUEUE)
+
+    response, _ = await asyncio.gather(client.get(f"/api/v1/internal/downloads/status/{JOB_ID}/stream"), run_job(redis))
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = [json.loads(line[len("data: ") :]) for line in response.text.splitlines() if line.startswith("data: ")]
+    assert events[0]["status"] == "queued"
+    assert events[0]["queue_position"] == 0
+    assert {"status": "in_progress", "progress": 50, "message": "Creating zip file"} in events
+    assert events[-1] == {"status": "success", "progress": 100, "path": f"/downloads/custom/{JOB_ID}/dams.zip"}
+
+    # polling endpoint returns the same final status
+    response = await client.get(f"/api/v1/internal/downloads/status/{JOB_ID}")
+    assert response.json() == events[-1]
+
+    response = await client.get("/api/v1/internal/downloads/status/unknown-job/stream")
+    events = [json.loads(line[len("data: ") :]) for line in response.text.splitlines() if line.startswith("data: ")]
+    assert [e["status"] for e in events] == ["not_found"]
@@ -0,0 +1,58 @@
+from io import BytesIO
+import zlib
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow.csv import write_csv
+
+from api.lib.domains import unpack_domains
+from api.lib.shards import build_state_shards, StateShards
+
+
+def read_parts(parts):
+    return b"".join(part if isinstance(part, bytes) else part.read_bytes() for part in parts)
+
+
+def test_state_shards(tmp_path):
+    rng = np.random.default_rng(0)
+    size = 1000
+    df = pa.Table.from_pydict(
+        {
+            "SARPID": pa.array([f"d{i}" for i in range(size)]),
+            "Name": pa.array(rng.choice(["", "Mill Dam", 'Dam "A", Upper'], size=size)),
+            "Hazard": pa.array(rng.choice([-1, 0, 1, 2], size=size).astype("int8")),
+            "HasNetwork": pa.array(rng.choice([True, False], size=size)),
+            "State": pa.array(rng.choice(["GA", "AL", "TX"], size=size)),
+        }
+    )
+
+    build_state_shards(df, tmp_path)
+    shards = StateShards(tmp_path)
+    assert shards.num_rows == size
+
+    for states in [["GA"], ["TX", "AL"], ["AL", "GA", "TX"], ["VI"]]:
+        # expected records are grouped by HasNetwork then by state
+        expected = unpack_domains(
+            df.append_column("_row", pa.array(np.arange(size)))
+            .filter(pc.is_in(df["State"], pa.array(states)))
+            .sort_by([("HasNetwork", "ascending"), ("State", "ascending"), ("_row", "ascending")])
+            .drop(["_row"])
+        )
+        stream = BytesIO()
+        write_csv(expected.rename_columns([c.lower() for c in expected.column_names]), stream)
+
+        parts, total_size, count = shards.get_parts(states)
+        data = read_parts(parts)
+        assert count == len(expected)
+        assert total_size == len(data)
+        assert data == stream.getvalue()
+
+        parts, total_size, count = shards.get_parts(states, gzip=True)
+        compressed = read_parts(parts)
+        assert total_size == len(compressed)
+
+        # must be a single gzip stream with valid checksum and size
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        assert decompressor.decompress(compressed) == data
+        assert decompressor.eof and not decompressor.unused_data
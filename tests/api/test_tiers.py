@@ -0,0 +1,65 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from api.lib.indexes import build_metric_ranks
+from api.lib.tiers import calculate_tiers, METRICS, METRIC_RANK_FIELDS
+
+
+def test_grouped_tiers():
+    rng = np.random.default_rng(0)
+    size = 1000
+    data = {"State": rng.choice(["GA", "AL", "VI"], size=size)}
+    for field in METRICS:
+        data[field] = rng.choice(rng.uniform(-1, 100, 25).round(1), size=size)
+
+    # all values are the same within this group
+    data["GainMiles"][data["State"] == "VI"] = 1.0
+    df = pa.Table.from_pydict(data)
+
+    tiers = calculate_tiers(df, group_field="State")
+    assert len(tiers) == len(df)
+
+    for state in ["GA", "AL", "VI"]:
+        ix = pc.equal(df["State"], state)
+        assert tiers.filter(ix).equals(calculate_tiers(df.filter(ix)))
+
+
+def test_tiers_from_ranks():
+    rng = np.random.default_rng(0)
+    size = 1000
+    data = {field: rng.choice(rng.uniform(-1, 100, 25).round(1), size=size) for field in METRICS}
+
+    # -0.0 and 0.0 are different unique values but sort as equal
+    data["GainMiles"][:10] = -0.0
+    data["GainMiles"][10:20] = 0.0
+    df = pa.Table.from_pydict(data)
+
+    ranks = build_metric_ranks(df, METRICS)
+    for field in ranks.schema:
+        df = df.append_column(field.with_name(METRIC_RANK_FIELDS[field.name]), ranks[field.name])
+
+    for ix in [np.arange(size), np.arange(5, size, 3), np.arange(15, size)]:
+        subset = df.take(ix)
+        assert calculate_tiers(subset).equals(calculate_tiers(subset.select(METRICS)))
+
+
+def test_grouped_tiers_signed_zeros():
+    rng = np.random.default_rng(0)
+    size = 1000
+    data = {"State": rng.choice(["GA", "AL", "VI"], size=size)}
+    for field in METRICS:
+        data[field] = rng.choice(rng.uniform(-1, 100, 25).round(1), size=size)
+
+    # -0.0 and 0.0 are different unique values but sort as equal; only GA
+    # has both
+    is_ga = data["State"] == "GA"
+    data["GainMiles"][np.flatnonzero(is_ga)[:10]] = -0.0
+    data["GainMiles"][np.flatnonzero(is_ga)[10:20]] = 0.0
+    data["GainMiles"][np.flatnonzero(data["State"] == "AL")[:10]] = 0.0
+    df = pa.Table.from_pydict(data)
+
+    tiers = calculate_tiers(df, group_field="State")
+    for state in ["GA", "AL", "VI"]:
+        ix = pc.equal(df["State"], state)
+        assert tiers.filter(ix).equals(calculate_tiers(df.filter(ix)))
@@ -0,0 +1,36 @@
+from io import BytesIO
+import random
+from zipfile import ZipFile, ZIP_DEFLATED
+
+import pytest
+
+from api.lib.zip import open_zip_entry, ParallelDeflate, ZIP_CHUNK_SIZE
+
+
+class _UnseekableBuffer(BytesIO):
+    # same as the response stream of streamed downloads
+    def seekable(self):
+        return False
+
+
+@pytest.mark.parametrize("threads", [2, 4])
+def test_parallel_deflate(threads):
+    rng = random.Random(0)
+    # compressible data spanning several chunks
+    words = [b"dam", b"culvert", b"bridge", b"ford", b"12345", b"-9999", b"\n"]
+    data = b",".join(rng.choice(words) for _ in range(3 * ZIP_CHUNK_SIZE // 5))
+    assert len(data) > 2 * ZIP_CHUNK_SIZE
+
+    out = _UnseekableBuffer()
+    with ZipFile(out, "w", compression=ZIP_DEFLATED, compresslevel=5) as zf:
+        with open_zip_entry(zf, "data.csv", threads=threads) as entry:
+            assert isinstance(entry._compressor, ParallelDeflate)
+            for i in range(0, len(data), 100_000):
+                entry.write(data[i : i + 100_000])
+
+        zf.writestr("README.txt", "readme")
+
+    with ZipFile(BytesIO(out.getvalue())) as zf:
+        assert zf.testzip() is None
+        assert zf.read("data.csv") == data
+        assert zf.getinfo("data.csv").compress_size < len(data) / 2
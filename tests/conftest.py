@@ -1,6 +1,8 @@
+from arq.connections import ArqRedis
 from httpx import ASGITransport, AsyncClient
 import pytest
 
+from api.lib.redis_pool import set_redis_pool
 from api.server import app
 
 
@@ -13,3 +15,19 @@ def anyio_backend():
 async def client_fixture():
     async with AsyncClient(transport=ASGITransport(app=app), base_url="http://localhost:5000") as client:
         yield client
+
+
+@pytest.fixture(name="redis")
+async def redis_fixture():
+    """Use a fake Redis for the shared connection pool, so that tests that use
+    background jobs do not require a running Redis server.
+    """
+    fakeredis = pytest.importorskip("fakeredis")
+
+    pool = ArqRedis(connection_pool=fakeredis.FakeAsyncRedis().connection_pool)
+    set_redis_pool(pool)
+
+    yield pool
+
+    set_redis_pool(None)
+    await pool.aclose()